@@ -0,0 +1,305 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import struct
+import socket
+import asyncio
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from AsyncResourceFile import AsyncResourceFile
+from ResourceRegistry import ResourceRegistry
+from FileIndex import FileIndex
+from FileCache import FileCache
+from ChecksumIndex import ChecksumIndex
+from RWLock import LockStats
+from Storage import PlainStorage, BlobStorage
+from Layout import makeLayout
+from BufferPool import buffers, tuneSocket
+from Log import log
+from Metrics import metrics
+from MainServer import prepareDirectory, CONSOLE_HELP
+from Protocol import OPERATIONS, BUSY, UNSUPPORTED, MAX_REQUEST_DATA, RANGE_REQUEST
+from Protocol import recvUploadOptionsAsync, packHeader, recvExactAsync, recvHeaderAsync, unpackListRequest, packList, unpackRange
+
+# AsyncMainServer
+# Motor alternativo del servidor basado en asyncio. En lugar de crear un hilo por
+# cada conexión, todas las conexiones se atienden como corrutinas en un solo ciclo
+# de eventos, y las operaciones bloqueantes sobre el disco se delegan a un executor
+# con un número acotado de hilos (workers).
+#
+# Habla exactamente el mismo protocolo que MainServer, por lo que client.py funciona
+# con ambos motores sin cambios. Se selecciona al iniciar el servidor con
+# --engine asyncio. Al igual que MainServer, responde 'b' (busy) cuando se alcanza
+# el límite de operaciones simultáneas de un tipo (opLimits).
+class AsyncMainServer:
+    def __init__(self,host=socket.gethostname(),port=42069,handshakeTimeout=10,workers=32,opLimits=None,scan=True,cacheSize=0,cacheFileSize=0,fsync='none',dedup=False,layout='flat',socketBuffer=0):
+        self.HOST = host
+        self.PORT = port
+        self.handshakeTimeout = handshakeTimeout # Plazo (segundos) para recibir la petición
+        self.fsync = fsync # Sincronización con el disco de los uploads (FSYNC_LEVELS)
+        self.socketBuffer = socketBuffer # SO_SNDBUF/SO_RCVBUF de las conexiones (bytes, 0: del sistema)
+        self.resources = ResourceRegistry(lambda filename: AsyncResourceFile(filename, self)) # Recursos activos
+        self.lockStats = LockStats() # Tiempos de espera de los semáforos de los recursos
+        self.countID = 0 # Tasks' ID counter
+
+        # Límite de operaciones simultáneas por tipo (ls, up, dw, dl)
+        self.opLimits = {op: n for op, n in (opLimits or {}).items() if n}
+        self.activeOps = {op: 0 for op in OPERATIONS} # Contador de operaciones en curso
+        self.rejectedOps = {op: 0 for op in OPERATIONS} # Contador de rechazos por operación
+
+        self.executor = ThreadPoolExecutor(max_workers=workers) # Hilos para E/S de disco
+
+        # El ciclo de eventos y el evento de finalización se crean aquí y no en serve(),
+        # pues listen_for_closing (en otro hilo) puede usarlos antes de que el ciclo
+        # inicie
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+        self.stopEvent = asyncio.Event()
+
+        # Organización de los archivos en el directorio (LAYOUTS)
+        self.layout = makeLayout(layout, './recv')
+        prepareDirectory(self.layout)
+
+        # Almacenamiento de los archivos: copias independientes o por contenido
+        self.storage = BlobStorage(self.layout) if dedup else PlainStorage(self.layout)
+
+        # Caché de los archivos pequeños más descargados
+        self.cache = FileCache(cacheSize, cacheFileSize)
+
+        # Índice de los archivos en el sistema. Si scan es verdadero, se construye
+        # recorriendo el directorio
+        self.files = FileIndex(self.layout, scan)
+
+        # Índice persistente del SHA-256 de los archivos (./recv.checksums)
+        self.checksums = ChecksumIndex(self.layout.root)
+
+    # Método principal, inicia el programa. Se ejecuta hasta que listen_for_closing
+    # detiene el ciclo de eventos
+    def start(self):
+        try:
+            self.loop.run_until_complete(self.serve())
+        except OSError as e:
+            log.error('Service down. %s', e)
+        finally:
+            # Como asyncio.run: cancela las conexiones que siguen abiertas antes de
+            # cerrar el ciclo
+            tasks = asyncio.all_tasks(self.loop)
+            for task in tasks: task.cancel()
+            self.loop.run_until_complete(asyncio.gather(*tasks, return_exceptions=True))
+            self.loop.close()
+            self.executor.shutdown(wait=False)
+
+    async def serve(self):
+        # limit: datos que los streams acumulan antes de dejar de leer del socket, al
+        # menos un buffer de transferencia
+        server = await asyncio.start_server(self.handle, self.HOST, self.PORT, limit=max(buffers.size, 1 << 16))
+        # asyncio ya activa TCP_NODELAY en cada conexión; las aceptadas heredan los
+        # buffers del socket que escucha
+        for sock in server.sockets: tuneSocket(sock, self.socketBuffer)
+        log.info('Service started on %s, %s (asyncio engine). Ready to receive connections.', self.HOST, self.PORT)
+        print(CONSOLE_HELP)
+
+        async with server:
+            await self.stopEvent.wait()
+        log.info('Service down by petition.')
+
+    # Atiende una conexión, registrándola en las métricas (Metrics)
+    async def handle(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        log.debug('New connection received, connected by %s.', addr)
+        self.countID += 1
+        ID = self.countID
+        log.bind(ID, addr=addr)
+        metrics.begin()
+        try:
+            await self.attend(reader, writer, addr, ID)
+        except Exception:
+            metrics.outcome('error')
+            raise
+        finally:
+            metrics.end()
+
+    # Recibe el encabezado de la petición y ejecuta la corrutina correspondiente del
+    # recurso
+    async def attend(self, reader, writer, addr, ID):
+        try:
+            op, name, length = await recvHeaderAsync(reader, self.handshakeTimeout)
+        except socket.timeout:
+            log.warning('Handshake timeout, closing connection with %s.', addr)
+            metrics.outcome('timeout')
+            await self.close(writer)
+            return
+        except ConnectionError:
+            log.warning('Connection with %s closed before request.', addr)
+            metrics.outcome('lost')
+            await self.close(writer)
+            return
+
+        if op not in OPERATIONS:
+            log.warning('Unknown operation from %s, closing connection.', addr)
+            metrics.outcome('invalid')
+            await self.close(writer)
+            return
+        log.update(op=op, file=name)
+        metrics.operation(op)
+
+        # Las sesiones y los paquetes solo los atiende el motor de hilos (MainServer)
+        if op in ('ss', 'bu', 'bd'):
+            log.info('Operation %s requested by %s, not supported by this engine.', op, addr)
+            metrics.outcome('unsupported')
+            writer.write(UNSUPPORTED)
+            await self.close(writer)
+            return
+
+        # Admission control
+        if op in self.opLimits and self.activeOps[op] >= self.opLimits[op]:
+            self.rejectedOps[op] += 1
+            log.info('Server busy, rejected connection #%s from %s.', ID, addr)
+            metrics.outcome('busy')
+            writer.write(BUSY)
+            await self.close(writer)
+            return
+
+        self.activeOps[op] += 1
+        try:
+            if op == 'ls': # List
+                await self.listf(reader, writer, addr, ID, name, length)
+            else:
+                filename = self.layout.path(name)
+                # Busca y obtiene el recurso asociado al archivo
+                resource = self.getResource(filename)
+
+                try:
+                    if op == 'up': # Upload
+                        await resource.upload(reader, writer, addr, ID, length)
+                    elif op == 'dw': # Download
+                        # Descarga parcial: los datos de la petición indican el rango
+                        try:
+                            if length and not RANGE_REQUEST.size <= length <= MAX_REQUEST_DATA: raise struct.error
+                            offset, count, codecs, flags = unpackRange(await recvExactAsync(reader, length))
+                        except (struct.error, ConnectionError):
+                            log.warning('Invalid download range from %s, closing connection.', addr)
+                            metrics.outcome('invalid')
+                            await self.close(writer)
+                        else:
+                            await resource.download(reader, writer, addr, ID, offset, count, codecs, flags)
+                    elif op == 'dl': # Delete
+                        await resource.delete(reader, writer, addr, ID)
+                    elif op == 'ck': # Checksum
+                        await resource.checksum(reader, writer, addr, ID)
+                    elif op == 'ru': # Resumable upload
+                        await resource.resume(reader, writer, addr, ID, length)
+                    elif op == 'pu': # Part of a parallel upload
+                        await resource.part(reader, writer, addr, ID, length)
+                    elif op == 'pc': # Assemble a parallel upload
+                        await resource.assemble(reader, writer, addr, ID, length)
+                    elif op == 'hv': # Publish existing content
+                        await resource.have(reader, writer, addr, ID, length)
+                    elif op == 'dt': # Delta upload
+                        await resource.delta(reader, writer, addr, ID, length)
+                    elif op == 'zu': # Compressed and/or verified upload
+                        try:
+                            codecs, flags = await recvUploadOptionsAsync(reader)
+                        except ConnectionError:
+                            log.warning('Connection with %s lost before request.', addr)
+                            metrics.outcome('lost')
+                            await self.close(writer)
+                        else:
+                            await resource.upload(reader, writer, addr, ID, length, codecs, flags)
+                finally:
+                    self.releaseResource(resource)
+        finally:
+            self.activeOps[op] -= 1
+
+    # Estado del servidor: operaciones en curso y rechazos
+    def stats(self):
+        return {'active': dict(self.activeOps), 'rejected': dict(self.rejectedOps), 'resources': len(self.resources), 'files': len(self.files),
+                'locks': self.lockStats.snapshot(), 'storage': self.storage.stats(), 'layout': self.layout.stats(), 'cache': self.cache.stats(),
+                'buffers': buffers.stats(), 'checksums': self.checksums.stats()}
+
+    # Ejecuta una función bloqueante en el executor acotado del servidor
+    def run(self, func, *args):
+        return self.loop.run_in_executor(self.executor, func, *args)
+
+    # Cierra la conexión con el cliente, ignorando si ya estaba cerrada
+    async def close(self, writer):
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError: pass
+
+    # Provee el recurso para el archivo indicado en el parámetro (tomando una
+    # referencia). Si no existe, lo crea.
+    def getResource(self, filename):
+        return self.resources.acquire(filename)
+
+    # Libera la referencia al recurso; se elimina cuando nadie lo está utilizando
+    def releaseResource(self, resource):
+        return self.resources.release(resource)
+
+    # Envía la lista de archivos en el sistema al cliente, como una sola trama
+    # construida a partir de una copia del índice (snapshot)
+    async def listf(self, reader, writer, addr, ID, prefix, length):
+        try:
+            # Request (1)
+            if length > MAX_REQUEST_DATA:
+                log.warning('404 List Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+            try:
+                metadata, limit, cursor = unpackListRequest(await recvExactAsync(reader, length))
+            except struct.error:
+                log.warning('404 List Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+
+            names, nextCursor = self.files.page(prefix, cursor, limit)
+            body = packList(names, self.files.stat if metadata else None)
+
+            # Reply (2) y lista de archivos (3)
+            log.debug('Sending files list (%s files) to client in %s.', len(names), addr)
+            writer.write(b'y' + packHeader('ls', nextCursor, len(body)) + body)
+            await writer.drain()
+
+            # Confirmation (4)
+            reply = (await recvExactAsync(reader, 3)).decode('utf-8', 'replace')
+            if reply == '100':
+                log.info('100 List Successfull, sended file list to client in %s.', addr)
+                metrics.outcome('ok')
+            else:
+                log.warning('404 List Failed, client in %s reported error.', addr)
+                metrics.outcome('failed')
+        except ConnectionError:
+            log.warning('404 List Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.close(writer)
+
+    # Escucha de entrada para finalizar la ejecución del servidor. Se ejecuta en un
+    # hilo por separado, y detiene el ciclo de eventos desde ese hilo. La entrada
+    # 'stats' muestra el estado del servidor sin detenerlo, y 'rescan' reconstruye el
+    # índice de archivos (y vacía la caché). Con commands, las entradas se leen de ese
+    # archivo en lugar del teclado.
+    def listen_for_closing(self, commands=None):
+        while True:
+            command = (commands.readline() if commands else input()).strip()
+            if command == 'stats':
+                print(f'{datetime.now()} [Server] Stats: {self.stats()}')
+                continue
+            if command == 'rescan':
+                self.cache.clear()
+                print(f'{datetime.now()} [Server] File index rebuilt, {self.files.reconcile()} files found.')
+                continue
+            break
+        self.loop.call_soon_threadsafe(self.stopEvent.set)
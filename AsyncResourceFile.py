@@ -0,0 +1,618 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import fcntl
+import struct
+import hashlib
+import asyncio
+from functools import partial
+from os.path import isfile, basename
+from RWLock import AsyncRWLock
+from StagedFile import StagedFile, Multipart
+from ResourceFile import sliceLength, openedStat
+from Delta import blockSize, signatures
+from FileCache import openCached
+from Log import log
+from BufferPool import BUFFER_SIZE, buffers
+from Metrics import metrics, STATUS_OUTCOMES
+from Compression import CODECS, COMPRESS_BLOCK, MAX_FRAME, choose, compressible, compressBlock, decompressBlock
+from Protocol import BUSY, RESUME_OFFSET, PART_REQUEST, PART_UPLOAD, MAX_PART_TOTAL, PART_ASSEMBLE, DIGEST_SIZE, HAVE_REQUEST, HAVE_REPLACE
+from Protocol import STATUS_OK, STATUS_BAD_REQUEST, STATUS_NOT_FOUND, STATUS_EXISTS, STATUS_BUSY
+from Protocol import DELTA_SIGNATURE, DELTA_INSTRUCTION, DELTA_COPY, DELTA_DATA, DELTA_END
+from Protocol import RANGE_VERIFY, UPLOAD_VERIFY, CHECKSUM_REPLY, COMPRESSED_CHUNK, packHeader, recvExactAsync, fileDigest, pwriteAll
+
+# Lee n bytes de f y los agrega al SHA-256 digest
+def readHashed(f, n, digest):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError(f'File ended, expected {n - len(data)} more bytes.')
+    digest.update(data)
+    return data
+
+# AsyncResourceFile
+# Versión de ResourceFile para el motor asyncio (AsyncMainServer). Conserva el mismo
+# modelo de Lectores y Escritores en orden de llegada, las mismas banderas y el mismo
+# diálogo con el cliente, pero cada operación es una corrutina que trabaja sobre
+# streams (StreamReader/StreamWriter) y el semáforo es un AsyncRWLock.
+#
+# Toda operación bloqueante sobre el disco (open, read, write, remove, isfile) se
+# ejecuta en el executor acotado del servidor (server.run), de tal forma que el ciclo
+# de eventos nunca se detiene esperando al disco.
+class AsyncResourceFile:
+    def __init__(self, filename, server):
+        self.filename = filename # Nombre del archivo asociado a este recurso
+        self.name = basename(filename) # Nombre del archivo en el índice del servidor
+        self.server = server # Objeto del servidor
+
+        self.deleted = False # Bandera de eliminación
+        self.lock = AsyncRWLock(server.lockStats) # Semáforo de Lectores y Escritores
+        self.resuming = False # Bandera de upload reanudable en curso
+
+    # Download
+    # Mismos pasos que ResourceFile.download. El archivo se envía con loop.sendfile,
+    # que utiliza os.sendfile cuando el transporte lo permite, o comprimido por bloques
+    # en el executor. Con RANGE_VERIFY, el SHA-256 se toma del índice de checksums o se
+    # calcula mientras se envían los datos (ver ResourceFile.download); en ese caso el
+    # archivo se lee por bloques en el executor en lugar de usar loop.sendfile.
+    async def download(self, reader, writer, addr, ID, offset=0, count=0, codecs=(), flags=0):
+        log.debug('Preparing for download, trying to aquire resource...')
+        # Resource adquisition (I)
+        await self.lock.acquireRead()
+
+        log.debug('Resource Aquired.')
+
+        try:
+            # Checking file existence (II)
+            # Primero verifica que el archivo no haya sido eliminado anteriormente por
+            # una tarea delete()
+            if self.deleted or not await self.server.run(isfile, self.filename):
+                writer.write(b'n') # Reply (2)
+                await writer.drain()
+                log.warning("Download Failed, %s doesn't exist", self.filename)
+                metrics.outcome('not_found')
+            else:
+                # File send (III)
+                log.debug('File found. Waiting for confirmation to send...')
+                writer.write(b'y') # Reply (2)
+                await writer.drain()
+                # If exists in client, asks for sending (3)
+                send = (await recvExactAsync(reader, 1)).decode('utf-8', 'replace')
+                if send == 'n':
+                    log.info('Download Aborted by client in %s', addr)
+                    metrics.outcome('aborted')
+                else:
+                    # Sending file data (4)
+                    log.debug('Download Confirmed.')
+                    # Los archivos pequeños se envían desde la caché del servidor
+                    f, data = await self.server.run(openCached, self.server.cache, self.filename)
+                    try:
+                        total = await self.server.run(f.seek, 0, os.SEEK_END)
+                        size = sliceLength(total, offset, count)
+                        codec = choose(codecs) if codecs and await self.server.run(compressible, f, offset, size) else ''
+                        verify = flags & RANGE_VERIFY
+                        st = await self.server.run(openedStat, f) if verify and not offset and size == total else None
+                        digest = self.server.checksums.get(self.name, st) if st is not None else None
+                        hasher = hashlib.sha256() if verify and digest is None else None
+                        log.debug('Sending file to client in %s%s.', addr, f" ({codec})" if codec else "")
+                        writer.write(packHeader('dw', codec, size))
+                        await writer.drain()
+                        if codec:
+                            await self.sendCompressed(writer, f, size, offset, codec, hasher)
+                        elif data is not None:
+                            view = memoryview(data)[offset:offset + size]
+                            if hasher is not None: hasher.update(view)
+                            writer.write(view)
+                            await writer.drain()
+                        elif hasher is not None: await self.sendHashed(writer, f, size, offset, hasher)
+                        elif size: await asyncio.get_running_loop().sendfile(writer.transport, f, offset, size)
+                        if verify:
+                            if hasher is not None:
+                                digest = hasher.digest()
+                                if st is not None: await self.server.run(self.server.checksums.put, self.name, st, digest)
+                            writer.write(digest)
+                            await writer.drain()
+                    finally:
+                        await self.server.run(f.close)
+
+                    # Confirmation
+                    reply = (await recvExactAsync(reader, 3)).decode('utf-8', 'replace')
+                    if reply == '100':
+                        log.info('Download Successfull, %s sended to client in %s', self.filename, addr, bytes=size)
+                        metrics.outcome('ok', bytesOut=size)
+                    else:
+                        log.warning('Download Failed, client in %s reported error.', addr)
+                        metrics.outcome('failed')
+        except ConnectionError:
+            log.warning('Download Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.server.close(writer)
+
+            # Resource liberation (IV)
+            await self.lock.releaseRead()
+
+    # Upload
+    # Mismos pasos que ResourceFile.upload. Los datos se reciben del stream y se
+    # escriben en un archivo temporal (StagedFile) a través del executor; el recurso
+    # solo se adquiere para publicarlo.
+    async def upload(self, reader, writer, addr, ID, length, codecs=None, flags=0):
+        log.debug('Preparing for upload...')
+
+        try:
+            # Checking file existence (I)
+            replace = 'y'
+            codec = choose(codecs) if codecs is not None else ''
+            choice = packHeader('zu', codec) if codecs is not None else b''
+            if await self.server.run(isfile, self.filename):
+                writer.write(b'y' + choice) # Reply (2)
+                await writer.drain()
+                # Replace? (3)
+                replace = (await recvExactAsync(reader, 1)).decode('utf-8', 'replace')
+                if replace == 'n':
+                    log.info('Upload Aborted by client in %s', addr)
+                    metrics.outcome('aborted')
+            else:
+                writer.write(b'n' + choice) # Reply (2)
+                await writer.drain()
+
+            # Data receving (II)
+            if replace == 'y':
+                log.debug('Upload Confirmed.')
+                verify = bool(flags & UPLOAD_VERIFY)
+                hashing = verify or self.server.storage.hashing
+                staged = await self.server.run(partial(StagedFile, self.filename, self.server.fsync, hashing=hashing))
+                try:
+                    # Recibe los datos del archivo en el temporal (4), y el SHA-256 del cliente
+                    log.debug('Receiving file from client in %s%s.', addr, f" ({codec})" if codec else "")
+                    if codec:
+                        await self.recvCompressed(reader, staged, length, codec)
+                    else:
+                        remaining = length
+                        while remaining:
+                            data = await reader.read(min(remaining, buffers.size))
+                            if not data:
+                                raise ConnectionError(f'Connection closed, expected {remaining} more bytes.')
+                            await self.server.run(staged.write, data)
+                            remaining -= len(data)
+                    digest = await recvExactAsync(reader, DIGEST_SIZE) if verify else None
+                    await self.server.run(staged.finish)
+
+                    # Resource adquisition (III), publicación (IV) y liberation (V)
+                    await self.publish(staged, digest)
+                finally:
+                    await self.server.run(staged.discard)
+
+                # Confirmation (5)
+                writer.write(STATUS_OK)
+                await writer.drain()
+                log.info('Upload Successfull, stored %s from client in %s', self.filename, addr, bytes=length)
+                metrics.outcome('ok', bytesIn=length)
+        except ConnectionError:
+            log.warning('Upload Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        except ValueError as e:
+            writer.write(STATUS_BAD_REQUEST)
+            log.warning('Upload Failed, %s', e)
+            metrics.outcome('invalid')
+        finally:
+            await self.server.close(writer)
+
+    # Versiones de Compression.sendCompressed y recvCompressed: la compresión y la
+    # descompresión de cada bloque se ejecutan en el executor
+    async def sendCompressed(self, writer, f, length, offset, codec, digest=None):
+        await self.server.run(f.seek, offset)
+        compressor = CODECS[codec][0]()
+        remaining = length
+        while remaining:
+            n = min(remaining, COMPRESS_BLOCK)
+            remaining -= n
+            writer.write(await self.server.run(compressBlock, f, n, compressor, not remaining, digest))
+            await writer.drain()
+        writer.write(COMPRESSED_CHUNK.pack(0))
+        await writer.drain()
+
+    # Envía length bytes de f a partir de offset, por bloques leídos en el executor, y
+    # los agrega al SHA-256 digest
+    async def sendHashed(self, writer, f, length, offset, digest):
+        await self.server.run(f.seek, offset)
+        remaining = length
+        while remaining:
+            data = await self.server.run(readHashed, f, min(remaining, BUFFER_SIZE), digest)
+            remaining -= len(data)
+            writer.write(data)
+            await writer.drain()
+
+    async def recvCompressed(self, reader, f, length, codec):
+        decompressor = CODECS[codec][1]()
+        written = 0
+        while True:
+            n, = COMPRESSED_CHUNK.unpack(await recvExactAsync(reader, COMPRESSED_CHUNK.size))
+            if not n: break
+            if n > MAX_FRAME:
+                raise ValueError(f'Invalid compressed data: frame of {n} bytes.')
+            written += await self.server.run(decompressBlock, f, await recvExactAsync(reader, n), decompressor, length - written)
+        if written != length:
+            raise ValueError(f'Invalid compressed data: expected {length} bytes, got {written}.')
+
+    # Resume
+    # Mismos pasos que ResourceFile.resume. Como todas las tareas se ejecutan en el
+    # mismo hilo, basta una bandera para que solo una tarea a la vez continúe el upload.
+    async def resume(self, reader, writer, addr, ID, length):
+        log.debug('Preparing for resumable upload...')
+        if self.resuming:
+            writer.write(BUSY)
+            await self.server.close(writer)
+            log.info('Upload Rejected, %s is being uploaded by another client.', self.filename)
+            metrics.outcome('busy')
+            return
+
+        self.resuming = True
+        try:
+            staged = await self.server.run(StagedFile, self.filename, self.server.fsync, length)
+            try:
+                # Reply (2)
+                writer.write(b'y' + RESUME_OFFSET.pack(staged.offset))
+                await writer.drain()
+                log.debug('Receiving file from client in %s, from byte %s.', addr, staged.offset)
+
+                # Data receving (3)
+                received = remaining = length - staged.offset
+                while remaining:
+                    data = await reader.read(min(remaining, buffers.size))
+                    if not data:
+                        raise ConnectionError(f'Connection closed, expected {remaining} more bytes.')
+                    await self.server.run(staged.write, data)
+                    remaining -= len(data)
+                await self.server.run(staged.finish)
+
+                # Publicación (4)
+                await self.publish(staged)
+                writer.write(b'100')
+                await writer.drain()
+                log.info('Upload Successfull, stored %s from client in %s', self.filename, addr, bytes=received)
+                metrics.outcome('ok', bytesIn=received)
+            finally:
+                await self.server.run(staged.discard)
+        except ConnectionError:
+            log.warning('Upload Interrupted, connection with client in %s was lost. Received data is kept.', addr)
+            metrics.outcome('lost')
+        finally:
+            self.resuming = False
+            await self.server.close(writer)
+
+    # Part
+    # Mismos pasos que ResourceFile.part. Cada bloque recibido se escribe con os.pwrite
+    # en el executor.
+    async def part(self, reader, writer, addr, ID, length):
+        try:
+            upload, offset, total = PART_REQUEST.unpack(await recvExactAsync(reader, PART_REQUEST.size))
+            if not upload:
+                # New upload
+                try:
+                    if length or total > MAX_PART_TOTAL: raise ValueError
+                    multipart = await self.server.run(Multipart.create, self.filename, total)
+                except (ValueError, OSError):
+                    status = STATUS_BAD_REQUEST
+                else:
+                    writer.write(STATUS_OK + PART_UPLOAD.pack(multipart.upload))
+                    await writer.drain()
+                    log.debug('Part Upload of %s (%s bytes) created for client in %s.', self.filename, total, addr)
+                    metrics.outcome('ok')
+                    return
+            else:
+                log.debug('Receiving part of %s (%s bytes from byte %s) from client in %s.', self.filename, length, offset, addr)
+                multipart = Multipart(self.filename, upload)
+                try:
+                    await self.server.run(multipart.lock, fcntl.LOCK_SH)
+                except FileNotFoundError:
+                    status = STATUS_NOT_FOUND
+                except BlockingIOError:
+                    status = STATUS_BUSY
+                else:
+                    try:
+                        if total != await self.server.run(multipart.total) or offset + length > total:
+                            status = STATUS_BAD_REQUEST
+                        else:
+                            position, remaining = offset, length
+                            while remaining:
+                                data = await reader.read(min(remaining, 65536))
+                                if not data:
+                                    raise ConnectionError(f'Connection closed, expected {remaining} more bytes.')
+                                await self.server.run(pwriteAll, multipart.fd, data, position)
+                                position += len(data)
+                                remaining -= len(data)
+                            await self.server.run(multipart.record, offset, length)
+                            status = STATUS_OK
+                    finally:
+                        await self.server.run(multipart.unlock)
+
+            # Confirmation
+            writer.write(status)
+            await writer.drain()
+            if status == STATUS_OK:
+                metrics.outcome('ok', bytesIn=length)
+                if log.sampled('pu'): log.info('Part Upload Successfull, %s bytes from byte %s of %s.', length, offset, self.filename, bytes=length)
+            else:
+                log.warning('Part Upload Failed, part of %s from client in %s was rejected (%s).', self.filename, addr, status.decode())
+                metrics.outcome(STATUS_OUTCOMES[status])
+        except ConnectionError:
+            log.warning('Part Upload Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.server.close(writer)
+
+    # Assemble
+    # Mismos pasos que ResourceFile.assemble. El SHA-256 se calcula en el executor.
+    async def assemble(self, reader, writer, addr, ID, length):
+        try:
+            upload, digest = PART_ASSEMBLE.unpack(await recvExactAsync(reader, PART_ASSEMBLE.size))
+            multipart = Multipart(self.filename, upload)
+            try:
+                await self.server.run(multipart.lock, fcntl.LOCK_EX)
+            except FileNotFoundError:
+                status = STATUS_NOT_FOUND
+            except BlockingIOError:
+                status = STATUS_BUSY
+            else:
+                try:
+                    status = STATUS_BAD_REQUEST
+                    if await self.server.run(multipart.total) == length and await self.server.run(multipart.complete):
+                        staged = await self.server.run(StagedFile, self.filename, self.server.fsync, length, multipart.suffix)
+                        try:
+                            await self.server.run(staged.finish)
+                            if await self.server.run(fileDigest, staged.tempname) == digest:
+                                await self.publish(staged, digest)
+                                status = STATUS_OK
+                        finally:
+                            await self.server.run(staged.discard)
+                    await self.server.run(multipart.remove)
+                finally:
+                    await self.server.run(multipart.unlock)
+
+            writer.write(status)
+            await writer.drain()
+            if status == STATUS_OK:
+                log.info('Upload Successfull, assembled %s from client in %s', self.filename, addr, bytes=length)
+                metrics.outcome('ok')
+            else:
+                log.warning("Assemble Failed, upload of %s from client in %s was rejected (%s).", self.filename, addr, status.decode())
+                metrics.outcome(STATUS_OUTCOMES[status])
+        except ConnectionError:
+            log.warning('Assemble Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.server.close(writer)
+
+    # Have
+    # Mismos pasos que ResourceFile.have
+    async def have(self, reader, writer, addr, ID, length):
+        try:
+            if length != HAVE_REQUEST.size: raise struct.error
+            digest, flags = HAVE_REQUEST.unpack(await recvExactAsync(reader, length))
+
+            await self.lock.acquireWrite()
+            try:
+                if not await self.server.run(self.server.storage.has, digest):
+                    status = STATUS_NOT_FOUND
+                elif not flags & HAVE_REPLACE and await self.server.run(isfile, self.filename):
+                    status = STATUS_EXISTS
+                else:
+                    st = await self.server.run(self.server.storage.link, self.filename, digest)
+                    if st is None:
+                        status = STATUS_NOT_FOUND
+                    else:
+                        self.server.cache.invalidate(self.filename)
+                        self.server.files.add(self.name, st.st_size, st.st_mtime)
+                        await self.server.run(self.server.checksums.put, self.name, st, digest)
+                        self.deleted = False
+                        status = STATUS_OK
+            finally:
+                await self.lock.releaseWrite()
+
+            writer.write(status)
+            await writer.drain()
+            if status == STATUS_OK: log.info('Upload Successfull, %s linked to existing content, no data received.', self.filename)
+            else: log.info('Have: %s for %s.', status.decode(), self.filename)
+            metrics.outcome(STATUS_OUTCOMES.get(status, 'failed'))
+        except (struct.error, ConnectionError):
+            log.warning('Have Failed, invalid request from client in %s.', addr)
+            metrics.outcome('invalid')
+        finally:
+            await self.server.close(writer)
+
+    # Delta
+    # Mismos pasos que ResourceFile.delta. Las firmas se calculan, y los bloques se
+    # copian, en el executor.
+    async def delta(self, reader, writer, addr, ID, length):
+        log.debug('Preparing for delta upload...')
+
+        try:
+            # Checking file existence (I)
+            await self.lock.acquireRead()
+            try:
+                exists = not self.deleted and await self.server.run(isfile, self.filename)
+                basis = await self.server.run(open, self.filename, 'rb') if exists else None
+            finally:
+                await self.lock.releaseRead()
+            if basis is None:
+                writer.write(b'n') # Reply (2)
+                await writer.drain()
+                log.warning("Delta Upload Failed, %s doesn't exist.", self.filename)
+                metrics.outcome('not_found')
+                return
+
+            try:
+                # Reply (2) y Replace? (3)
+                writer.write(b'y')
+                await writer.drain()
+                if await recvExactAsync(reader, 1) == b'n':
+                    log.info('Upload Aborted by client in %s', addr)
+                    metrics.outcome('aborted')
+                    return
+
+                # Signatures (4)
+                size = os.fstat(basis.fileno()).st_size
+                block = blockSize(size)
+                writer.write(DELTA_SIGNATURE.pack(block, size) + await self.server.run(signatures, basis, block))
+                await writer.drain()
+                log.debug('Sent signatures of %s, receiving delta from client in %s.', self.filename, addr)
+
+                # Construcción del archivo (5)
+                staged = await self.server.run(partial(StagedFile, self.filename, self.server.fsync, hashing=True))
+                try:
+                    copied = await self.rebuild(reader, staged, basis.fileno(), block, size, length)
+                    await self.server.run(staged.finish)
+
+                    # Verificación y publicación (6)
+                    if copied is None:
+                        status = STATUS_BAD_REQUEST
+                        log.warning("Delta Upload Failed, delta from client in %s doesn't match %s.", addr, self.filename)
+                        metrics.outcome('invalid')
+                    else:
+                        await self.publish(staged, staged.digest.digest())
+                        status = STATUS_OK
+                        log.info('Upload Successfull, stored %s from client in %s (%s of %s bytes reused).', self.filename, addr, copied, length, bytes=length - copied)
+                        metrics.outcome('ok', bytesIn=length - copied)
+                finally:
+                    await self.server.run(staged.discard)
+                writer.write(status)
+                await writer.drain()
+            finally:
+                await self.server.run(basis.close)
+        except ConnectionError:
+            log.warning('Upload Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.server.close(writer)
+
+    # Mismos pasos que ResourceFile.rebuild
+    async def rebuild(self, reader, staged, fd, block, size, length):
+        written = copied = 0
+        while True:
+            kind, value = DELTA_INSTRUCTION.unpack(await recvExactAsync(reader, DELTA_INSTRUCTION.size))
+            if kind == DELTA_COPY and value * block < size:
+                data = await self.server.run(os.pread, fd, block, value * block)
+                if written + len(data) > length: return None
+                await self.server.run(staged.write, data)
+                written += len(data)
+                copied += len(data)
+            elif kind == DELTA_DATA and written + value <= length:
+                remaining = value
+                while remaining:
+                    data = await reader.read(min(remaining, buffers.size))
+                    if not data:
+                        raise ConnectionError(f'Connection closed, expected {remaining} more bytes.')
+                    await self.server.run(staged.write, data)
+                    remaining -= len(data)
+                written += value
+            elif kind == DELTA_END:
+                digest = await recvExactAsync(reader, DIGEST_SIZE)
+                return copied if written == length and staged.digest.digest() == digest else None
+            else:
+                return None
+
+    # Publica un archivo recibido (StagedFile) como Escritor upload, a través del
+    # almacenamiento del servidor. Si el SHA-256 no coincide con digest, lanza ValueError
+    # sin publicarlo. Regresa el SHA-256 (ver ResourceFile.publish)
+    async def publish(self, staged, digest=None):
+        received = staged.digest.digest() if staged.digest is not None else None
+        if digest is not None and received is not None and digest != received:
+            raise ValueError(f"SHA-256 of the received data doesn't match the client's, {self.filename} not published.")
+        digest = digest or received
+        await self.lock.acquireWrite()
+        try:
+            st = await self.server.run(self.server.storage.publish, staged, self.filename, digest)
+            self.server.cache.invalidate(self.filename)
+            self.server.files.add(self.name, st.st_size, st.st_mtime)
+            if digest is not None: await self.server.run(self.server.checksums.put, self.name, st, digest)
+        finally:
+            self.deleted = False
+            await self.lock.releaseWrite()
+        return digest
+
+    # Remove
+    # Mismos pasos que ResourceFile.delete
+    async def delete(self, reader, writer, addr, ID):
+        log.debug('Preparing for delete, trying to aquire resource...')
+        # Resource Adquisition (I)
+        await self.lock.acquireWrite()
+
+        try:
+            # File doesn't more exist (II) / Checking file existence (III)
+            if self.deleted or not await self.server.run(isfile, self.filename):
+                writer.write(b'n') # Reply (2)
+                await writer.drain()
+                log.warning("Delete Failed, %s doesn't exist.", self.filename)
+                metrics.outcome('not_found')
+            else:
+                writer.write(b'y') # Reply (2)
+                await writer.drain()
+                # Remove? (3)
+                log.debug('File found. Waiting for confirmation to delete...')
+                remove = (await recvExactAsync(reader, 1)).decode('utf-8', 'replace')
+                if remove == 'n':
+                    log.info('Delete Aborted, by client in %s', addr)
+                    metrics.outcome('aborted')
+                else:
+                    log.debug('Delete Confirmed.')
+                    # Delete file permanently (IV)
+                    await self.server.run(self.server.storage.remove, self.filename)
+                    self.server.cache.invalidate(self.filename)
+
+                    # Confirmation (4)
+                    writer.write(b'100')
+                    await writer.drain()
+                    log.info('Delete Successfull, %s was succesfully deleted.', self.filename)
+                    metrics.outcome('ok')
+
+                    # File list update (V)
+                    self.server.files.remove(self.name)
+                    await self.server.run(self.server.checksums.remove, self.name)
+
+                    # File deleted
+                    self.deleted = True
+        except ConnectionError:
+            log.warning('Delete Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.server.close(writer)
+
+            # Resource liberation (VI)
+            await self.lock.releaseWrite()
+
+    # Checksum
+    # Mismos pasos que ResourceFile.checksum; la consulta al índice (que puede leer el
+    # archivo) se ejecuta en el executor.
+    async def checksum(self, reader, writer, addr, ID):
+        await self.lock.acquireRead()
+        try:
+            result = not self.deleted and await self.server.run(self.server.checksums.checksum, self.name, self.filename)
+            if not result:
+                writer.write(b'n')
+                await writer.drain()
+                log.warning("Checksum Failed, %s doesn't exist", self.filename)
+                metrics.outcome('not_found')
+            else:
+                st, digest = result
+                writer.write(b'y' + CHECKSUM_REPLY.pack(st.st_size, st.st_mtime, digest))
+                await writer.drain()
+                log.info('Checksum Successfull, sended checksum of %s to client in %s', self.filename, addr)
+                metrics.outcome('ok')
+        except ConnectionError:
+            log.warning('Checksum Failed, connection with client in %s was lost.', addr)
+            metrics.outcome('lost')
+        finally:
+            await self.server.close(writer)
+            await self.lock.releaseRead()
@@ -0,0 +1,368 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.request
+from os.path import abspath, dirname, join
+from FTPClient import FTPClient, ServerBusy, RequestFailed
+
+# Benchmark
+# Pruebas de carga reproducibles del servidor. Inicia MainServer en un directorio
+# temporal (con --metrics-port), ejecuta las cargas de trabajo (WORKLOADS) con varios
+# clientes concurrentes (hilos con FTPClient) y escribe los resultados en JSON.
+#
+# Cada carga sube primero sus archivos (sin medirlo) y después cada cliente ejecuta ops
+# operaciones: un download con probabilidad reads, o un upload (reemplazando el
+# archivo), sobre un archivo elegido al azar. Los números aleatorios dependen solo de
+# --seed, por lo que dos ejecuciones hacen exactamente las mismas operaciones.
+#
+# Por cada carga se reporta el rendimiento (operaciones y MiB por segundo), la latencia
+# de cada operación (p50, p99, max) medida por los clientes, y la espera por los
+# semáforos de los archivos medida por el servidor (diferencia de sus métricas antes y
+# después de la carga). Con --processes, el servidor se ejecuta en modo pre-fork y se
+# suman las métricas de todos sus workers.
+#
+# Carga: (archivos, tamaño de cada uno, fracción de downloads, operaciones por cliente)
+# los tamaños y el número de operaciones se configuran por línea de comandos.
+WORKLOADS = ('small', 'huge', 'read-heavy', 'write-heavy', 'hot')
+
+def workloads(argv):
+    small, huge = argv.smallSize << 10, argv.hugeSize << 20
+    return {'small': (argv.smallFiles, small, 0.5, argv.ops),
+            'huge': (argv.hugeFiles, huge, 0.5, argv.hugeOps),
+            'read-heavy': (argv.files, argv.fileSize << 10, 0.9, argv.ops),
+            'write-heavy': (argv.files, argv.fileSize << 10, 0.1, argv.ops),
+            'hot': (1, argv.fileSize << 10, 0.5, argv.ops)} # Todos los clientes sobre el mismo archivo
+
+# Contenido de un archivo de size bytes: un bloque aleatorio repetido (generar size bytes
+# aleatorios tarda más que la carga misma en archivos grandes)
+def payload(size, seed):
+    block = random.Random(seed).randbytes(min(size, 1 << 20))
+    return (block * (size // len(block) + 1))[:size] if size else b''
+
+# Destino de los downloads: solo cuenta los bytes recibidos
+class Sink:
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+# Percentil p (0-100) de una lista ordenada, por rango más cercano
+def percentile(values, p):
+    if not values: return 0.0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values) + 0.5) - 1))]
+
+def latencies(values):
+    values = sorted(values)
+    return {'count': len(values),
+            'mean': round(sum(values) / len(values), 6) if values else 0.0,
+            'p50': round(percentile(values, 50), 6),
+            'p99': round(percentile(values, 99), 6),
+            'max': round(values[-1], 6) if values else 0.0}
+
+# Métricas del servidor (texto de Prometheus): {(nombre, etiquetas): valor}
+def scrape(port):
+    with urllib.request.urlopen(f'http://127.0.0.1:{port}/metrics', timeout=10) as response:
+        text = response.read().decode()
+    samples = {}
+    for line in text.splitlines():
+        if not line or line.startswith('#'): continue
+        key, value = line.rsplit(' ', 1)
+        name, _, labels = key.partition('{')
+        samples[name, tuple(sorted(l.split('=', 1)[0] + '=' + l.split('=', 1)[1].strip('"') for l in labels.rstrip('}').split(',') if l))] = float(value)
+    return samples
+
+# Espera por los semáforos durante la carga: diferencia entre dos lecturas de las
+# métricas. Por tipo de acceso (read / write): adquisiciones, espera media, cota
+# superior del p99 (límite del bucket) y máxima cota observada; por operación: espera y
+# tiempo de transferencia medios
+def lockReport(before, after):
+    delta = {key: value - before.get(key, 0) for key, value in after.items()}
+    def label(key, name):
+        return next((l.split('=', 1)[1] for l in key[1] if l.startswith(name + '=')), None)
+
+    report = {'acquire': {}, 'wait_by_op': {}, 'transfer_by_op': {}}
+    for mode in ('read', 'write'):
+        count = delta.get(('ftp_lock_acquire_seconds_count', (f'mode={mode}',)), 0)
+        total = delta.get(('ftp_lock_acquire_seconds_sum', (f'mode={mode}',)), 0)
+        buckets = sorted((float(label(k, 'le')), v) for k, v in delta.items()
+                         if k[0] == 'ftp_lock_acquire_seconds_bucket' and label(k, 'mode') == mode and label(k, 'le') != '+Inf')
+        p99 = next((le for le, n in buckets if n >= 0.99 * count), None) if count else 0.0
+        report['acquire'][mode] = {'count': int(count), 'mean': round(total / count, 6) if count else 0.0, 'p99_le': p99}
+
+    for metric, field in (('ftp_lock_wait_seconds', 'wait_by_op'), ('ftp_transfer_seconds', 'transfer_by_op')):
+        for key, count in delta.items():
+            if key[0] == f'{metric}_count' and count:
+                op = label(key, 'op')
+                total = delta.get((f'{metric}_sum', key[1]), 0)
+                report[field][op] = {'count': int(count), 'mean': round(total / count, 6)}
+    return report
+
+# Servidor en un directorio temporal. Se detiene enviando Enter a su entrada estándar.
+# Con processes > 1, cada worker publica sus métricas en el puerto siguiente al del
+# anterior
+class Server:
+    def __init__(self, engine, port, metricsPort, extra, processes=1):
+        self.root = tempfile.mkdtemp(prefix='ftpbench-')
+        self.port = port
+        self.metricsPorts = [metricsPort + i for i in range(processes)]
+        command = [sys.executable, join(dirname(abspath(__file__)), 'MainServer.py'), str(port), '-e', engine,
+                   '--metrics-port', str(metricsPort), '--log-level', 'warning'] + extra
+        if processes > 1: command += ['--processes', str(processes)]
+        self.process = subprocess.Popen(command, cwd=self.root, stdin=subprocess.PIPE,
+                                        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        self.wait()
+
+    # Espera a que el servidor acepte conexiones
+    def wait(self, timeout=15):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f'Server exited with code {self.process.returncode}.')
+            try:
+                socket.create_connection((socket.gethostname(), self.port), 1).close()
+                self.scrape()
+                return
+            except OSError:
+                time.sleep(0.1)
+        raise RuntimeError('Server did not start.')
+
+    # Métricas de todos los workers
+    def scrape(self):
+        samples = {}
+        for port in self.metricsPorts:
+            for key, value in scrape(port).items():
+                samples[key] = samples.get(key, 0) + value
+        return samples
+
+    def stop(self):
+        try:
+            self.process.communicate(b'\n', timeout=15)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+        shutil.rmtree(self.root, ignore_errors=True)
+
+# Puerto TCP libre en este equipo
+def freePort():
+    with socket.socket() as s:
+        s.bind(('', 0))
+        return s.getsockname()[1]
+
+# Ejecuta una carga: sube sus archivos y después ejecuta las operaciones de los
+# clientes. Regresa el reporte de la carga
+def run(name, spec, argv, server, seed):
+    files, size, reads, ops = spec
+    client = FTPClient(socket.gethostname(), server.port, argv.timeout, argv.verify)
+    names = [f'{name}-{i}.bin' for i in range(files)]
+    data = payload(size, seed)
+    for n in names:
+        client.upload(n, data)
+
+    results = [[] for _ in range(argv.clients)] # Por cliente: (op, latencia, bytes, resultado)
+    barrier = threading.Barrier(argv.clients + 1)
+    def worker(index):
+        rng = random.Random(f'{seed}-{name}-{index}')
+        plan = [('dw' if rng.random() < reads else 'up', rng.choice(names)) for _ in range(ops)]
+        barrier.wait()
+        for op, n in plan:
+            start = time.perf_counter()
+            try:
+                transferred = client.download(n, Sink()) if op == 'dw' else client.upload(n, data)
+                outcome = 'ok'
+            except ServerBusy:
+                transferred, outcome = 0, 'busy'
+            except (RequestFailed, OSError):
+                transferred, outcome = 0, 'error'
+            results[index].append((op, time.perf_counter() - start, transferred, outcome))
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(argv.clients)]
+    for t in threads: t.start()
+    before = server.scrape()
+    barrier.wait()
+    start = time.perf_counter()
+    for t in threads: t.join()
+    elapsed = time.perf_counter() - start
+    after = server.scrape()
+
+    samples = [r for rs in results for r in rs]
+    done = [r for r in samples if r[3] == 'ok']
+    transferred = sum(r[2] for r in done)
+    return {'workload': name,
+            'files': files,
+            'file_size': size,
+            'reads': reads,
+            'clients': argv.clients,
+            'ops': len(samples),
+            'ok': len(done),
+            'busy': sum(r[3] == 'busy' for r in samples),
+            'errors': sum(r[3] == 'error' for r in samples),
+            'seconds': round(elapsed, 6),
+            'throughput': {'ops_per_s': round(len(done) / elapsed, 3) if elapsed else 0.0,
+                           'mib_per_s': round(transferred / elapsed / (1 << 20), 3) if elapsed else 0.0},
+            'latency': {'all': latencies([r[1] for r in done]),
+                        **{op: latencies([r[1] for r in done if r[0] == op]) for op in ('up', 'dw')}},
+            'locks': lockReport(before, after)}
+
+# Versión del código (commit de git), si está disponible
+def version():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], cwd=dirname(abspath(__file__)),
+                              capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except OSError:
+        return None
+
+# ParseArgs() recibe los argumentos de ejecución desde línea de comandos.
+# py Benchmark.py [-w workloads] [-c clients] [-n ops] [-e threads|asyncio] [-o output]
+#                 [--seed N] [--small-files N] [--small-size KiB] [--huge-files N]
+#                 [--huge-size MiB] [--huge-ops N] [--files N] [--file-size KiB]
+#                 [--timeout seconds] [-p processes] [--server-args "..."] [--no-verify]
+def ParseArgs():
+    parser = argparse.ArgumentParser(description='Simple FTP Server benchmark')
+
+    parser.add_argument('-w','--workloads',
+                    default=','.join(WORKLOADS),
+                    help=f'Comma separated workloads to run ({", ".join(WORKLOADS)}).')
+
+    parser.add_argument('-c','--clients',
+                    type=int,
+                    default=8,
+                    help='Concurrent clients.')
+
+    parser.add_argument('-n','--ops',
+                    type=int,
+                    default=100,
+                    help='Operations per client (except the huge workload).')
+
+    parser.add_argument('-e','--engine',
+                    choices=['threads', 'asyncio'],
+                    default='threads',
+                    help='Server engine.')
+
+    parser.add_argument('-o','--output',
+                    default=None,
+                    help='Write the JSON report to this file instead of stdout.')
+
+    parser.add_argument('--seed',
+                    type=int,
+                    default=0,
+                    help='Seed of the file contents and of the operations of every client.')
+
+    parser.add_argument('--small-files',
+                    type=int,
+                    default=200,
+                    dest='smallFiles',
+                    help='Files of the small workload.')
+
+    parser.add_argument('--small-size',
+                    type=int,
+                    default=4,
+                    dest='smallSize',
+                    help='Size (KiB) of each file of the small workload.')
+
+    parser.add_argument('--huge-files',
+                    type=int,
+                    default=2,
+                    dest='hugeFiles',
+                    help='Files of the huge workload.')
+
+    parser.add_argument('--huge-size',
+                    type=int,
+                    default=64,
+                    dest='hugeSize',
+                    help='Size (MiB) of each file of the huge workload.')
+
+    parser.add_argument('--huge-ops',
+                    type=int,
+                    default=4,
+                    dest='hugeOps',
+                    help='Operations per client of the huge workload.')
+
+    parser.add_argument('--files',
+                    type=int,
+                    default=20,
+                    help='Files of the read-heavy and write-heavy workloads.')
+
+    parser.add_argument('--file-size',
+                    type=int,
+                    default=256,
+                    dest='fileSize',
+                    help='Size (KiB) of each file of the read-heavy, write-heavy and hot workloads.')
+
+    parser.add_argument('--timeout',
+                    type=float,
+                    default=60,
+                    help='Client socket timeout (seconds).')
+
+    parser.add_argument('-p','--processes',
+                    type=int,
+                    default=1,
+                    help='Server worker processes (pre-fork mode, threads engine).')
+
+    parser.add_argument('--server-args',
+                    default='',
+                    dest='serverArgs',
+                    help='Extra arguments for MainServer.py, e.g. "--fsync file --cache-size 0".')
+
+    parser.add_argument('--no-verify',
+                    action='store_false',
+                    dest='verify',
+                    help="Don't verify the SHA-256 of the transfers in the clients (measures only the server).")
+
+    argv = parser.parse_args()
+    unknown = set(argv.workloads.split(',')) - set(WORKLOADS)
+    if unknown: parser.error(f'unknown workloads: {", ".join(sorted(unknown))}')
+    return argv
+
+# Main
+if __name__ == '__main__':
+    argv = ParseArgs()
+    specs = workloads(argv)
+    server = Server(argv.engine, freePort(), freePort(), argv.serverArgs.split(), argv.processes)
+    try:
+        results = []
+        for name in argv.workloads.split(','):
+            print(f'[+] Running workload {name}...', file=sys.stderr)
+            results.append(run(name, specs[name], argv, server, argv.seed))
+    finally:
+        server.stop()
+
+    report = {'version': version(),
+              'python': platform.python_version(),
+              'platform': platform.platform(),
+              'cpus': os.cpu_count(),
+              'engine': argv.engine,
+              'processes': argv.processes,
+              'server_args': argv.serverArgs,
+              'verify': argv.verify,
+              'seed': argv.seed,
+              'results': results}
+    text = json.dumps(report, indent=2)
+    if argv.output:
+        with open(argv.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
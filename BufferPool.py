@@ -0,0 +1,124 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import socket
+import threading
+from contextlib import contextmanager
+
+# BufferPool
+# Conjunto de buffers (bytearray) reutilizables para las transferencias de archivos.
+#
+# Las funciones de Protocol reciben con recv_into directamente en un buffer prestado
+# (borrow) y escriben rebanadas de él (memoryview), en lugar de crear un objeto bytes
+# nuevo en cada recv. Al terminar la transferencia el buffer vuelve al conjunto, por lo
+# que un servidor ocupado reutiliza siempre los mismos buffers; se conservan hasta keep
+# buffers libres y los demás se liberan.
+#
+# El tamaño de los buffers (size) es el máximo de datos de cada recv_into y de cada
+# escritura al disco: la recepción llena el buffer con tantas lecturas como sean
+# necesarias antes de escribirlo, de tal forma que las escrituras son grandes aunque la
+# red entregue los datos en trozos pequeños, y cada recv_into pide todo el espacio
+# libre, tomando lo que el kernel ya tenga disponible.
+#
+# El tamaño de cada bloque se adapta a la transferencia: borrow(length) presta el
+# buffer más pequeño que contiene los length bytes, de entre tamaños que son potencias
+# de 2 desde MIN_BUFFER_SIZE hasta size. Así, las transferencias pequeñas (la mayoría
+# en un servidor con muchos archivos chicos) no ocupan un buffer de size bytes cada
+# una, y las grandes usan bloques de size bytes. El tamaño se elige al iniciar la
+# transferencia, solo por su longitud, y no cambia durante ella. Cada tamaño tiene sus
+# buffers libres.
+BUFFER_SIZE = 256 << 10 # Bytes
+MIN_BUFFER_SIZE = 16 << 10 # Bytes
+BUFFER_KEEP = 64 # Buffers libres que se conservan
+
+class BufferPool:
+    def __init__(self, size=BUFFER_SIZE, keep=BUFFER_KEEP):
+        self.size = size # Tamaño máximo de un buffer
+        self.keep = keep # Máximo de buffers libres
+        self.free = {} # Tamaño -> buffers libres de ese tamaño
+        self.freeCount = 0 # Total de buffers libres
+        self.lock = threading.Lock() # Semáforo para free y los contadores
+        self.allocated = 0 # Buffers creados
+        self.reused = 0 # Préstamos atendidos con un buffer libre
+
+    # Cambia el tamaño máximo de los buffers; los libres se descartan
+    def configure(self, size=BUFFER_SIZE, keep=BUFFER_KEEP):
+        with self.lock:
+            self.size = size
+            self.keep = keep
+            self.free.clear()
+            self.freeCount = 0
+
+    # Tamaño del buffer para una transferencia de length bytes (None: desconocida)
+    def sizeFor(self, length=None):
+        if length is None or length >= self.size: return self.size
+        size = MIN_BUFFER_SIZE
+        while size < length: size <<= 1
+        return min(size, self.size)
+
+    # Presta un buffer (como memoryview) para una transferencia de length bytes
+    # mientras dura el bloque 'with'
+    @contextmanager
+    def borrow(self, length=None):
+        with self.lock:
+            size = self.sizeFor(length)
+            free = self.free.get(size)
+            buffer = free.pop() if free else None
+            if buffer is None:
+                self.allocated += 1
+            else:
+                self.reused += 1
+                self.freeCount -= 1
+        if buffer is None: buffer = bytearray(size)
+        view = memoryview(buffer)
+        try:
+            yield view
+        finally:
+            view.release()
+            with self.lock:
+                # Los buffers de un tamaño anterior a configure() se liberan
+                if self.freeCount < self.keep and self.sizeFor(len(buffer)) == len(buffer):
+                    self.free.setdefault(len(buffer), []).append(buffer)
+                    self.freeCount += 1
+
+    def stats(self):
+        with self.lock:
+            return {'size': self.size, 'free': self.freeCount, 'allocated': self.allocated, 'reused': self.reused}
+
+buffers = BufferPool()
+
+# Opciones de una conexión TCP. TCP_NODELAY envía de inmediato los mensajes pequeños
+# del protocolo (encabezados, respuestas de un byte, confirmaciones), que de otra forma
+# esperan al ACK retardado del otro extremo (algoritmo de Nagle) en cada intercambio;
+# las transferencias no cambian, pues siempre se envían en bloques grandes. Con
+# bufferSize (bytes), fija SO_SNDBUF y SO_RCVBUF; sin él, el sistema operativo ajusta
+# los buffers del socket automáticamente.
+def tuneSocket(conn, bufferSize=0):
+    try:
+        conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        if bufferSize:
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, bufferSize)
+            conn.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, bufferSize)
+    except OSError:
+        pass # Conexión ya cerrada, o socket que no es TCP
+
+# Con cork, el kernel junta los envíos en segmentos completos hasta que se vuelve a
+# llamar sin cork, que envía lo pendiente (TCP_CORK, solo en Linux). Se usa al enviar
+# muchos mensajes pequeños seguidos, como los archivos de un paquete
+def corkSocket(conn, cork):
+    if hasattr(socket, 'TCP_CORK'):
+        try:
+            conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_CORK, int(cork))
+        except OSError:
+            pass
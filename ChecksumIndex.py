@@ -0,0 +1,152 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import struct
+import threading
+from Protocol import fileDigest
+from FileCache import fileIdentity
+
+# ChecksumIndex
+# Índice persistente del SHA-256 de los archivos del servidor, para responder la
+# operación checksum (ck) sin volver a leer el archivo.
+#
+# Los uploads calculan el SHA-256 mientras reciben los datos (StagedFile) y lo
+# registran al publicar el archivo (put). Cada entrada guarda la identidad de la
+# versión del archivo (inodo, fecha de modificación y tamaño, ver fileIdentity): la
+# entrada solo es válida mientras el archivo tiene esa identidad, por lo que un archivo
+# modificado desde fuera del servidor (o con un upload de otro proceso) nunca se
+# responde con un SHA-256 anterior. Los archivos sin entrada válida (p. ej. uploads
+# reanudables, o archivos copiados a mano) se leen una vez y se registran (checksum).
+#
+# El índice se guarda en un archivo junto al directorio de los archivos
+# (./recv.checksums) como un registro (journal) al que solo se agregan entradas, cada
+# una con una sola escritura (O_APPEND): CHECKSUM_RECORD seguido del nombre. Una
+# entrada con mtime CHECKSUM_REMOVED indica que el archivo se eliminó. Al iniciar el
+# servidor se lee completo, y se compacta (compactChecksums) si tiene muchas entradas
+# reemplazadas. En modo pre-fork todos los workers agregan al mismo archivo, y cada uno
+# lee las entradas nuevas de los demás (refresh) cuando no encuentra una entrada válida.
+CHECKSUM_SUFFIX = '.checksums'
+CHECKSUM_RECORD = struct.Struct('!HQqQ32s') # namelen, inodo, mtime (ns), tamaño, SHA-256
+CHECKSUM_REMOVED = -1
+
+class ChecksumIndex:
+    def __init__(self, root):
+        self.path = os.path.normpath(root) + CHECKSUM_SUFFIX # Archivo del índice
+        self.entries = {} # nombre -> (identidad, SHA-256)
+        self.offset = 0 # Bytes del archivo ya leídos
+        self.lock = threading.Lock() # Semáforo para entries y offset
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        self.hits = 0 # Consultas respondidas desde el índice
+        self.computed = 0 # SHA-256 calculados leyendo el archivo
+        self.refresh()
+
+    # Lee las entradas agregadas al archivo desde la última lectura
+    def refresh(self):
+        with self.lock:
+            self.offset = readRecords(self.path, self.offset, self.entries)
+
+    # SHA-256 registrado del archivo name, si corresponde a la versión con stat st
+    def get(self, name, st):
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry is not None and entry[0] == fileIdentity(st):
+            return entry[1]
+        return None
+
+    # Registra el SHA-256 de la versión del archivo name con stat st
+    def put(self, name, st, digest):
+        with self.lock:
+            self.entries[name] = (fileIdentity(st), digest)
+            os.write(self.fd, packRecord(name, st.st_ino, st.st_mtime_ns, st.st_size, digest))
+
+    def remove(self, name):
+        with self.lock:
+            self.entries.pop(name, None)
+            os.write(self.fd, packRecord(name, 0, CHECKSUM_REMOVED, 0, bytes(32)))
+
+    # Regresa (stat, SHA-256) del archivo filename (con nombre name en el índice), o
+    # None si no existe. Solo lee el archivo si el índice no tiene una entrada válida
+    def checksum(self, name, filename):
+        try:
+            st = os.stat(filename)
+        except FileNotFoundError:
+            return None
+        digest = self.get(name, st)
+        if digest is None:
+            self.refresh()
+            digest = self.get(name, st)
+        if digest is not None:
+            with self.lock:
+                self.hits += 1
+            return st, digest
+
+        digest = fileDigest(filename)
+        # Solo se registra si el archivo no cambió mientras se leía
+        if fileIdentity(os.stat(filename)) == fileIdentity(st):
+            self.put(name, st, digest)
+        with self.lock:
+            self.computed += 1
+        return st, digest
+
+    def close(self):
+        os.close(self.fd)
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'hits': self.hits, 'computed': self.computed}
+
+def packRecord(name, ino, mtime, size, digest):
+    name = name.encode('utf-8', 'surrogateescape')
+    return CHECKSUM_RECORD.pack(len(name), ino, mtime, size, digest) + name
+
+# Lee las entradas completas del archivo path a partir de offset y las aplica a
+# entries. Regresa la posición de la primera entrada no leída (una entrada incompleta
+# se está escribiendo y se leerá después)
+def readRecords(path, offset, entries):
+    try:
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read()
+    except FileNotFoundError:
+        return offset
+    position = 0
+    while position + CHECKSUM_RECORD.size <= len(data):
+        namelen, ino, mtime, size, digest = CHECKSUM_RECORD.unpack_from(data, position)
+        end = position + CHECKSUM_RECORD.size + namelen
+        if end > len(data): break
+        name = data[position + CHECKSUM_RECORD.size:end].decode('utf-8', 'surrogateescape')
+        if mtime == CHECKSUM_REMOVED: entries.pop(name, None)
+        else: entries[name] = ((ino, mtime, size), digest)
+        position = end
+    return offset + position
+
+# Reescribe el índice del directorio root solo con sus entradas vigentes, si las
+# reemplazadas son más de la mitad o si termina con una entrada incompleta (una caída
+# del sistema durante una escritura). Se ejecuta al iniciar el servidor, antes de que
+# algún proceso agregue entradas (el archivo se reemplaza con un rename). Regresa los
+# bytes eliminados
+def compactChecksums(root):
+    path = os.path.normpath(root) + CHECKSUM_SUFFIX
+    entries = {}
+    size = readRecords(path, 0, entries)
+    live = sum(CHECKSUM_RECORD.size + len(name.encode('utf-8', 'surrogateescape')) for name in entries)
+    total = os.path.getsize(path) if os.path.exists(path) else 0
+    if size <= 2 * live and size == total: return 0
+    temp = path + '.tmp'
+    with open(temp, 'wb') as f:
+        for name, ((ino, mtime, fsize), digest) in entries.items():
+            f.write(packRecord(name, ino, mtime, fsize, digest))
+    os.replace(temp, path)
+    return total - live
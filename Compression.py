@@ -0,0 +1,172 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import zlib
+from Protocol import COMPRESSED_CHUNK, recvExact
+
+# Compression
+# Compresión de los datos de un archivo mientras se transfieren (ver
+# Protocol.COMPRESSED_CHUNK). Los datos se comprimen por bloques de COMPRESS_BLOCK
+# bytes con un compresor incremental, por lo que nunca se tiene el archivo completo en
+# memoria.
+#
+# zlib siempre está disponible; lz4 y zstd solo si están instalados los paquetes lz4
+# y zstandard. CODECS tiene, por nombre, las funciones que crean el compresor (con
+# compress(data) y flush()) y el descompresor (con decompress(data, max_length), que
+# regresa a lo más max_length bytes, para que unas tramas pequeñas no produzcan una
+# salida sin límite).
+COMPRESS_BLOCK = 1 << 16
+MAX_FRAME = 2 * COMPRESS_BLOCK # Tamaño máximo de una trama recibida
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+CODECS = {'zlib': (lambda: zlib.compressobj(ZLIB_LEVEL), zlib.decompressobj)}
+
+try:
+    import lz4.frame
+
+    # El compresor de lz4 envía el encabezado del frame con begin()
+    class Lz4Compressor:
+        def __init__(self):
+            self.compressor = lz4.frame.LZ4FrameCompressor()
+            self.header = self.compressor.begin()
+
+        def compress(self, data):
+            data, self.header = self.header + self.compressor.compress(data), b''
+            return data
+
+        def flush(self):
+            data, self.header = self.header + self.compressor.flush(), b''
+            return data
+
+    CODECS['lz4'] = (Lz4Compressor, lz4.frame.LZ4FrameDecompressor)
+except ImportError:
+    pass
+
+try:
+    import zstandard
+
+    # El descompresor de zstandard no acota su salida; los datos se descomprimen a
+    # través de un stream_writer, que entrega la salida por bloques a Output, y este
+    # termina la descompresión en cuanto se pasa de max_length
+    class ZstdDecompressor:
+        class Output:
+            def __init__(self):
+                self.data = bytearray()
+                self.limit = 0
+
+            def write(self, data):
+                if len(self.data) + len(data) > self.limit:
+                    raise ValueError(f'more than {self.limit} bytes of output.')
+                self.data += data
+                return len(data)
+
+        def __init__(self):
+            self.output = self.Output()
+            self.writer = zstandard.ZstdDecompressor().stream_writer(self.output, write_size=COMPRESS_BLOCK)
+
+        def decompress(self, data, max_length):
+            self.output.limit = max_length
+            self.writer.write(data)
+            data, self.output.data = bytes(self.output.data), bytearray()
+            return data
+
+    CODECS['zstd'] = (lambda: zstandard.ZstdCompressor(level=ZSTD_LEVEL).compressobj(), ZstdDecompressor)
+except ImportError:
+    pass
+
+# Orden de preferencia de las compresiones que ofrece el cliente
+PREFERENCE = ('zstd', 'lz4', 'zlib')
+
+# Heurística de datos comprimibles: se comprime con zlib (nivel 1) una muestra de
+# SAMPLE_SIZE bytes; si no se reduce al menos a MIN_RATIO de su tamaño, los datos
+# probablemente ya están comprimidos (gz, zip, jpg, mp4...) y se envían sin comprimir.
+# Tampoco se comprimen archivos de menos de MIN_SIZE bytes.
+SAMPLE_SIZE = 1 << 16
+MIN_RATIO = 0.9
+MIN_SIZE = 512
+
+# Compresiones disponibles, en orden de preferencia
+def available():
+    return [c for c in PREFERENCE if c in CODECS]
+
+# Primera compresión de offered que está disponible ('' si ninguna)
+def choose(offered):
+    return next((c for c in offered if c in CODECS), '')
+
+# Verifica si vale la pena comprimir length bytes del archivo f a partir de offset
+def compressible(f, offset, length):
+    if length < MIN_SIZE: return False
+    f.seek(offset)
+    sample = f.read(min(length, SAMPLE_SIZE))
+    return len(zlib.compress(sample, 1)) < len(sample) * MIN_RATIO
+
+# Lee n bytes de f y los comprime. Regresa las tramas con los datos comprimidos (puede
+# ser b'' si el compresor aún no produce salida). Con last, termina la compresión. Con
+# digest (hashlib), calcula el SHA-256 de los datos sin comprimir
+def compressBlock(f, n, compressor, last=False, digest=None):
+    data = f.read(n)
+    if len(data) < n:
+        raise EOFError(f'File ended, expected {n - len(data)} more bytes.')
+    if digest is not None: digest.update(data)
+    data = compressor.compress(data)
+    if last: data += compressor.flush()
+    return COMPRESSED_CHUNK.pack(len(data)) + data if data else b''
+
+# Tramas con los datos comprimidos de length bytes de f, a partir de offset
+def compressedFrames(f, length, offset, codec, digest=None):
+    f.seek(offset)
+    compressor = CODECS[codec][0]()
+    remaining = length
+    while remaining:
+        n = min(remaining, COMPRESS_BLOCK)
+        remaining -= n
+        frames = compressBlock(f, n, compressor, not remaining, digest)
+        if frames: yield frames
+    yield COMPRESSED_CHUNK.pack(0)
+
+# Envía length bytes de f, a partir de offset, comprimidos con codec
+def sendCompressed(conn, f, length, offset, codec, digest=None):
+    for frames in compressedFrames(f, length, offset, codec, digest):
+        conn.sendall(frames)
+
+# Descomprime data y escribe en f a lo más limit bytes. Regresa el número de bytes
+# escritos. Lanza ValueError, sin escribir en f, si los datos no son válidos o
+# producen más de limit bytes
+def decompressBlock(f, data, decompressor, limit):
+    try:
+        data, tail = decompressor.decompress(data, limit + 1), getattr(decompressor, 'unconsumed_tail', b'')
+    except Exception as e:
+        raise ValueError(f'Invalid compressed data: {e}') from e
+    # Si la salida llegó al límite, zlib deja sin procesar el resto de la trama
+    # (unconsumed_tail), y lz4 lo guarda para la siguiente llamada
+    if len(data) > limit or tail:
+        raise ValueError(f'Invalid compressed data: more than {limit} bytes.')
+    f.write(data)
+    return len(data)
+
+# Recibe los datos comprimidos con codec y escribe en f exactamente length bytes
+# descomprimidos. Lanza ValueError si los datos no son válidos o no tienen length
+# bytes; nunca escribe más de length bytes
+def recvCompressed(conn, f, length, codec):
+    decompressor = CODECS[codec][1]()
+    written = 0
+    while True:
+        n, = COMPRESSED_CHUNK.unpack(recvExact(conn, COMPRESSED_CHUNK.size))
+        if not n: break
+        if n > MAX_FRAME:
+            raise ValueError(f'Invalid compressed data: frame of {n} bytes.')
+        written += decompressBlock(f, recvExact(conn, n), decompressor, length - written)
+    if written != length:
+        raise ValueError(f'Invalid compressed data: expected {length} bytes, got {written}.')
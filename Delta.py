@@ -0,0 +1,124 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import zlib
+import hashlib
+from math import isqrt
+from Protocol import DELTA_BLOCK, DELTA_STRONG_SIZE, DELTA_COPY, DELTA_DATA
+
+# Delta
+# Funciones del upload por diferencias (ver Protocol.DELTA_SIGNATURE), al estilo de
+# rsync.
+#
+# El servidor divide su versión del archivo en bloques de blockSize bytes y envía la
+# firma de cada uno: un checksum débil (adler32), que se puede recalcular al desplazar
+# la ventana un byte sin volver a recorrerla (rolling checksum), y uno fuerte (SHA-256).
+# El cliente recorre el nuevo archivo con una ventana de blockSize bytes: si el checksum
+# débil de la ventana es el de algún bloque y el fuerte coincide, envía una referencia
+# al bloque y salta la ventana completa; si no, avanza un byte, y los bytes que deja
+# atrás se envían como datos literales.
+#
+# Las regiones sin cambios avanzan un bloque a la vez (adler32 y sha256 de la
+# biblioteca estándar); solo las regiones modificadas se recorren byte por byte.
+ADLER_MOD = 65521
+MIN_BLOCK_SIZE = 2048
+MAX_BLOCK_SIZE = 1 << 17
+READ_SIZE = 1 << 20 # Bytes leídos del archivo a la vez
+MAX_LITERAL = 1 << 20 # Datos literales que se acumulan antes de enviarlos
+
+# Tamaño de bloque para un archivo de size bytes: aproximadamente la raíz cuadrada del
+# tamaño (como rsync), en múltiplos de 1 KiB
+def blockSize(size):
+    return min(max(isqrt(size) >> 10 << 10, MIN_BLOCK_SIZE), MAX_BLOCK_SIZE)
+
+def strongChecksum(block):
+    return hashlib.sha256(block).digest()[:DELTA_STRONG_SIZE]
+
+# Firmas (DELTA_BLOCK) de todos los bloques del archivo f, en una sola cadena
+def signatures(f, size):
+    return b''.join(DELTA_BLOCK.pack(zlib.adler32(block), strongChecksum(block))
+                    for block in iter(lambda: f.read(size), b''))
+
+# Índice de las firmas recibidas del servidor, para un archivo de size bytes.
+# Regresa (index, tail): index es checksum débil -> {checksum fuerte: índice} de los
+# bloques completos, y tail es (índice, tamaño, débil, fuerte) del último bloque si es
+# más corto que blockSize (o None)
+def signatureIndex(data, blockSize, size):
+    index = {}
+    tail = None
+    for i, (weak, strong) in enumerate(DELTA_BLOCK.iter_unpack(data)):
+        length = min(blockSize, size - i * blockSize)
+        if length == blockSize: index.setdefault(weak, {}).setdefault(strong, i)
+        else: tail = (i, length, weak, strong)
+    return index, tail
+
+# Recorre el archivo f y genera las instrucciones para construirlo a partir de la
+# versión del servidor: (DELTA_COPY, índice del bloque) o (DELTA_DATA, bytes).
+# digest (hashlib) se actualiza con todo el contenido de f
+def delta(f, blockSize, index, tail, digest):
+    buffer = b''
+    pos = 0 # Inicio de la ventana en buffer
+    literal = 0 # Inicio de los datos literales pendientes en buffer
+    weak = None # adler32 de la ventana buffer[pos:pos + blockSize]
+    eof = False
+
+    while True:
+        # La ventana y el byte siguiente deben estar en buffer para poder desplazarla
+        if not eof and len(buffer) - pos <= blockSize:
+            if pos - literal >= MAX_LITERAL:
+                yield DELTA_DATA, buffer[literal:pos]
+                literal = pos
+            buffer, pos, literal = buffer[literal:], pos - literal, 0
+            data = f.read(READ_SIZE)
+            if data:
+                digest.update(data)
+                buffer += data
+            else:
+                eof = True
+            continue
+
+        if len(buffer) - pos >= blockSize:
+            if weak is None:
+                weak = zlib.adler32(buffer[pos:pos + blockSize])
+
+            candidates = index.get(weak)
+            if candidates:
+                i = candidates.get(strongChecksum(buffer[pos:pos + blockSize]))
+                if i is not None:
+                    if pos > literal: yield DELTA_DATA, buffer[literal:pos]
+                    yield DELTA_COPY, i
+                    pos += blockSize
+                    literal = pos
+                    weak = None
+                    continue
+
+            # Sin coincidencia: desplaza la ventana un byte, el primero queda como literal
+            if pos + blockSize < len(buffer):
+                out, new = buffer[pos], buffer[pos + blockSize]
+                a = ((weak & 0xffff) - out + new) % ADLER_MOD
+                b = ((weak >> 16) - blockSize * out + a - 1) % ADLER_MOD
+                weak = b << 16 | a
+                pos += 1
+                continue
+
+        # Final del archivo: el resto son datos literales, salvo el último bloque del
+        # servidor (más corto) si coincide con el final del archivo
+        end = len(buffer)
+        if tail and end - tail[1] >= literal:
+            block = buffer[end - tail[1]:]
+            if zlib.adler32(block) == tail[2] and strongChecksum(block) == tail[3]:
+                end -= tail[1]
+        if end > literal: yield DELTA_DATA, buffer[literal:end]
+        if end < len(buffer): yield DELTA_COPY, tail[0]
+        return
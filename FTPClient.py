@@ -0,0 +1,181 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import io
+import hashlib
+from Protocol import BUSY, STATUS_OK, STATUS_BAD_REQUEST, BUNDLE_REQUEST, BUNDLE_REPLACE, packRange, packListRequest, unpackList
+from Protocol import RANGE_VERIFY, UPLOAD_VERIFY, CHECKSUM_REPLY, DIGEST_SIZE, DigestWriter, packUploadOptions
+from Protocol import packHeader, sendHeader, recvHeader, recvExact, recvToFile, sendFile, connect, sendBundle, recvBundle
+
+# FTPClient
+# Non-interactive client library, for scripts and benchmarks (client.py is the
+# interactive command line client). Every operation opens its own connection, like
+# client.py, and answers the server's questions from its arguments instead of asking
+# the user. Failures are raised as exceptions:
+# ServerBusy: the server replied busy, the request may be retried later
+# NotFound: the file doesn't exist on server
+# RequestFailed: the server (or the connection) reported an error
+# ChecksumMismatch: the SHA-256 of the data received by one side doesn't match the
+# data sent by the other
+class RequestFailed(Exception):
+    pass
+
+class ServerBusy(RequestFailed):
+    pass
+
+class NotFound(RequestFailed):
+    pass
+
+class ChecksumMismatch(RequestFailed):
+    pass
+
+class FTPClient:
+    def __init__(self, host, port, timeout=None, verify=True):
+        self.host = host
+        self.port = port
+        self.timeout = timeout # Seconds for connecting and for each socket operation
+        self.verify = verify # Verify the SHA-256 of uploads and downloads
+
+    def connect(self):
+        return connect((self.host, self.port), self.timeout)
+
+    # Checks the first reply of the server
+    def reply(self, s, name):
+        reply = s.recv(1)
+        if reply == BUSY: raise ServerBusy(f'Server busy, retry later ({name}).')
+        if not reply: raise RequestFailed(f'Connection closed by server ({name}).')
+        return reply
+
+    # Uploads data (bytes or a binary file object) as name. If the file exists on
+    # server it is replaced, unless replace is False. With verify, the SHA-256 of the
+    # data is sent after it, and the server saves the file only if the data it received
+    # matches. Returns the bytes sent (0 if the upload was declined)
+    def upload(self, name, data, replace=True):
+        f = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+        size = f.seek(0, io.SEEK_END)
+        with self.connect() as s:
+            if self.verify:
+                # Verified upload: 'zu' without compressions
+                s.sendall(packHeader('zu', name, size) + packUploadOptions(flags=UPLOAD_VERIFY))
+            else:
+                sendHeader(s, 'up', name, size)
+            exists = self.reply(s, name)
+            if self.verify: recvHeader(s) # Compression chosen by the server (none)
+            if exists == b'y':
+                s.send(b'y' if replace else b'n')
+                if not replace: return 0
+            digest = hashlib.sha256() if self.verify else None
+            sendFile(s, f, size, 0, digest)
+            if self.verify: s.sendall(digest.digest())
+            reply = s.recv(3)
+            if reply == STATUS_BAD_REQUEST and self.verify:
+                raise ChecksumMismatch(f"{name} was received by the server with a different SHA-256, it wasn't saved.")
+            if reply != b'100':
+                raise RequestFailed(f"Couldn't save {name} on server.")
+        return size
+
+    # Downloads name (or count bytes from offset, 0 = to the end) into the binary file
+    # object f, or returns its content if f is None. The data is verified against the
+    # SHA-256 sent by the server (with verify). Returns the bytes received
+    def download(self, name, f=None, offset=0, count=0):
+        target = f if f is not None else io.BytesIO()
+        sink = DigestWriter(target) if self.verify else target
+        with self.connect() as s:
+            # Header and range in one segment
+            flags = RANGE_VERIFY if self.verify else 0
+            request = packRange(offset, count, flags=flags) if offset or count or flags else b''
+            s.sendall(packHeader('dw', name, len(request)) + request)
+            if self.reply(s, name) != b'y':
+                raise NotFound(f'Cannot find {name} on server.')
+            s.send(b'y')
+            op, codec, size = recvHeader(s)
+            recvToFile(s, sink, size)
+            if self.verify and recvExact(s, DIGEST_SIZE) != sink.digest.digest():
+                s.send(STATUS_BAD_REQUEST)
+                raise ChecksumMismatch(f'{name} was received with a different SHA-256.')
+            s.send(b'100')
+        return target.getvalue() if f is None else size
+
+    # Size, modification time and SHA-256 (bytes) of name on server, taken from the
+    # server's checksum index
+    def checksum(self, name):
+        with self.connect() as s:
+            sendHeader(s, 'ck', name)
+            if self.reply(s, name) != b'y':
+                raise NotFound(f'Cannot find {name} on server.')
+            return CHECKSUM_REPLY.unpack(recvExact(s, CHECKSUM_REPLY.size))
+
+    # Removes name from server
+    def delete(self, name):
+        with self.connect() as s:
+            sendHeader(s, 'dl', name)
+            if self.reply(s, name) != b'y':
+                raise NotFound(f'Cannot find {name} on server.')
+            s.send(b'y')
+            if s.recv(3) != b'100':
+                raise RequestFailed(f"Couldn't remove {name} from server.")
+
+    # Lists the files starting with prefix: (name, size, mtime) tuples (size and mtime
+    # are None without metadata). With limit, returns one page and the cursor of the
+    # next one ('' if there are no more files)
+    def list(self, prefix='', metadata=False, cursor='', limit=0):
+        with self.connect() as s:
+            request = packListRequest(cursor, limit, metadata)
+            sendHeader(s, 'ls', prefix, len(request))
+            s.sendall(request)
+            self.reply(s, 'list')
+            op, nextCursor, length = recvHeader(s)
+            files = unpackList(recvExact(s, length), metadata)
+            s.send(b'100')
+        return (files, nextCursor) if limit else files
+
+    # Uploads many files in one request (bundle). files yields (name, data) pairs, with
+    # data as in upload(). Returns a list of (name, status) pairs, with the server
+    # status of each file (STATUS_OK, STATUS_EXISTS when not replaced, ...)
+    def uploadBundle(self, files, replace=True):
+        names = []
+        def entries():
+            for name, data in files:
+                f = io.BytesIO(data) if isinstance(data, (bytes, bytearray, memoryview)) else data
+                names.append(name)
+                yield name, f, f.seek(0, io.SEEK_END)
+        with self.connect() as s:
+            request = BUNDLE_REQUEST.pack(BUNDLE_REPLACE if replace else 0)
+            sendHeader(s, 'bu', '', len(request))
+            s.sendall(request)
+            if self.reply(s, 'bundle') != b'y':
+                raise RequestFailed('Server does not support bundles.')
+            sendBundle(s, entries())
+            op, _, count = recvHeader(s)
+            statuses = recvExact(s, 3 * count)
+        return [(name, statuses[3 * i:3 * i + 3]) for i, name in enumerate(names[:count])]
+
+    # Downloads in one request (bundle) the files whose names start with prefix and
+    # match pattern (glob, '' for all). Returns a dict name -> content; files removed
+    # while the bundle was being sent are left out
+    def downloadBundle(self, pattern='', prefix=''):
+        files = {}
+        with self.connect() as s:
+            request = pattern.encode('utf-8')
+            sendHeader(s, 'bd', prefix, len(request))
+            s.sendall(request)
+            if self.reply(s, 'bundle') != b'y':
+                raise RequestFailed('Server does not support bundles.')
+            for status, name, size, source in recvBundle(s):
+                if status == STATUS_OK:
+                    sink = io.BytesIO()
+                    recvToFile(source, sink, size)
+                    files[name] = sink.getvalue()
+            s.send(b'100')
+        return files
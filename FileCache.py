@@ -0,0 +1,134 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import io
+import os
+import threading
+from collections import OrderedDict
+
+# FileCache
+# Caché en memoria del contenido de los archivos pequeños más descargados, con
+# política LRU (se descarta el archivo usado menos recientemente) y un límite total de
+# maxBytes bytes. Solo se guardan archivos de hasta maxFileSize bytes; con maxBytes en
+# 0 la caché está desactivada.
+#
+# Las descargas (Lectores) llenan la caché, y toda escritura (publish, delete) invalida
+# la entrada del archivo mientras tiene el recurso como Escritor. Como Lectores y
+# Escritores de un archivo nunca se ejecutan al mismo tiempo, una descarga nunca guarda
+# una versión que ya fue reemplazada. Si los archivos se modifican desde fuera del
+# servidor, 'rescan' vacía la caché.
+#
+# Con shared (modo pre-fork), los otros procesos también escriben los archivos, sin
+# invalidar esta caché. Cada entrada guarda entonces la identidad del archivo (inodo,
+# fecha de modificación y tamaño), y solo se usa si el archivo en el disco conserva
+# esa identidad; como publish reemplaza el archivo con un rename, cada versión tiene
+# su propio inodo.
+class FileCache:
+    def __init__(self, maxBytes=0, maxFileSize=0, shared=False):
+        self.maxBytes = maxBytes # Tamaño máximo de la caché
+        self.maxFileSize = min(maxFileSize, maxBytes) # Tamaño máximo de un archivo en la caché
+        self.shared = shared # Bandera de archivos compartidos con otros procesos
+        self.entries = OrderedDict() # Nombre de archivo -> contenido, del menos al más reciente
+        self.identities = {} # Nombre de archivo -> identidad del contenido guardado
+        self.size = 0 # Bytes en la caché
+        self.lock = threading.Lock() # Semáforo para entries y los contadores
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    # Contenido del archivo, o None si no está en la caché (o si su identidad no es
+    # identity, con shared)
+    def get(self, filename, identity=None):
+        if not self.maxBytes: return None
+        with self.lock:
+            data = self.entries.get(filename)
+            if data is not None and self.shared and self.identities.get(filename) != identity:
+                self.drop(filename)
+                self.invalidations += 1
+                data = None
+            if data is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(filename)
+            self.hits += 1
+            return data
+
+    # Verifica si un archivo de size bytes puede guardarse en la caché
+    def fits(self, size):
+        return size <= self.maxFileSize and self.maxBytes > 0
+
+    # Guarda el contenido del archivo (con su identidad), descartando los menos
+    # recientes si no cabe
+    def put(self, filename, data, identity=None):
+        if not self.fits(len(data)): return
+        with self.lock:
+            self.drop(filename)
+            self.entries[filename] = data
+            self.identities[filename] = identity
+            self.size += len(data)
+            while self.size > self.maxBytes:
+                name, evicted = self.entries.popitem(last=False)
+                del self.identities[name]
+                self.size -= len(evicted)
+                self.evictions += 1
+
+    # Elimina el archivo de la caché (su contenido cambió)
+    def invalidate(self, filename):
+        with self.lock:
+            if self.drop(filename):
+                self.invalidations += 1
+
+    # Se ejecuta con self.lock adquirido. Regresa True si el archivo estaba en la caché
+    def drop(self, filename):
+        data = self.entries.pop(filename, None)
+        if data is None: return False
+        del self.identities[filename]
+        self.size -= len(data)
+        return True
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.identities.clear()
+            self.size = 0
+
+    def stats(self):
+        with self.lock:
+            return {'entries': len(self.entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses,
+                    'evictions': self.evictions, 'invalidations': self.invalidations}
+
+# Abre el archivo para leerlo. Si es pequeño, se lee completo de la caché (o del disco,
+# y se guarda en la caché). Regresa (f, data): f es un objeto de archivo (io.BytesIO
+# para el contenido en memoria) y data el contenido completo, o None si el archivo no
+# cabe en la caché. Con shared, el contenido en la caché solo se usa si el archivo
+# conserva su identidad
+def openCached(cache, filename):
+    identity = fileIdentity(os.stat(filename)) if cache.shared and cache.maxBytes else None
+    data = cache.get(filename, identity)
+    if data is not None:
+        return io.BytesIO(data), data
+
+    f = open(filename, 'rb')
+    st = os.fstat(f.fileno())
+    if not cache.fits(st.st_size):
+        return f, None
+    with f:
+        data = f.read()
+    cache.put(filename, data, fileIdentity(st) if cache.shared else None)
+    return io.BytesIO(data), data
+
+# Identidad de una versión de un archivo, a partir de su stat
+def fileIdentity(st):
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
@@ -0,0 +1,139 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import time
+import threading
+from bisect import bisect_left, bisect_right
+from StagedFile import isTemporary
+
+# FileIndex
+# Índice en memoria de los archivos almacenados en un directorio del servidor.
+#
+# En lugar de volver a leer el directorio completo después de cada escritura, las
+# operaciones upload() y delete() actualizan únicamente la entrada del archivo que
+# modificaron (add / remove), por lo que el costo de una escritura no depende del
+# número de archivos.
+#
+# Los lectores (List) obtienen una copia inmutable y ordenada de los nombres
+# (snapshot). La copia se reconstruye solo cuando el índice cambió desde la última
+# vez; mientras no haya cambios, la lectura no toma ningún semáforo. Una lista en
+# curso nunca bloquea a los escritores, pues trabaja sobre su propia copia.
+#
+# Cada entrada guarda además el tamaño y la fecha de modificación del archivo (stat),
+# de tal forma que la lista con metadatos no necesita consultar el disco.
+#
+# reconcile() recorre los archivos de la organización del directorio (Layout) y
+# reconstruye el índice. Se ejecuta al iniciar el servidor, y se puede volver a ejecutar
+# si el directorio se modificó desde fuera. Los archivos temporales de los uploads en
+# curso (StagedFile) no se incluyen. El orden de la lista es el de los nombres, sin
+# importar en qué subdirectorio esté cada archivo.
+#
+# Con shared (modo pre-fork), otros procesos también modifican el directorio. Antes de
+# cada lista se compara la fecha de modificación del directorio con la del último
+# recorrido, y si cambió se reconstruye el índice (refresh). Si el directorio cambió
+# muy poco antes del recorrido (RACY_WINDOW), un cambio posterior podría conservar la
+# misma fecha, por lo que ese recorrido no se considera confiable y la siguiente lista
+# vuelve a recorrer el directorio. Los cambios dentro de los subdirectorios de la
+# organización no modifican la fecha del directorio, por lo que cada add / remove la
+# actualiza (touch).
+RACY_WINDOW = 0.1 # Segundos
+
+class FileIndex:
+    def __init__(self, layout, scan=True, shared=False):
+        self.layout = layout # Organización del directorio indexado
+        self.root = layout.root # Directorio indexado
+        self.names = {} # Nombre de archivo -> (tamaño, fecha de modificación)
+        self.version = 0 # Se incrementa con cada cambio
+        self.cache = (0, ()) # (versión, nombres ordenados) de la última copia
+        self.lock = threading.Lock() # Semáforo para los escritores del índice
+        self.shared = shared # Bandera de directorio compartido con otros procesos
+        self.scanned = (None, False) # (fecha del directorio, confiable) del último recorrido
+        self.scanLock = threading.Lock() # Semáforo para refresh()
+
+        if scan: self.reconcile()
+
+    # Recorre el directorio y reconstruye el índice. Regresa el número de archivos
+    def reconcile(self):
+        start = time.time_ns()
+        mtime = os.stat(self.root).st_mtime_ns
+        names = {}
+        for e in self.layout.scan():
+            if not isTemporary(e.name):
+                st = e.stat()
+                names[e.name] = (st.st_size, st.st_mtime)
+        with self.lock:
+            self.names = names
+            self.version += 1
+            self.scanned = (mtime, mtime < start - RACY_WINDOW * 1e9)
+        return len(names)
+
+    # Reconstruye el índice si otro proceso modificó el directorio (solo con shared)
+    def refresh(self):
+        if not self.shared: return
+        with self.scanLock:
+            mtime, trusted = self.scanned
+            if not trusted or os.stat(self.root).st_mtime_ns != mtime:
+                self.reconcile()
+
+    # Avisa a los otros procesos que el índice cambió (solo con shared)
+    def touch(self):
+        if self.shared: os.utime(self.root)
+
+    # Agrega (o actualiza) un archivo
+    def add(self, name, size=0, mtime=0.0):
+        with self.lock:
+            if name not in self.names:
+                self.version += 1
+            self.names[name] = (size, mtime)
+        self.touch()
+
+    # Elimina un archivo
+    def remove(self, name):
+        with self.lock:
+            if self.names.pop(name, None) is not None:
+                self.version += 1
+        self.touch()
+
+    # Tamaño y fecha de modificación de un archivo, o None si no está en el índice
+    def stat(self, name):
+        return self.names.get(name)
+
+    # Copia inmutable y ordenada de los nombres de los archivos
+    def snapshot(self):
+        version, names = self.cache
+        if version == self.version:
+            return names
+        with self.lock:
+            if self.cache[0] != self.version:
+                self.cache = (self.version, tuple(sorted(self.names)))
+            return self.cache[1]
+
+    # Página de la lista: hasta limit nombres (0 = sin límite) que comienzan con prefix
+    # y que van después de cursor en orden alfabético. Regresa (nombres, cursor), donde
+    # cursor es el valor para pedir la siguiente página, o '' si no hay más.
+    def page(self, prefix='', cursor='', limit=0):
+        self.refresh()
+        names = self.snapshot()
+        start = bisect_right(names, cursor) if cursor > prefix else bisect_left(names, prefix)
+        end = bisect_left(names, prefix + '\U0010ffff', start) if prefix else len(names)
+        if limit and end - start > limit:
+            return names[start:start + limit], names[start + limit - 1]
+        return names[start:end], ''
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def __len__(self):
+        return len(self.names)
@@ -0,0 +1,117 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import hashlib
+import threading
+from os.path import join, normpath
+
+# Organización de los archivos en el disco (--layout)
+# Los clientes ven siempre un solo espacio de nombres plano; la organización decide en
+# qué directorio se guarda cada nombre. Todo el servidor obtiene la ruta de un archivo
+# con path(name), y recorre los archivos con scan(), por lo que el resto del código
+# (recursos, índice, almacenamiento) no depende de la organización.
+#
+# path(name) ruta del archivo name (crea su directorio si es necesario)
+# location(name) ruta del archivo name, sin crear su directorio
+# scan() recorre los archivos (os.DirEntry) de todos los directorios, incluidos los
+#     temporales
+# directories() recorre los directorios que contienen archivos
+LAYOUTS = ('flat', 'sharded')
+
+# FlatLayout
+# Todos los archivos en el mismo directorio (root/NAME), la organización original
+class FlatLayout:
+    name = 'flat'
+
+    def __init__(self, root):
+        self.root = normpath(root) # Directorio de los archivos
+
+    def path(self, name):
+        return join(self.root, name)
+
+    def location(self, name):
+        return join(self.root, name)
+
+    def directories(self):
+        yield self.root
+
+    def scan(self):
+        for directory in self.directories():
+            with os.scandir(directory) as entries:
+                for e in entries:
+                    if e.is_file(): yield e
+
+    def stats(self):
+        return {'layout': self.name}
+
+# ShardedLayout
+# Cada archivo se guarda en un subdirectorio de dos niveles obtenido del SHA-256 de su
+# nombre (root/XX/YY/NAME, con XX y YY los primeros dígitos hexadecimales), de tal forma
+# que con millones de archivos ningún directorio crece demasiado y abrir, buscar o
+# reemplazar un archivo cuesta lo mismo que con pocos archivos. Los temporales de un
+# upload se crean en el directorio del archivo, por lo que la publicación sigue siendo
+# un solo rename.
+#
+# Los subdirectorios se crean cuando se usan por primera vez y nunca se eliminan (así
+# nunca desaparece el directorio de un upload en curso). Los directorios de root con
+# otros nombres (p. ej. .blobs) no forman parte de la organización.
+SHARD_DIGITS = 2 # Dígitos hexadecimales del nombre de cada nivel
+SHARD_LEVELS = 2 # Niveles de subdirectorios
+
+class ShardedLayout(FlatLayout):
+    name = 'sharded'
+
+    def __init__(self, root):
+        super().__init__(root)
+        self.created = set() # Subdirectorios que ya existen
+        self.lock = threading.Lock() # Semáforo para created
+
+    # Subdirectorio (relativo a root) del archivo name
+    @staticmethod
+    def shard(name):
+        digest = hashlib.sha256(name.encode('utf-8', 'surrogateescape')).hexdigest()
+        return join(*(digest[i * SHARD_DIGITS:(i + 1) * SHARD_DIGITS] for i in range(SHARD_LEVELS)))
+
+    def location(self, name):
+        return join(self.root, self.shard(name), name)
+
+    def path(self, name):
+        directory = join(self.root, self.shard(name))
+        if directory not in self.created:
+            os.makedirs(directory, exist_ok=True)
+            with self.lock:
+                self.created.add(directory)
+        return join(directory, name)
+
+    def directories(self):
+        def walk(directory, level):
+            with os.scandir(directory) as entries:
+                shards = sorted(e.path for e in entries if e.is_dir() and isShard(e.name))
+            for shard in shards:
+                if level == SHARD_LEVELS: yield shard
+                else: yield from walk(shard, level + 1)
+        yield from walk(self.root, 1)
+
+    def stats(self):
+        with self.lock:
+            return {'layout': self.name, 'directories': len(self.created)}
+
+# Verifica si el nombre es el de un subdirectorio de ShardedLayout
+def isShard(name):
+    return len(name) == SHARD_DIGITS and all(c in '0123456789abcdef' for c in name)
+
+# Organización con el nombre indicado (LAYOUTS) para el directorio root
+def makeLayout(name, root):
+    return ShardedLayout(root) if name == 'sharded' else FlatLayout(root)
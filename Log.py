@@ -0,0 +1,149 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import sys
+import json
+import time
+import queue
+import logging
+import itertools
+import contextvars
+from datetime import datetime
+from logging.handlers import QueueHandler, QueueListener
+
+# Log
+# Bitácora del servidor, con niveles (LOG_LEVELS) y escritura en segundo plano.
+#
+# Las funciones debug / info / warning / error solo encolan el evento (mensaje con
+# formato %, sus argumentos y los campos) si su nivel está activo; el mensaje, la fecha
+# y la línea completa se construyen en el hilo que escribe la bitácora (QueueListener),
+# de tal forma que los hilos que atienden conexiones nunca esperan a la salida
+# estándar ni dan formato a eventos descartados.
+#
+# Cada conexión asocia su contexto con bind(ID, ...) al comenzar: el ID del hilo o la
+# tarea, la operación, el archivo, la dirección del cliente y el instante de inicio. El
+# contexto se guarda en una ContextVar (propia de cada hilo y de cada tarea de
+# asyncio), por lo que los eventos lo incluyen sin pasarlo como parámetro.
+#
+# Formatos (LOG_FORMATS):
+# 'text': la línea de siempre, '<fecha> [Thread #ID] mensaje' ('[Server]' fuera de una
+#         conexión, '[Worker N, Thread #ID]' en modo pre-fork)
+# 'json': un objeto por línea con time, level, worker (en modo pre-fork), ID, op, file,
+#         addr, duration (segundos desde el inicio de la conexión), msg y los campos
+#         del evento (p. ej. bytes)
+#
+# Los eventos que se repiten por cada elemento (p. ej. cada petición de una sesión) se
+# registran solo si sampled(key) lo indica: uno de cada sample eventos con esa clave.
+LOG_LEVELS = ('debug', 'info', 'warning', 'error')
+LOG_FORMATS = ('text', 'json')
+
+context = contextvars.ContextVar('log context', default=None)
+
+# QueueHandler da formato al evento antes de encolarlo; aquí se encola tal cual y el
+# formato se hace en el hilo de la bitácora
+class DeferredQueueHandler(QueueHandler):
+    def prepare(self, record):
+        return record
+
+class TextFormatter(logging.Formatter):
+    def __init__(self, unit, worker=None):
+        super().__init__()
+        self.unit = unit # 'Thread' o 'Task', según el motor
+        self.prefix = f'Worker {worker}, ' if worker is not None else '' # Proceso worker (pre-fork)
+
+    def format(self, record):
+        ID = record.ctx.get('ID') if record.ctx else None
+        source = f'{self.prefix}{self.unit} #{ID}' if ID is not None else self.prefix + 'Server'
+        return f'{datetime.fromtimestamp(record.created)} [{source}] {record.getMessage()}'
+
+class JsonFormatter(logging.Formatter):
+    def __init__(self, worker=None):
+        super().__init__()
+        self.worker = worker # Proceso worker (pre-fork)
+
+    def format(self, record):
+        entry = {'time': datetime.fromtimestamp(record.created).isoformat(), 'level': record.levelname.lower()}
+        if self.worker is not None: entry['worker'] = self.worker
+        if record.ctx:
+            entry.update((k, v) for k, v in record.ctx.items() if k != 'start')
+            entry['duration'] = round(record.created - record.ctx['start'], 6)
+        entry['msg'] = record.getMessage()
+        entry.update(record.fields)
+        return json.dumps(entry, default=str)
+
+class Log:
+    def __init__(self):
+        self.logger = logging.getLogger('FTPServer')
+        self.logger.propagate = False
+        self.logger.addHandler(logging.NullHandler()) # Sin salida hasta setup()
+        self.listener = None
+        self.sample = 1
+        self.counters = {} # Clave -> contador de eventos (sampled)
+
+    # Configura la bitácora: nivel, formato, unidad de los IDs ('Thread' / 'Task'),
+    # muestreo de los eventos por elemento, flujo de salida y número del proceso worker
+    # (modo pre-fork)
+    def setup(self, level='info', format='text', unit='Thread', sample=1, stream=None, worker=None):
+        self.stop()
+        events = queue.SimpleQueue()
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(JsonFormatter(worker) if format == 'json' else TextFormatter(unit, worker))
+        self.logger.handlers = [DeferredQueueHandler(events)]
+        self.logger.setLevel(level.upper())
+        self.sample = max(sample, 1)
+        self.listener = QueueListener(events, output)
+        self.listener.start()
+
+    # Escribe los eventos pendientes y detiene el hilo de la bitácora
+    def stop(self):
+        if self.listener:
+            self.listener.stop()
+            self.listener = None
+
+    # Asocia el contexto de una conexión al hilo (o tarea) actual
+    def bind(self, ID, **fields):
+        context.set({'ID': ID, **fields, 'start': time.time()})
+
+    # Agrega campos al contexto actual (p. ej. la operación, al conocerla)
+    def update(self, **fields):
+        ctx = context.get()
+        if ctx is not None: context.set({**ctx, **fields})
+
+    # Verifica si debe registrarse este evento de la clave key (uno de cada sample)
+    def sampled(self, key):
+        if self.sample == 1: return True
+        counter = self.counters.get(key)
+        if counter is None: counter = self.counters.setdefault(key, itertools.count())
+        return next(counter) % self.sample == 0
+
+    def enabled(self, level):
+        return self.logger.isEnabledFor(level)
+
+    def event(self, level, msg, args, fields):
+        if self.logger.isEnabledFor(level):
+            self.logger._log(level, msg, args, extra={'ctx': context.get(), 'fields': fields})
+
+    def debug(self, msg, *args, **fields):
+        self.event(logging.DEBUG, msg, args, fields)
+
+    def info(self, msg, *args, **fields):
+        self.event(logging.INFO, msg, args, fields)
+
+    def warning(self, msg, *args, **fields):
+        self.event(logging.WARNING, msg, args, fields)
+
+    def error(self, msg, *args, **fields):
+        self.event(logging.ERROR, msg, args, fields)
+
+log = Log()
@@ -12,186 +12,865 @@
 # Otoño 2020
 # 27/Noviembre/2020
 
+import os
 import sys
 import errno
+import struct
+import argparse
 import socket
 import threading
+import traceback
+import re
+from fnmatch import fnmatchcase
 from datetime import datetime
-from os import listdir, mkdir
+from os import mkdir
 from ResourceFile import ResourceFile
-from os.path import isfile, isdir, join
+from ResourceRegistry import ResourceRegistry
+from FileIndex import FileIndex
+from FileCache import FileCache
+from ChecksumIndex import ChecksumIndex, compactChecksums
+from StagedFile import FSYNC_LEVELS, removeTemporaries
+from Log import LOG_LEVELS, LOG_FORMATS, log
+from Metrics import metrics, STATUS_OUTCOMES
+from WorkerPool import WorkerPool
+from RWLock import LockStats
+from Storage import PlainStorage, BlobStorage
+from ProcessLock import ProcessLocks
+from Layout import LAYOUTS, makeLayout
+from BufferPool import buffers, tuneSocket, corkSocket
+from Protocol import OPERATIONS, BUSY, MAX_REQUEST_DATA, SESSION_REPLACE, STATUS_OK, STATUS_BAD_REQUEST, STATUS_BUSY
+from Protocol import RANGE_REQUEST, packHeader, recvHeader, recvExact, discard, unpackListRequest, packList, unpackRange
+from Protocol import recvUploadOptions, recvSessionRequest, sendSessionResponse, packSessionList
+from Protocol import BUNDLE_REQUEST, BUNDLE_REPLACE, BUNDLE_FILE, BUNDLE_ENTRY, BufferedConnection
+from os.path import isdir
 
 # MainServer
 # Clase principal. Gestiona las conexiones entrantes y las canaliza a sus respectivos
-# hilos. Al recibir una conexión, solicita el tipo de operación, y luego el nombre
-# del archivo (excepto si la operación es List) para generar el recurso correspondiente.
-# Ejecuta en un nuevo hilo la función correspondiente del recurso a la operación
-# solicitada.
+# hilos. Cada conexión aceptada se atiende en un nuevo hilo, que solicita el tipo de
+# operación y el nombre del archivo (excepto si la operación es List) para generar el
+# recurso correspondiente, y ejecuta la función del recurso correspondiente a la
+# operación solicitada.
 #
 # Provee semáforos y métodos para bloquear el acceso al sistema de archivos, y para
 # obtener o generar los objetos recurso.
 #
+# Las conexiones se atienden en un conjunto fijo de hilos (WorkerPool) con una cola
+# acotada. Si la cola está llena, o si se alcanzó el límite de operaciones simultáneas
+# de ese tipo (opLimits), se responde de inmediato 'b' (busy) para que el cliente
+# reintente más tarde, en lugar de aceptar trabajo sin límite.
+#
 # Recurso: Objeto que representa y maneja el acceso a un archivo del sistema. Cada
 # archivo se asocia con un y solo un recurso. Esto permite la ejecución concurrente
 # de operaciones en diferentes recursos (salvo algunas excepciones)
+#
+# Con shared, el servidor es uno de varios procesos worker del modo pre-fork (ver
+# prefork): todos escuchan en el mismo puerto (SO_REUSEPORT) y el sistema operativo
+# reparte las conexiones entre ellos. Los semáforos de los recursos excluyen también a
+# los otros procesos (ProcessLock), y el índice de archivos y la caché se validan
+# contra el directorio, que los otros procesos también modifican.
 class MainServer:
-    def __init__(self,host=socket.gethostname(),port=42069):
+    def __init__(self,host=socket.gethostname(),port=42069,handshakeTimeout=10,workers=32,queueSize=64,opLimits=None,scan=True,cacheSize=0,cacheFileSize=0,sessionTimeout=60,fsync='none',dedup=False,shared=False,layout='flat',socketBuffer=0):
         self.HOST = host
         self.PORT = port
-        self.activeResourceList = [] # Lista de recursos arctivos
-        self.listCount = 0 # Contador de hilos de operación List
+        self.handshakeTimeout = handshakeTimeout # Plazo (segundos) para recibir la petición
+        self.sessionTimeout = sessionTimeout # Plazo (segundos) para la siguiente petición de una sesión
+        self.fsync = fsync # Sincronización con el disco de los uploads (FSYNC_LEVELS)
+        self.socketBuffer = socketBuffer # SO_SNDBUF/SO_RCVBUF de las conexiones (bytes, 0: del sistema)
+        self.resources = ResourceRegistry(lambda filename: ResourceFile(filename, self)) # Recursos activos
+        self.lockStats = LockStats() # Tiempos de espera de los semáforos de los recursos
+        self.locks = ProcessLocks('./recv') if shared else None # Semáforos entre procesos (pre-fork)
+        self.shared = shared # Bandera de proceso worker del modo pre-fork
         self.countID = 0 # Threads' ID counter
 
-        self.fileSystemLock = threading.Lock() # Semáforo para bloquear el acceso al Sistema de Archivos
-        self.listLock = threading.Lock() # Semáforo para el acceso a listCount
-        self.resourceLock = threading.Lock() # Semáforo para el acceso a activeResourceList
+        self.pool = WorkerPool(workers, queueSize) # Hilos que atienden las conexiones
+        # Límite de operaciones simultáneas por tipo (ls, up, dw, dl)
+        self.opSlots = {op: threading.BoundedSemaphore(n) for op, n in (opLimits or {}).items() if n}
+        self.rejectedOps = {op: 0 for op in OPERATIONS} # Contador de rechazos por operación
+        self.statsLock = threading.Lock() # Semáforo para acceder a rejectedOps
         
-        # Checa si existe el directorio
-        if not isdir('./recv'):
-            try:
-                print(f'{datetime.now()} [Server] Creating directory ./recv for incoming files.')
-                mkdir('./recv')
-            except OSError as e:
-                if e.errno != errno.EEXIST:
-                    raise
+        # Organización de los archivos en el directorio (LAYOUTS)
+        self.layout = makeLayout(layout, './recv')
+
+        # En modo pre-fork el proceso principal prepara el directorio antes de crear los
+        # workers, pues un worker que inicia después que otro eliminaría los temporales
+        # de sus uploads en curso
+        if not shared: prepareDirectory(self.layout)
+
+        # Almacenamiento de los archivos: copias independientes o por contenido
+        self.storage = BlobStorage(self.layout) if dedup else PlainStorage(self.layout)
+
+        # Caché de los archivos pequeños más descargados
+        self.cache = FileCache(cacheSize, cacheFileSize, shared)
+
+        # Índice de los archivos en el sistema. Si scan es verdadero, se construye
+        # recorriendo el directorio
+        self.files = FileIndex(self.layout, scan, shared)
 
-        # Obtiene la lista de archivos en el sistema.
-        self.files = [f for f in listdir('./recv') if isfile(join('./recv', f))]
+        # Índice persistente del SHA-256 de los archivos (./recv.checksums)
+        self.checksums = ChecksumIndex(self.layout.root)
 
     # Método principal, inicia el programa
     def start(self):
         # Creación del server socket. La cláusula 'with' maneja el socket y lo cierra
         # automáticamente al terminar
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as self.s:
+            # En modo pre-fork, los workers comparten el puerto
+            if self.shared: self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            # Los buffers del socket se fijan antes de escuchar, para que las conexiones
+            # aceptadas los hereden (y el tamaño de ventana TCP se negocie con ellos)
+            tuneSocket(self.s, self.socketBuffer)
             self.s.bind((self.HOST, self.PORT))# Crea un socket con esos parametros
-            print(f'{datetime.now()} [Server] Service started on {self.HOST}, {self.PORT}. Ready to receive connections.')
-            print('Press Enter to end process.')
+            log.info('Service started on %s, %s. Ready to receive connections.', self.HOST, self.PORT)
+            if not self.shared: print(CONSOLE_HELP)
             
             try:
                 # Server remains available
                 while True:
                     self.s.listen() # Escucha peticciones
                     conn, addr = self.s.accept() # Acepta una
+                    tuneSocket(conn)
 
                     # Handles the new connection
-                    print(f'{datetime.now()} [Server] New connection received, connected by {addr}.')
+                    # La negociación (operación y nombre del archivo) se realiza en el
+                    # hilo que atiende la conexión, por lo que un cliente lento no
+                    # detiene la aceptación de nuevas conexiones
+                    log.debug('New connection received, connected by %s.', addr)
                     self.countID += 1
-                    op = conn.recv(2).decode('utf-8', 'replace')
-
-                    # Si la operación es List, genera el nuevo hilo sin pedir más
-                    # datos
-                    if op == 'ls': # List
-                        threading._start_new_thread(self.listf, (conn, addr, self.countID))
-                        print(f'{datetime.now()} [Server] List Thread created.')
-                    # Cualquier otra operación necesita primero el nombre del archivo
-                    # deseado para generar el recurso.
-                    else:
-                        # Obtiene el nombre del archivo deseado (1)
-                        name = conn.recv(1024).decode('utf-8', 'replace')
-                        filename = f'recv/{name}'
-                        # Busca y obtiene el recurso asociado al archivo
-                        resource = self.getResource(filename)
-
-                        # Starts a thread with the respective function for the desired
-                        # operation
-                        if op == 'up': # Upload
-                            threading._start_new_thread(resource.upload, (conn, addr, self.countID))
-                            print(f'{datetime.now()} [Server] Upload Thread created.')
-                        elif op == 'dw': # Download
-                            threading._start_new_thread(resource.download, (conn, addr, self.countID))
-                            print(f'{datetime.now()} [Server] Download Thread created.')
-                        elif op == 'dl': # Delete
-                            threading._start_new_thread(resource.delete, (conn, addr, self.countID))
-                            print(f'{datetime.now()} [Server] Delete Thread created.')
+                    if not self.pool.submit(self.handle, conn, addr, self.countID):
+                        self.busy(conn, addr, self.countID)
             except OSError:
-                print(f'{datetime.now()} [Server] Service down by petition.')
+                log.info('Service down by petition.')
             except Exception as e:
-                print(f'{datetime.now()} [Server] Unknown Error. Service down.')
-                print(e)
+                log.error('Unknown Error. Service down. %r', e)
+
+    # Atiende una conexión en su propio hilo, registrándola en las métricas (Metrics)
+    def handle(self, conn, addr, ID):
+        log.bind(ID, addr=addr)
+        metrics.begin()
+        try:
+            self.attend(conn, addr, ID)
+        except Exception:
+            metrics.outcome('error')
+            raise
+        finally:
+            metrics.end()
+
+    # Recibe el encabezado de la petición: operación, nombre del archivo (excepto si
+    # la operación es List) y longitud de los datos. El encabezado debe llegar dentro
+    # del plazo handshakeTimeout; si no, se cierra la conexión. Después ejecuta, en el
+    # mismo hilo, la función correspondiente a la operación solicitada.
+    def attend(self, conn, addr, ID):
+        try:
+            op, name, length = recvHeader(conn, self.handshakeTimeout)
+        except socket.timeout:
+            log.warning('Handshake timeout, closing connection with %s.', addr)
+            metrics.outcome('timeout')
+            conn.close()
+            return
+        except ConnectionError:
+            log.warning('Connection with %s closed before request.', addr)
+            metrics.outcome('lost')
+            conn.close()
+            return
+
+        if op not in OPERATIONS:
+            log.warning('Unknown operation from %s, closing connection.', addr)
+            metrics.outcome('invalid')
+            conn.close()
+            return
+        log.update(op=op, file=name)
+        metrics.operation(op)
+
+        # Admission control
+        # Si ya hay el máximo de operaciones de este tipo en curso, avisa al cliente
+        slots = self.opSlots.get(op)
+        if slots is not None and not slots.acquire(blocking=False):
+            self.busy(conn, addr, ID, op)
+            return
+
+        try:
+            if op == 'ls': # List
+                # El nombre de la petición es el prefijo de los archivos a listar
+                log.debug('List requested.')
+                self.listf(conn, addr, ID, name, length)
+            elif op == 'ss': # Session
+                log.debug('Session requested.')
+                self.session(conn, addr, ID)
+            elif op == 'bu': # Bundle upload
+                log.debug('Bundle upload requested.')
+                self.bundleUpload(conn, addr, ID, length)
+            elif op == 'bd': # Bundle download
+                # El nombre de la petición es el prefijo de los archivos del paquete
+                log.debug('Bundle download requested.')
+                self.bundleDownload(conn, addr, ID, name, length)
+            # Cualquier otra operación necesita el nombre del archivo deseado para
+            # generar el recurso.
+            else:
+                filename = self.layout.path(name)
+                # Busca y obtiene el recurso asociado al archivo
+                resource = self.getResource(filename)
+
+                try:
+                    if op == 'up': # Upload
+                        log.debug('Upload requested.')
+                        resource.upload(conn, addr, ID, length)
+                    elif op == 'dw': # Download
+                        log.debug('Download requested.')
+                        # Descarga parcial: los datos de la petición indican el rango
+                        try:
+                            if length and not RANGE_REQUEST.size <= length <= MAX_REQUEST_DATA: raise struct.error
+                            offset, count, codecs, flags = unpackRange(recvExact(conn, length))
+                        except (struct.error, ConnectionError):
+                            log.warning('Invalid download range from %s, closing connection.', addr)
+                            metrics.outcome('invalid')
+                            conn.close()
+                        else:
+                            resource.download(conn, addr, ID, offset, count, codecs, flags)
+                    elif op == 'dl': # Delete
+                        log.debug('Delete requested.')
+                        resource.delete(conn, addr, ID)
+                    elif op == 'ck': # Checksum
+                        log.debug('Checksum requested.')
+                        resource.checksum(conn, addr, ID)
+                    elif op == 'ru': # Resumable upload
+                        log.debug('Resumable upload requested.')
+                        resource.resume(conn, addr, ID, length)
+                    elif op == 'pu': # Part of a parallel upload
+                        log.debug('Part upload requested.')
+                        resource.part(conn, addr, ID, length)
+                    elif op == 'pc': # Assemble a parallel upload
+                        log.debug('Assemble requested.')
+                        resource.assemble(conn, addr, ID, length)
+                    elif op == 'hv': # Publish existing content
+                        log.debug('Have requested.')
+                        resource.have(conn, addr, ID, length)
+                    elif op == 'dt': # Delta upload
+                        log.debug('Delta upload requested.')
+                        resource.delta(conn, addr, ID, length)
+                    elif op == 'zu': # Compressed and/or verified upload
+                        log.debug('Compressed upload requested.')
+                        try:
+                            codecs, flags = recvUploadOptions(conn)
+                        except ConnectionError:
+                            log.warning('Connection with %s lost before request.', addr)
+                            metrics.outcome('lost')
+                            conn.close()
+                        else:
+                            resource.upload(conn, addr, ID, length, codecs, flags)
+                finally:
+                    self.releaseResource(resource)
+        finally:
+            if slots is not None: slots.release()
+
+    # Sesión
+    # Atiende varias peticiones sobre la misma conexión, en el orden en que llegan, y
+    # responde a cada una con su tag. El cliente puede enviar las peticiones sin
+    # esperar las respuestas (pipelining). La sesión termina con 'qt', al cerrar el
+    # cliente la conexión, o si no llega una nueva petición en sessionTimeout segundos.
+    def session(self, conn, addr, ID):
+        count = 0
+        with conn:
+            # Reply (1)
+            conn.sendall(b'y')
+            metrics.outcome('ok')
+            while True:
+                try:
+                    tag, op, flags, name, length = recvSessionRequest(conn, self.sessionTimeout)
+                except socket.timeout:
+                    log.warning('Session with %s idle, closing connection.', addr)
+                    break
+                except ConnectionError:
+                    break
+                if op == 'qt': break
+
+                try:
+                    self.sessionRequest(conn, ID, tag, op, flags, name, length)
+                except ConnectionError:
+                    log.warning('Session Failed, connection with client in %s was lost.', addr)
+                    metrics.outcome('lost')
+                    break
+                count += 1
+        log.info('Session with %s ended, %s requests attended.', addr, count)
+
+    # Atiende una petición de una sesión
+    def sessionRequest(self, conn, ID, tag, op, flags, name, length):
+        # Petición inválida: se descartan sus datos para seguir con la siguiente. dl y ck
+        # no llevan datos
+        if op not in ('ls', 'up', 'dw', 'dl', 'ck') or (op != 'up' and length > MAX_REQUEST_DATA) \
+                or (op == 'dw' and length not in (0, RANGE_REQUEST.size)) or (op in ('dl', 'ck') and length):
+            discard(conn, length)
+            sendSessionResponse(conn, tag, op, STATUS_BAD_REQUEST)
+            metrics.request(op if op in OPERATIONS else 'none', 'invalid')
+            return
+
+        # Admission control
+        slots = self.opSlots.get(op)
+        if slots is not None and not slots.acquire(blocking=False):
+            with self.statsLock:
+                self.rejectedOps[op] += 1
+            discard(conn, length)
+            sendSessionResponse(conn, tag, op, STATUS_BUSY)
+            metrics.request(op, 'busy')
+            return
+
+        try:
+            if op == 'ls': # List
+                try:
+                    metadata, limit, cursor = unpackListRequest(recvExact(conn, length))
+                except struct.error:
+                    sendSessionResponse(conn, tag, op, STATUS_BAD_REQUEST)
+                    metrics.request(op, 'invalid')
+                    return
+                names, nextCursor = self.files.page(name, cursor, limit)
+                body = packList(names, self.files.stat if metadata else None)
+                sendSessionResponse(conn, tag, op, STATUS_OK, packSessionList(nextCursor, body))
+                status = STATUS_OK
+            else:
+                resource = self.getResource(self.layout.path(name))
+                try:
+                    if op == 'up': # Upload
+                        status = resource.sessionUpload(conn, tag, length, bool(flags & SESSION_REPLACE))
+                    elif op == 'dw': # Download
+                        # Solo el rango: las descargas de una sesión no se comprimen
+                        offset, count = RANGE_REQUEST.unpack(recvExact(conn, length)) if length else (0, 0)
+                        status = resource.sessionDownload(conn, tag, offset, count)
+                    elif op == 'dl': # Delete
+                        status = resource.sessionDelete(conn, tag)
+                    elif op == 'ck': # Checksum
+                        status = resource.sessionChecksum(conn, tag)
+                finally:
+                    self.releaseResource(resource)
+            metrics.request(op, STATUS_OUTCOMES.get(status, 'failed'))
+            if log.sampled('ss'): log.info('Session request #%s %s %s: %s', tag, op, name, status.decode())
+        finally:
+            if slots is not None: slots.release()
+
+    # Paquetes de archivos (ver BUNDLE_FILE)
+    # Cada archivo de un paquete se recibe o envía con su propio recurso, adquirido
+    # solo mientras pasa ese archivo, como en una operación individual; nunca se tiene
+    # más de un recurso a la vez, por lo que un paquete no puede bloquearse (deadlock)
+    # con otras operaciones ni con otros paquetes. Los archivos de un paquete de
+    # descarga se recorren en orden por nombre.
+
+    # Upload de un paquete: publica cada archivo en cuanto termina de llegar, sin
+    # esperar al resto, y al final responde con el status de cada archivo. Los datos se
+    # leen a través de un buffer (BufferedConnection), de tal forma que los archivos
+    # pequeños de un paquete llegan varios en un solo recv.
+    def bundleUpload(self, conn, addr, ID, length):
+        with conn:
+            # Request (1)
+            try:
+                if length != BUNDLE_REQUEST.size: raise struct.error
+                flags, = BUNDLE_REQUEST.unpack(recvExact(conn, length))
+            except (struct.error, ConnectionError):
+                log.warning('Bundle Upload Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+            replace = bool(flags & BUNDLE_REPLACE)
+
+            # Reply (2) y archivos (3)
+            conn.sendall(b'y')
+            statuses = []
+            received = 0
+            try:
+                with BufferedConnection(conn) as source:
+                    while True:
+                        namelen, size = BUNDLE_FILE.unpack(recvExact(source, BUNDLE_FILE.size))
+                        if not namelen: break
+                        name = recvExact(source, namelen)
+                        if not validName(name):
+                            discard(source, size)
+                            statuses.append(STATUS_BAD_REQUEST)
+                            continue
+                        name = name.decode('utf-8')
+                        resource = self.getResource(self.layout.path(name))
+                        start = source.received
+                        try:
+                            status = resource.store(source, size, replace)
+                        except ConnectionError:
+                            raise
+                        except OSError as e:
+                            # Error del disco: se descarta el resto del archivo y el
+                            # paquete sigue con el siguiente
+                            log.warning('Bundle Upload, %s could not be stored: %s', name, e)
+                            discard(source, size - (source.received - start))
+                            status = STATUS_BAD_REQUEST
+                        finally:
+                            self.releaseResource(resource)
+                        statuses.append(status)
+                        if status == STATUS_OK: received += size
+            except ConnectionError:
+                log.warning('Bundle Upload Failed, connection with client in %s was lost after %s files.', addr, len(statuses), bytes=received)
+                metrics.outcome('lost')
+                return
+
+            # Status de cada archivo (4)
+            conn.sendall(packHeader('bu', '', len(statuses)) + b''.join(statuses))
+            log.info('Bundle Upload Successfull, stored %s of %s files from client in %s.', statuses.count(STATUS_OK), len(statuses), addr, bytes=received)
+            metrics.outcome('ok')
+
+    # Download de un paquete: envía los archivos cuyo nombre empieza con prefix y
+    # coincide con el patrón (glob) de la petición. La lista se toma del índice al
+    # iniciar; un archivo eliminado después se reporta con STATUS_NOT_FOUND. Los envíos
+    # se juntan en segmentos completos (corkSocket) mientras dura el paquete.
+    def bundleDownload(self, conn, addr, ID, prefix, length):
+        with conn:
+            # Request (1)
+            if length > MAX_REQUEST_DATA:
+                log.warning('Bundle Download Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+            try:
+                pattern = recvExact(conn, length).decode('utf-8', 'replace')
+            except ConnectionError:
+                log.warning('Bundle Download Failed, connection with client in %s was lost.', addr)
+                metrics.outcome('lost')
+                return
+            names = self.bundleNames(prefix, pattern)
+
+            # Reply (2) y archivos (3)
+            log.debug('Sending bundle (%s files) to client in %s.', len(names), addr)
+            sent = 0
+            try:
+                corkSocket(conn, True)
+                conn.sendall(b'y')
+                for name in names:
+                    resource = self.getResource(self.layout.path(name))
+                    try:
+                        if resource.bundleDownload(conn) == STATUS_OK: sent += 1
+                    finally:
+                        self.releaseResource(resource)
+                conn.sendall(BUNDLE_ENTRY.pack(STATUS_OK, 0, len(names)))
+                corkSocket(conn, False)
+
+                # Confirmation (4)
+                reply = recvExact(conn, 3).decode('utf-8', 'replace')
+            except ConnectionError:
+                log.warning('Bundle Download Failed, connection with client in %s was lost.', addr)
+                metrics.outcome('lost')
+                return
+            if reply == '100':
+                log.info('Bundle Download Successfull, sended %s of %s files to client in %s.', sent, len(names), addr)
+                metrics.outcome('ok')
+            else:
+                log.warning('Bundle Download Failed, client in %s reported error.', addr)
+                metrics.outcome('failed')
+
+    # Nombres (en orden) de los archivos de un paquete de descarga. El prefijo se
+    # extiende con la parte literal del patrón, para buscar en el índice solo los
+    # nombres que pueden coincidir
+    def bundleNames(self, prefix, pattern):
+        literal = re.split(r'[*?[]', pattern, maxsplit=1)[0]
+        if literal.startswith(prefix): prefix = literal
+        names, cursor = self.files.page(prefix)
+        if pattern: names = [name for name in names if fnmatchcase(name, pattern)]
+        return names
+
+    # Responde 'b' (busy, retry later) y cierra la conexión. op es None cuando la
+    # conexión se rechaza antes de conocer la operación (cola del pool llena)
+    def busy(self, conn, addr, ID, op=None):
+        if op is not None:
+            with self.statsLock:
+                self.rejectedOps[op] += 1
+        log.info('Server busy, rejected connection #%s from %s.', ID, addr)
+        # Sin operación, la conexión no llegó a un hilo del pool (ver handle())
+        if op is None: metrics.request('none', 'busy')
+        else: metrics.outcome('busy')
+        try:
+            conn.send(BUSY)
+            conn.shutdown(socket.SHUT_WR)
+        except OSError: pass
+        conn.close()
+
+    # Estado del servidor: hilos del pool, profundidad de la cola y rechazos
+    def stats(self):
+        with self.statsLock:
+            rejected = dict(self.rejectedOps)
+        return {'pool': self.pool.stats(), 'rejected': rejected, 'resources': len(self.resources), 'files': len(self.files),
+                'locks': self.lockStats.snapshot(), 'storage': self.storage.stats(), 'layout': self.layout.stats(), 'cache': self.cache.stats(),
+                'buffers': buffers.stats(), 'checksums': self.checksums.stats()}
 
     # Provee el recurso para el archivo indicado en el parámetro. Si no existe, lo crea.
-    # El método es sincronizado consigo mismo y con removeResource
+    # Cada llamada toma una referencia al recurso, que se debe liberar con
+    # releaseResource al terminar la operación
     def getResource(self, filename):
-        self.resourceLock.acquire()
-        # Busca el recurso en la lista del servidor
-        for resource in self.activeResourceList:
-            if resource.filename == filename:
-                # El recurso fue encontrado
-                self.resourceLock.release()
-                return resource
-        
-        # El recurso no fue encontrado, por lo que se crea uno nuevo asociándolo al
-        # archivo solicitado
-        resource = ResourceFile(filename, self)
-        self.activeResourceList.append(resource)
-        self.resourceLock.release()
-        return resource
-
-
-    # Elimina el recurso que se especifica en el parámetro de la lista del sistema.
-    # El método es sincronizado consigo mismo y con getResource.
-    def removeResource(self, resource):
-        self.resourceLock.acquire()
-        try:
-            self.activeResourceList.remove(resource)
-            self.resourceLock.release()
-            return True
-        except ValueError:
-            self.resourceLock.release()
-            return False
-
-    # Bloqua el sistema de archivos y actualiza la lista de archivos en el sistema
-    def updateFileList(self):
-        self.fileSystemLock.acquire()
-        self.files = [f for f in listdir('./recv') if isfile(join('./recv', f))]
-        self.fileSystemLock.release()
-        
-    # Envía la lista de archivos en el sistema al cliente
-    def listf(self, conn, addr, ID):
-        self.listLock.acquire()
-        self.listCount += 1
-        if self.listCount == 1: self.fileSystemLock.acquire()
-        self.listLock.release()
+        return self.resources.acquire(filename)
 
+    # Libera la referencia al recurso. El recurso se elimina del sistema cuando ninguna
+    # operación lo está utilizando
+    def releaseResource(self, resource):
+        return self.resources.release(resource)
+
+    # Envía la lista de archivos en el sistema al cliente
+    # La lista (o la página solicitada) se construye como una sola trama a partir de
+    # una copia del índice (snapshot), y se envía con un solo sendall. No bloquea a las
+    # operaciones upload() y delete() que se ejecuten mientras tanto.
+    def listf(self, conn, addr, ID, prefix, length):
         with conn:
-            # Sends file list one by one (1)
-            for f in self.files:
-                data = str(f + '\n').encode('utf-8', 'replace')
-                print(f'{datetime.now()} [Server] Sending files list to client in {addr}.')
-                conn.send(data)
-
-            # Confirmation (2)
-            reply = conn.recv(3).decode('utf-8', 'replace')
-            if reply == '100': print(f"{datetime.now()} [Server] 100 List Successfull, sended file list to client in {addr}.")
-            else: print(f"{datetime.now()} [Server] 404 List Failed, client in {addr} reported error.")
-
-        self.listLock.acquire()
-        self.listCount -= 1
-        if self.listCount == 0: self.fileSystemLock.release()
-        self.listLock.release()
+            # Request (1)
+            # Parámetros de la lista: metadatos, límite de la página y cursor
+            if length > MAX_REQUEST_DATA:
+                log.warning('404 List Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+            try:
+                metadata, limit, cursor = unpackListRequest(recvExact(conn, length))
+            except (ConnectionError, struct.error):
+                log.warning('404 List Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+
+            names, nextCursor = self.files.page(prefix, cursor, limit)
+            body = packList(names, self.files.stat if metadata else None)
+
+            # Reply (2) y lista de archivos (3)
+            log.debug('Sending files list (%s files) to client in %s.', len(names), addr)
+            conn.sendall(b'y' + packHeader('ls', nextCursor, len(body)) + body)
+
+            # Confirmation (4)
+            try:
+                reply = recvExact(conn, 3).decode('utf-8', 'replace')
+            except ConnectionError:
+                log.warning('404 List Failed, connection with client in %s was lost.', addr)
+                metrics.outcome('lost')
+                return
+            if reply == '100':
+                log.info('100 List Successfull, sended file list to client in %s.', addr)
+                metrics.outcome('ok')
+            else:
+                log.warning('404 List Failed, client in %s reported error.', addr)
+                metrics.outcome('failed')
 
     # Escucha de entrada para finalizar la ejecución del servidor
     # Se debe ejecutar en un hilo por separado, de tal forma que se mantenga escuchado
     # una entrada de teclado cualquiera. Esto permite que el servidor pueda detener
     # su ejecución incluso si se bloquea al esperar conexiones o datos del cliente.
-    def listen_for_closing(self):
+    # La entrada 'stats' muestra el estado del servidor sin detenerlo, y 'rescan'
+    # reconstruye el índice de archivos recorriendo el directorio (y vacía la caché).
+    # En modo pre-fork las entradas llegan del proceso principal por commands (un
+    # pipe); si se cierra, el servidor se detiene.
+    def listen_for_closing(self, commands=None):
         while True:
-            input()
+            command = (commands.readline() if commands else input()).strip()
+            if command == 'stats':
+                print(f'{datetime.now()} [Server] Stats: {self.stats()}')
+                continue
+            if command == 'rescan':
+                self.cache.clear()
+                print(f'{datetime.now()} [Server] File index rebuilt, {self.files.reconcile()} files found.')
+                continue
             break
         self.s.close()
 
-# Main
-if __name__ == '__main__':
-    print('Server Log:')
+CONSOLE_HELP = 'Press Enter to end process, or type "stats" to show server status or "rescan" to rebuild the file index.'
+CONSOLE_COMMANDS = ('stats', 'rescan')
+
+# Crea el directorio de los archivos de la organización layout si no existe, elimina
+# los temporales de uploads que una ejecución anterior no terminó y compacta el índice
+# de checksums
+def prepareDirectory(layout):
+    if not isdir(layout.root):
+        try:
+            log.info('Creating directory ./%s for incoming files.', layout.root)
+            mkdir(layout.root)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+
+    removed = removeTemporaries(layout.scan())
+    if removed: log.info('Removed %s temporary files of unfinished uploads from ./%s.', removed, layout.root)
+    compacted = compactChecksums(layout.root)
+    if compacted: log.info('Compacted checksum index of ./%s, %s bytes removed.', layout.root, compacted)
+
+# Longitud máxima (bytes, UTF-8) del nombre de un archivo de un paquete: deja lugar
+# para el prefijo y el sufijo de sus temporales dentro de los 255 bytes de un nombre
+MAX_NAME_LENGTH = 200
+
+# Verifica que name (bytes) pueda ser el nombre de un archivo del servidor (un paquete
+# no puede crear archivos fuera de ./recv ni en subdirectorios)
+def validName(name):
     try:
-        PORT = int(sys.argv[1])
-        server = MainServer(port=PORT)
-    except :
-        print(f'{datetime.now()} [Server] Port not specified. Using default port.')
-        server = MainServer()
+        text = name.decode('utf-8')
+    except UnicodeDecodeError:
+        return False
+    return len(name) <= MAX_NAME_LENGTH and text not in ('', '.', '..') and '/' not in text and '\0' not in text
+
+# Modo pre-fork
+# Crea processes procesos worker con fork; cada uno ejecuta serve(worker, commands),
+# donde worker es su número (0, 1, ...) y commands el pipe por el que recibe las
+# entradas de teclado. El proceso principal no atiende conexiones: reenvía las
+# entradas a todos los workers (Enter los detiene a todos) y espera a que terminen,
+# registrando los que terminan de forma inesperada.
+#
+# Se ejecuta antes de crear cualquier hilo, pues fork solo copia el hilo actual.
+def prefork(processes, serve):
+    children = {} # pid -> (worker, pipe de entradas)
+    for worker in range(processes):
+        sys.stdout.flush()
+        r, w = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(w)
+            for _, pipe in children.values(): pipe.close()
+            code = 0
+            try:
+                with os.fdopen(r) as commands:
+                    serve(worker, commands)
+            except BaseException:
+                traceback.print_exc()
+                code = 1
+            finally:
+                sys.stdout.flush()
+                os._exit(code)
+        os.close(r)
+        children[pid] = (worker, os.fdopen(w, 'w'))
+    return children
+
+# Reenvía las entradas de teclado a los workers (en un hilo aparte) hasta que una de
+# ellas los detenga
+def forwardCommands(children):
+    stopping = False
+    try:
+        while not stopping:
+            command = input()
+            stopping = command.strip() not in CONSOLE_COMMANDS
+            for worker, pipe in list(children.values()):
+                try:
+                    pipe.write(command + '\n')
+                    pipe.flush()
+                except OSError: pass
+    except EOFError:
+        return
+    for worker, pipe in list(children.values()):
+        try: pipe.close()
+        except OSError: pass
+
+# Espera a que terminen los workers. Regresa False si alguno terminó con error
+def waitWorkers(children):
+    ok = True
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker, pipe = children.pop(pid, (None, None))
+        code = os.waitstatus_to_exitcode(status)
+        if code: log.error('Worker %s (pid %s) ended unexpectedly with exit code %s.', worker, pid, code)
+        else: log.info('Worker %s (pid %s) ended.', worker, pid)
+        ok = ok and not code
+    return ok
+
+# ParseArgs() recibe los argumentos de ejecución desde línea de comandos.
+# py MainServer.py [port] [-e threads|asyncio] [-p processes] [-t handshake timeout] [-w workers]
+#                   [-q queue size] [--max-ls N] [--max-up N] [--max-dw N] [--max-dl N]
+#                   [--max-ss N] [--max-ru N] [--max-pu N] [--max-pc N] [--max-hv N]
+#                   [--max-dt N] [--max-zu N] [--max-bu N] [--max-bd N] [--max-ck N]
+#                   [--session-timeout seconds] [--fsync none|file|full] [--dedup] [--no-scan]
+#                   [--layout flat|sharded]
+#                   [--cache-size MiB] [--cache-file-size KiB] [--buffer-size KiB] [--socket-buffer KiB]
+#                   [--log-level debug|info|warning|error] [--log-format text|json] [--log-sample N]
+#                   [--metrics-port N] [--metrics-file path] [--metrics-interval seconds]
+def ParseArgs():
+    parser = argparse.ArgumentParser(description='Simple FTP Server')
+
+    parser.add_argument('port',
+                    nargs='?',
+                    type=int,
+                    default=None,
+                    help='The port of the server.')
+
+    parser.add_argument('-e','--engine',
+                    choices=['threads', 'asyncio'],
+                    default='threads',
+                    help='Server engine: one thread per connection, or asyncio event loop.')
+
+    parser.add_argument('-p','--processes',
+                    type=int,
+                    default=1,
+                    help='Worker processes sharing the port (SO_REUSEPORT, threads engine only); 1 runs a single process.')
+
+    parser.add_argument('-t','--handshake-timeout',
+                    type=float,
+                    default=10,
+                    dest='handshakeTimeout',
+                    help='Seconds a client has to send its request after connecting.')
+
+    parser.add_argument('--session-timeout',
+                    type=float,
+                    default=60,
+                    dest='sessionTimeout',
+                    help='Seconds an idle session waits for its next request (threads engine).')
+
+    parser.add_argument('--fsync',
+                    choices=FSYNC_LEVELS,
+                    default='none',
+                    help='Flush uploaded files to disk before publishing them ("full" also flushes the directory).')
+
+    parser.add_argument('--cache-size',
+                    type=int,
+                    default=64,
+                    dest='cacheSize',
+                    help='Memory (MiB) for the cache of small, frequently downloaded files (0 disables it).')
+
+    parser.add_argument('--cache-file-size',
+                    type=int,
+                    default=1024,
+                    dest='cacheFileSize',
+                    help='Largest file (KiB) kept in the cache.')
+
+    parser.add_argument('--buffer-size',
+                    type=int,
+                    default=256,
+                    dest='bufferSize',
+                    help='Size (KiB) of the reusable transfer buffers: largest receive and disk write of a transfer.')
+
+    parser.add_argument('--socket-buffer',
+                    type=int,
+                    default=0,
+                    dest='socketBuffer',
+                    help='Kernel send/receive buffer (KiB) of each connection (0 leaves the OS autotuning).')
+
+    parser.add_argument('--dedup',
+                    action='store_true',
+                    default=False,
+                    help='Store each distinct content once (./recv/.blobs), linked from every file name that has it.')
+
+    parser.add_argument('--layout',
+                    choices=LAYOUTS,
+                    default='flat',
+                    help='Keep every file in ./recv, or in hashed subdirectories ./recv/XX/YY (see Migrate.py).')
+
+    parser.add_argument('-w','--workers',
+                    type=int,
+                    default=32,
+                    help='Worker threads: connection pool of the threads engine, disk I/O of the asyncio engine.')
+
+    parser.add_argument('-q','--queue-size',
+                    type=int,
+                    default=64,
+                    dest='queueSize',
+                    help='Accepted connections waiting for a worker before replying busy (threads engine).')
+
+    for op, name in zip(OPERATIONS, ('list', 'upload', 'download', 'delete', 'session', 'resumable upload',
+                                          'part upload', 'assemble', 'have', 'delta upload',
+                                          'compressed upload', 'bundle upload', 'bundle download', 'checksum')):
+        parser.add_argument(f'--max-{op}',
+                    type=int,
+                    default=None,
+                    dest=f'max_{op}',
+                    help=f'Maximum simultaneous {name} operations before replying busy.')
+
+    parser.add_argument('--log-level',
+                    choices=LOG_LEVELS,
+                    default='info',
+                    dest='logLevel',
+                    help='Minimum level of the messages written to the log (debug shows every step).')
+
+    parser.add_argument('--log-format',
+                    choices=LOG_FORMATS,
+                    default='text',
+                    dest='logFormat',
+                    help='Log format: text lines, or one JSON object per line.')
+
+    parser.add_argument('--log-sample',
+                    type=int,
+                    default=1,
+                    dest='logSample',
+                    help='Log only 1 of every N per-item messages (session requests, part uploads).')
+
+    parser.add_argument('--metrics-port',
+                    type=int,
+                    default=None,
+                    dest='metricsPort',
+                    help='Serve Prometheus metrics on http://127.0.0.1:PORT/metrics.')
+
+    parser.add_argument('--metrics-file',
+                    default=None,
+                    dest='metricsFile',
+                    help='Write Prometheus metrics to this file periodically and at shutdown.')
+
+    parser.add_argument('--metrics-interval',
+                    type=float,
+                    default=10,
+                    dest='metricsInterval',
+                    help='Seconds between writes of --metrics-file.')
+
+    parser.add_argument('--no-scan',
+                    action='store_false',
+                    dest='scan',
+                    default=True,
+                    help="Don't scan ./recv at startup; the file index starts empty (use \"rescan\" later).")
+
+    return parser.parse_args()
+
+# Ejecuta un servidor hasta que se detenga. En modo pre-fork, worker es el número del
+# proceso worker y commands el pipe de sus entradas de teclado
+def serve(argv, worker=None, commands=None):
+    log.setup(argv.logLevel, argv.logFormat, 'Task' if argv.engine == 'asyncio' else 'Thread', argv.logSample, worker=worker)
+    buffers.configure(argv.bufferSize << 10)
+    kwargs = {'handshakeTimeout': argv.handshakeTimeout,
+              'scan': argv.scan,
+              'fsync': argv.fsync,
+              'dedup': argv.dedup,
+              'layout': argv.layout,
+              'socketBuffer': argv.socketBuffer << 10,
+              'cacheSize': argv.cacheSize << 20,
+              'cacheFileSize': argv.cacheFileSize << 10,
+              'workers': argv.workers,
+              'opLimits': {op: getattr(argv, f'max_{op}') for op in OPERATIONS}}
+    if argv.port is None:
+        if not worker: log.info('Port not specified. Using default port.')
+    else:
+        kwargs['port'] = argv.port
+
+    if argv.engine == 'asyncio':
+        from AsyncMainServer import AsyncMainServer
+        server = AsyncMainServer(**kwargs)
+    else:
+        server = MainServer(queueSize=argv.queueSize, sessionTimeout=argv.sessionTimeout, shared=worker is not None, **kwargs)
+
+    # Métricas: servidor HTTP local y/o archivo. En modo pre-fork, cada worker usa el
+    # puerto siguiente al del anterior y su propio archivo (terminado en .N)
+    metricsFile = argv.metricsFile and (argv.metricsFile if worker is None else f'{argv.metricsFile}.{worker}')
+    if argv.metricsPort is not None:
+        metricsPort = argv.metricsPort + (worker or 0)
+        metrics.serve(server, '127.0.0.1', metricsPort)
+        log.info('Metrics available on http://127.0.0.1:%s/metrics.', metricsPort)
+    if metricsFile:
+        metrics.dumpEvery(server, metricsFile, argv.metricsInterval)
 
     # Ejecuta el hilo para la finalización de la ejecución
-    threading._start_new_thread(server.listen_for_closing, ())
+    threading._start_new_thread(server.listen_for_closing, (commands,))
     # Ejecuta el servidor (no es un hilo aparte, la función se ejecuta sobre el
     # mismo hilo actual)
     server.start()
+    if metricsFile: metrics.dump(server, metricsFile)
+    # Escribe los mensajes pendientes de la bitácora
+    log.stop()
+
+# Main
+if __name__ == '__main__':
+    print('Server Log:')
+    argv = ParseArgs()
+    if argv.processes <= 1:
+        serve(argv)
+    else:
+        # Modo pre-fork: los semáforos del motor asyncio (AsyncRWLock) y el índice de
+        # los blobs (--dedup) son propios de cada proceso
+        if argv.engine != 'threads': sys.exit('--processes requires the threads engine.')
+        if argv.dedup: sys.exit('--processes cannot be combined with --dedup.')
+        log.setup(argv.logLevel, argv.logFormat, 'Thread', argv.logSample)
+        prepareDirectory(makeLayout(argv.layout, './recv'))
+        log.info('Starting %s worker processes.', argv.processes)
+        log.stop()
+
+        children = prefork(argv.processes, lambda worker, commands: serve(argv, worker, commands))
+        log.setup(argv.logLevel, argv.logFormat, 'Thread', argv.logSample)
+        print(CONSOLE_HELP)
+        threading.Thread(target=forwardCommands, args=(children,), daemon=True).start()
+        ok = waitWorkers(children)
+        log.stop()
+        # Termina sin esperar al hilo que reenvía las entradas, que puede seguir
+        # esperando el teclado
+        sys.stdout.flush()
+        os._exit(0 if ok else 1)
@@ -0,0 +1,230 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Metrics
+# Métricas del servidor en el formato de texto de Prometheus, para saber si la lentitud
+# se debe a la espera de los semáforos, al disco o a la red.
+#
+# Cada conexión es una petición: begin() al aceptarla, operation(op) al conocer la
+# operación y end() al terminar. Los recursos indican el resultado de la operación
+# (outcome: 'ok', 'aborted', 'lost', 'not_found'...) y los bytes recibidos y enviados;
+# los semáforos RWLock agregan a la petición el tiempo que esperó por ellos
+# (lockWait). Al terminar se registran:
+# ftp_requests_total{op, outcome}   peticiones por operación y resultado
+# ftp_bytes_total{direction}        bytes de archivo recibidos (in) y enviados (out)
+# ftp_request_seconds{op}           duración total de la petición (histograma)
+# ftp_lock_wait_seconds{op}         tiempo de espera por el recurso (histograma)
+# ftp_transfer_seconds{op}          duración sin la espera: red y disco (histograma)
+#
+# Como el contexto de la bitácora (Log), la petición actual se guarda en una
+# ContextVar, propia de cada hilo y de cada tarea de asyncio. Las operaciones de una
+# sesión se cuentan con request(), con su propia operación, y sus bytes con
+# transferred().
+#
+# Las métricas se exponen en http://127.0.0.1:PORT/metrics (serve()) o se escriben cada
+# cierto tiempo en un archivo (dump()).
+METRIC_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 60)
+
+# Resultado de las respuestas de una sesión (ver Protocol.STATUS_*)
+STATUS_OUTCOMES = {b'100': 'ok', b'400': 'invalid', b'404': 'not_found', b'409': 'exists', b'503': 'busy'}
+
+current = contextvars.ContextVar('metrics request', default=None)
+
+class Histogram:
+    def __init__(self):
+        self.buckets = [0] * (len(METRIC_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.buckets[bisect_left(METRIC_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+class Metrics:
+    def __init__(self):
+        self.lock = threading.Lock() # Semáforo para los contadores y los histogramas
+        self.connections = 0 # Conexiones activas
+        self.active = Counter() # Operación -> peticiones en curso
+        self.requests = Counter() # (operación, resultado) -> peticiones terminadas
+        self.bytes = Counter() # 'in' / 'out' -> bytes de archivo
+        self.histograms = {} # (métrica, operación) -> Histogram
+
+    # Inicio de una conexión (petición) en el hilo o tarea actual
+    def begin(self):
+        current.set({'op': '', 'outcome': None, 'start': time.monotonic(), 'wait': 0.0, 'in': 0, 'out': 0})
+        with self.lock:
+            self.connections += 1
+
+    # Operación de la petición actual, al recibir el encabezado
+    def operation(self, op):
+        request = current.get()
+        if request is None: return
+        request['op'] = op
+        with self.lock:
+            self.active[op] += 1
+
+    # Resultado de la petición actual y bytes de archivo recibidos y enviados
+    def outcome(self, outcome, bytesIn=0, bytesOut=0):
+        request = current.get()
+        if request is None: return
+        request['outcome'] = outcome
+        request['in'] += bytesIn
+        request['out'] += bytesOut
+
+    # Bytes de archivo recibidos y enviados por la petición actual, sin cambiar su
+    # resultado (p. ej. en cada operación de una sesión)
+    def transferred(self, bytesIn=0, bytesOut=0):
+        request = current.get()
+        if request is None: return
+        request['in'] += bytesIn
+        request['out'] += bytesOut
+
+    # Tiempo que la petición actual esperó por un semáforo
+    def lockWait(self, seconds):
+        request = current.get()
+        if request is not None: request['wait'] += seconds
+
+    # Fin de la petición actual: registra su resultado y sus tiempos
+    def end(self):
+        request = current.get()
+        if request is None: return
+        current.set(None)
+        op = request['op'] or 'none'
+        duration = time.monotonic() - request['start']
+        with self.lock:
+            self.connections -= 1
+            if request['op']: self.active[op] -= 1
+            self.requests[op, request['outcome'] or 'closed'] += 1
+            self.bytes['in'] += request['in']
+            self.bytes['out'] += request['out']
+            self.observe('request', op, duration)
+            self.observe('lock_wait', op, request['wait'])
+            self.observe('transfer', op, max(duration - request['wait'], 0.0))
+
+    # Operación atendida dentro de otra petición (p. ej. en una sesión)
+    def request(self, op, outcome):
+        with self.lock:
+            self.requests[op, outcome] += 1
+
+    # Se ejecuta con self.lock adquirido
+    def observe(self, name, op, value):
+        histogram = self.histograms.get((name, op))
+        if histogram is None: histogram = self.histograms[name, op] = Histogram()
+        histogram.observe(value)
+
+    # Métricas en el formato de texto de Prometheus. server provee los semáforos
+    # (lockStats) y la caché
+    def render(self, server):
+        lines = []
+        def metric(name, kind, help, samples):
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {kind}')
+            for labels, value in samples:
+                lines.append(f'{name}{labels} {value}')
+
+        with self.lock:
+            metric('ftp_connections', 'gauge', 'Open client connections.', [('', self.connections)])
+            metric('ftp_active_requests', 'gauge', 'Requests in progress by operation.',
+                   [(labels(op=op), n) for op, n in sorted(self.active.items())])
+            metric('ftp_requests_total', 'counter', 'Finished requests by operation and outcome.',
+                   [(labels(op=op, outcome=outcome), n) for (op, outcome), n in sorted(self.requests.items())])
+            metric('ftp_bytes_total', 'counter', 'File bytes received (in) and sent (out).',
+                   [(labels(direction=d), self.bytes[d]) for d in ('in', 'out')])
+            for name, help in (('request', 'Request duration.'), ('lock_wait', 'Time spent waiting for file locks.'),
+                               ('transfer', 'Request duration without lock waits (network and disk).')):
+                samples = []
+                for (metricName, op), histogram in sorted(self.histograms.items()):
+                    if metricName == name:
+                        samples += histogramSamples(METRIC_BUCKETS, histogram.buckets, histogram.total, histogram.count, op=op)
+                metric(f'ftp_{name}_seconds', 'histogram', help, samples)
+
+        locks = server.lockStats.snapshot()
+        metric('ftp_lock_holders', 'gauge', 'Readers and writers holding a file lock.',
+               [(labels(mode=mode), s['holding']) for mode, s in locks.items()])
+        metric('ftp_lock_waiters', 'gauge', 'Readers and writers waiting for a file lock.',
+               [(labels(mode=mode), s['waiting']) for mode, s in locks.items()])
+        samples = []
+        for mode, s in locks.items():
+            samples += histogramSamples(server.lockStats.bounds, list(s['buckets'].values()), s['total'], s['count'], mode=mode)
+        metric('ftp_lock_acquire_seconds', 'histogram', 'Wait to acquire a file lock, by mode.', samples)
+
+        cache = server.cache.stats()
+        metric('ftp_cache_bytes', 'gauge', 'Bytes in the file cache.', [('', cache['bytes'])])
+        metric('ftp_cache_events_total', 'counter', 'File cache hits, misses, evictions and invalidations.',
+               [(labels(event=e), cache[e]) for e in ('hits', 'misses', 'evictions', 'invalidations')])
+        return '\n'.join(lines) + '\n'
+
+    # Escribe las métricas en filename (reemplazándolo atómicamente)
+    def dump(self, server, filename):
+        temp = f'{filename}.tmp'
+        with open(temp, 'w') as f:
+            f.write(self.render(server))
+        os.replace(temp, filename)
+
+    # Escribe las métricas en filename cada interval segundos, en un hilo aparte
+    def dumpEvery(self, server, filename, interval):
+        def loop():
+            while True:
+                time.sleep(interval)
+                self.dump(server, filename)
+        threading.Thread(target=loop, name='Metrics', daemon=True).start()
+
+    # Atiende GET /metrics en host:port, en un hilo aparte. Regresa el servidor HTTP
+    def serve(self, server, host, port):
+        metrics = self
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = metrics.render(server).encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        http = ThreadingHTTPServer((host, port), Handler)
+        http.daemon_threads = True
+        threading.Thread(target=http.serve_forever, name='Metrics', daemon=True).start()
+        return http
+
+def labels(**values):
+    return '{' + ','.join(f'{k}="{v}"' for k, v in values.items()) + '}'
+
+# Muestras de un histograma (buckets acumulados, suma y cuenta). counts tiene un valor
+# por límite de bounds y uno más para los valores mayores
+def histogramSamples(bounds, counts, total, count, **values):
+    samples = []
+    cumulative = 0
+    for bound, n in zip(bounds, counts):
+        cumulative += n
+        samples.append((labels(**values, le=bound), cumulative))
+    samples.append((labels(**values, le='+Inf'), count))
+    name = labels(**values)
+    return [(f'_bucket{l}', n) for l, n in samples] + [(f'_sum{name}', round(total, 6)), (f'_count{name}', count)]
+
+metrics = Metrics()
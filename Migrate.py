@@ -0,0 +1,152 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import sys
+import argparse
+from os.path import join, dirname, exists
+from Layout import LAYOUTS, FlatLayout, ShardedLayout, makeLayout, isShard
+from StagedFile import TEMP_PREFIX, TEMP_SUFFIX, PARTIAL_SUFFIX, MULTIPART_SUFFIX, RANGES_SUFFIX
+
+# Migrate
+# Cambia la organización (Layout) de un directorio de archivos del servidor, p. ej. de
+# flat (./recv/NAME) a sharded (./recv/XX/YY/NAME) o al revés. El servidor debe estar
+# detenido.
+#
+# Cada archivo se mueve con un rename a su ruta en la nueva organización, por lo que no
+# se copian datos y los enlaces a los blobs (--dedup) se conservan. Los temporales de
+# uploads reanudables y por partes se mueven junto con su archivo, para que el upload
+# pueda continuar; los de uploads normales se dejan, el servidor los elimina al
+# iniciar. Se puede volver a ejecutar si se interrumpe: los archivos que ya están en su
+# lugar no se modifican. Si el destino ya existe (el mismo nombre en las dos
+# organizaciones), el archivo no se mueve y se reporta.
+#
+# Un archivo con nombre de subdirectorio (p. ej. 'ab') en la raíz ocupa el lugar de un
+# subdirectorio de sharded, por lo que esos archivos se mueven primero a un directorio
+# de paso (HOLDING) y al final (después de eliminar los subdirectorios vacíos, al
+# migrar a flat) a su destino.
+HOLDING = '.migrating'
+
+# Nombre del archivo al que pertenece el archivo (o temporal) name, o None si es un
+# temporal que no se conserva. Los temporales de un upload por partes llevan además el
+# identificador del upload (ver StagedFile.Multipart)
+def ownerName(name):
+    if name.startswith(TEMP_PREFIX):
+        if name.endswith(PARTIAL_SUFFIX): return name[len(TEMP_PREFIX):-len(PARTIAL_SUFFIX)]
+        for suffix in (MULTIPART_SUFFIX, RANGES_SUFFIX):
+            if name.endswith(suffix): return name[len(TEMP_PREFIX):-len(suffix)].rpartition('.')[0]
+        if name.endswith(TEMP_SUFFIX): return None
+    return name
+
+# Mueve source a target, creando su directorio. Regresa False si target ya existe
+def move(source, target):
+    if exists(target): return False
+    os.makedirs(dirname(target), exist_ok=True)
+    os.rename(source, target)
+    return True
+
+def migrate(root, to, dryRun=False, progress=100000):
+    target = makeLayout(to, root)
+    root = target.root
+    holding = join(root, HOLDING)
+    counts = {'moved': 0, 'in_place': 0, 'conflicts': 0}
+
+    # Archivos de ambas organizaciones (y de una migración interrumpida)
+    entries = [(e.path, e.name) for e in FlatLayout(root).scan()]
+    entries += [(e.path, e.name) for e in ShardedLayout(root).scan()]
+    if os.path.isdir(holding):
+        entries += [(e.path, e.name) for e in FlatLayout(holding).scan()]
+
+    # Los archivos de la raíz con nombre de subdirectorio se mueven a HOLDING antes que
+    # los demás, que pueden necesitar ese subdirectorio
+    entries.sort(key=lambda entry: not (isShard(entry[1]) and dirname(entry[0]) == root))
+
+    pending = [] # (origen, destino) de los archivos que pasan por HOLDING
+    for path, name in entries:
+        owner = ownerName(name)
+        if owner is None: continue
+        destination = join(dirname(target.location(owner)), name)
+        if path == destination:
+            counts['in_place'] += 1
+            continue
+        if dryRun:
+            counts['moved'] += 1
+            continue
+
+        # Un archivo con nombre de subdirectorio que va o está en la raíz pasa por HOLDING
+        if isShard(name) and root in (dirname(path), dirname(destination)) or dirname(path) == holding:
+            if dirname(path) != holding:
+                if not move(path, join(holding, name)):
+                    counts['conflicts'] += 1
+                    print(f'[-] Conflict: {join(holding, name)} already exists, {path} not moved.', file=sys.stderr)
+                    continue
+                path = join(holding, name)
+            pending.append((path, destination))
+            continue
+
+        if move(path, destination):
+            counts['moved'] += 1
+            if counts['moved'] % progress == 0: print(f'[+] {counts["moved"]} files moved...', file=sys.stderr)
+        else:
+            counts['conflicts'] += 1
+            print(f'[-] Conflict: {destination} already exists, {path} not moved.', file=sys.stderr)
+
+    # Los subdirectorios vacíos de sharded (al migrar a flat)
+    if to == 'flat' and not dryRun:
+        for directory in reversed(list(ShardedLayout(root).directories())):
+            for d in (directory, dirname(directory)):
+                try: os.rmdir(d)
+                except OSError: pass
+
+    for path, destination in pending:
+        if move(path, destination):
+            counts['moved'] += 1
+        else:
+            counts['conflicts'] += 1
+            print(f'[-] Conflict: {destination} already exists, {path} not moved.', file=sys.stderr)
+    try: os.rmdir(holding)
+    except OSError: pass
+    return counts
+
+# ParseArgs() recibe los argumentos de ejecución desde línea de comandos.
+# py Migrate.py [root] [--to flat|sharded] [--dry-run]
+def ParseArgs():
+    parser = argparse.ArgumentParser(description='Change the on-disk layout of the files of a stopped FTP server.')
+
+    parser.add_argument('root',
+                    nargs='?',
+                    default='./recv',
+                    help='Directory of the server files.')
+
+    parser.add_argument('--to',
+                    choices=LAYOUTS,
+                    default='sharded',
+                    help='New layout (the one the server will be started with, --layout).')
+
+    parser.add_argument('--dry-run',
+                    action='store_true',
+                    default=False,
+                    dest='dryRun',
+                    help='Only count the files that would be moved.')
+
+    return parser.parse_args()
+
+# Main
+if __name__ == '__main__':
+    argv = ParseArgs()
+    if not os.path.isdir(argv.root): sys.exit(f'{argv.root} is not a directory.')
+    counts = migrate(argv.root, argv.to, argv.dryRun)
+    print(f'[+] {"Would move" if argv.dryRun else "Moved"} {counts["moved"]} files to the {argv.to} layout; '
+          f'{counts["in_place"]} already in place, {counts["conflicts"]} conflicts.')
+    if counts['conflicts']: sys.exit(1)
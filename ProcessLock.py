@@ -0,0 +1,83 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import fcntl
+import struct
+import hashlib
+
+# ProcessLock
+# Semáforo entre procesos (modo pre-fork, --processes) sobre un byte de un archivo de
+# semáforos compartido, con los byte-range locks de fcntl. El archivo está junto al
+# directorio de los archivos (./recv.locks), no dentro, para que no forme parte de la
+# lista.
+#
+# Se usan los locks de descripción de archivo abierto (OFD, F_OFD_SETLK) de Linux en
+# lugar de los locks POSIX clásicos: los POSIX pertenecen al proceso, por lo que dos
+# hilos del mismo proceso no se excluyen entre sí y cerrar cualquier descriptor del
+# archivo los libera todos. Cada adquisición abre su propio descriptor, que es el dueño
+# del lock, y al liberarlo se cierra; así no queda ningún descriptor abierto por
+# recurso, y si el proceso termina el sistema operativo libera sus locks.
+#
+# El byte de cada nombre (key) se obtiene de su SHA-256; dos nombres con el mismo byte
+# solo se esperan entre sí de más, nunca se pierde la exclusión. Dentro de un proceso,
+# el acceso lo coordina el RWLock del recurso, por lo que un ProcessLock nunca es
+# adquirido por dos hilos al mismo tiempo.
+LOCK_SUFFIX = '.locks'
+LOCK_RANGE = 1 << 62 # Bytes posibles del archivo de semáforos
+
+class ProcessLock:
+    def __init__(self, path, key):
+        self.path = path # Archivo de semáforos
+        self.offset = int.from_bytes(hashlib.sha256(key.encode('utf-8', 'surrogateescape')).digest()[:8], 'big') % LOCK_RANGE
+        self.fd = None # Descriptor que tiene el lock
+
+    def lock(self, kind, wait=True):
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.fcntl(fd, fcntl.F_OFD_SETLKW if wait else fcntl.F_OFD_SETLK,
+                        struct.pack('hhqqi', kind, os.SEEK_SET, self.offset, 1, 0))
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    # Lector: compartido con los lectores de otros procesos
+    def lockRead(self):
+        self.lock(fcntl.F_RDLCK)
+
+    # Escritor: exclusivo
+    def lockWrite(self):
+        self.lock(fcntl.F_WRLCK)
+
+    # Escritor sin esperar. Regresa False si otro proceso tiene el lock
+    def tryLock(self):
+        try:
+            self.lock(fcntl.F_WRLCK, wait=False)
+        except (BlockingIOError, PermissionError):
+            return False
+        return True
+
+    def unlock(self):
+        fd, self.fd = self.fd, None
+        os.close(fd)
+
+# Semáforos entre procesos de los archivos de un directorio
+class ProcessLocks:
+    def __init__(self, root):
+        self.path = os.path.normpath(root) + LOCK_SUFFIX
+
+    # Semáforo del archivo name; kind distingue semáforos independientes del mismo archivo
+    def get(self, name, kind='rw'):
+        return ProcessLock(self.path, f'{kind}:{name}')
@@ -0,0 +1,580 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import io
+import os
+import asyncio
+import time
+import errno
+import socket
+import struct
+import hashlib
+from BufferPool import buffers, tuneSocket
+
+# Protocol
+# Funciones comunes al servidor y al cliente para el manejo de tramas (frames).
+#
+# Cada petición comienza con un encabezado binario de tamaño fijo:
+#   op      (2 bytes)  Tipo de operación: 'ls', 'up', 'dw', 'dl'
+#   namelen (2 bytes)  Longitud en bytes del nombre del archivo
+#   length  (8 bytes)  Longitud en bytes de los datos que acompañan a la trama
+#                      (para 'up', el tamaño del archivo; para 'ls', sus parámetros)
+# seguido de namelen bytes con el nombre del archivo (UTF-8). Los datos de un archivo
+# se envían con el mismo encabezado y después exactamente length bytes, de tal forma
+# que el receptor sabe cuándo termina la transferencia sin esperar un timeout.
+HEADER = struct.Struct('!2sHQ')
+MAX_REQUEST_DATA = 4096 # Máximo de datos de una petición que no transfiere un archivo
+
+# Operaciones del protocolo. 'ss' inicia una sesión (ver SESSION_REQUEST), 'ru'
+# continúa un upload interrumpido (ver RESUME_OFFSET), 'pu' y 'pc' suben un archivo
+# por partes (ver PART_REQUEST), 'hv' publica un contenido que el servidor ya tiene
+# (ver HAVE_REQUEST), 'dt' sube solo las diferencias con la versión del servidor (ver
+# DELTA_SIGNATURE), 'zu' sube un archivo comprimido (ver COMPRESSED_CHUNK), 'bu' y
+# 'bd' suben y descargan varios archivos en un paquete (ver BUNDLE_FILE) y 'ck'
+# consulta el SHA-256 de un archivo (ver CHECKSUM_REPLY)
+OPERATIONS = ('ls', 'up', 'dw', 'dl', 'ss', 'ru', 'pu', 'pc', 'hv', 'dt', 'zu', 'bu', 'bd', 'ck')
+
+# Descarga parcial (dw)
+# Si la petición dw lleva datos, son offset (8 bytes) y count (8 bytes, 0 = hasta el
+# final del archivo), y opcionalmente la lista de compresiones que acepta el cliente
+# (packCodecs) seguida de flags (1 byte). La trama 'dw' de la respuesta indica cuántos
+# bytes se envían y, en el campo del nombre, la compresión elegida por el servidor
+# ('' = sin compresión). Con RANGE_VERIFY, el servidor envía después de los datos el
+# SHA-256 (32 bytes) de los bytes enviados (sin comprimir), para que el cliente
+# verifique lo que recibió.
+RANGE_REQUEST = struct.Struct('!QQ')
+RANGE_VERIFY = 0x01
+
+# Compresión (dw, zu)
+# El cliente ofrece una lista de compresiones (nombres separados por comas, precedidos
+# por su longitud en 1 byte) y el servidor elige la primera que soporta, o ninguna si
+# los datos no parecen comprimibles (ver Compression). Los datos comprimidos se envían
+# en tramas de COMPRESSED_CHUNK (longitud, 4 bytes) seguida de los datos, y terminan
+# con una trama de longitud 0; el tamaño sin comprimir es el length de la petición
+# (zu) o de la respuesta (dw).
+#
+# La petición zu lleva en length el tamaño del archivo, seguida de la lista de
+# compresiones y de flags (1 byte, ver packUploadOptions). El servidor responde 'y' /
+# 'n' (el archivo existe), como en 'up', seguido de una trama 'zu' cuyo nombre es la
+# compresión elegida; el resto del diálogo es el de 'up', con los datos comprimidos (o
+# sin comprimir, si no eligió ninguna, o si la lista está vacía). Si los datos
+# comprimidos no son válidos responde STATUS_BAD_REQUEST.
+COMPRESSED_CHUNK = struct.Struct('!I')
+
+# Upload verificado (zu con UPLOAD_VERIFY)
+# El cliente envía después de los datos el SHA-256 (32 bytes) de los datos sin
+# comprimir. El servidor lo calcula mientras los recibe y publica el archivo solo si
+# coinciden; si no, descarta el temporal y responde STATUS_BAD_REQUEST en lugar de
+# STATUS_OK, y el archivo anterior (si existe) no cambia. Un 'up' no se verifica, y el
+# servidor no calcula su SHA-256 (salvo que su almacenamiento lo necesite).
+UPLOAD_VERIFY = 0x01
+
+# Checksum (ck)
+# La petición lleva el nombre del archivo. El servidor responde 'n' si no existe, o 'y'
+# seguido de CHECKSUM_REPLY: size (8 bytes), mtime (8 bytes, double) y el SHA-256 (32
+# bytes) del archivo, tomado del índice de checksums del servidor (ChecksumIndex) sin
+# volver a leer el archivo. En una sesión, los datos de la respuesta son CHECKSUM_REPLY.
+CHECKSUM_REPLY = struct.Struct('!Qd32s')
+
+# Upload reanudable (ru)
+# La petición lleva en length el tamaño total del archivo. El servidor responde 'y'
+# seguido del número de bytes que ya tiene (8 bytes), y el cliente envía el resto del
+# archivo a partir de esa posición. Si la conexión se pierde, los bytes recibidos se
+# conservan para el siguiente intento.
+RESUME_OFFSET = struct.Struct('!Q')
+
+# Upload por partes (pu, pc)
+# El cliente divide el archivo en rangos y los envía al mismo tiempo por varias
+# conexiones. Cada petición 'pu' lleva en length el tamaño de la parte, seguida de
+# PART_REQUEST (identificador del upload, posición de la parte y tamaño total del
+# archivo) y los datos. Primero, una petición 'pu' con identificador 0 y sin datos crea
+# el upload: el servidor responde STATUS_OK seguido del identificador (PART_UPLOAD),
+# que llevan todas las partes y el ensamblado, o STATUS_BAD_REQUEST si el tamaño total
+# es mayor que MAX_PART_TOTAL o no se puede reservar en el disco. Cada parte se responde con STATUS_OK al
+# escribirla, STATUS_NOT_FOUND si el upload no existe, STATUS_BAD_REQUEST si el tamaño
+# total no coincide o la parte se sale del archivo, o STATUS_BUSY si el upload se está
+# ensamblando. Al terminar todas, una petición 'pc' con length igual al tamaño total y
+# como datos PART_ASSEMBLE (identificador y SHA-256 del archivo) pide ensamblarlo; el
+# servidor responde STATUS_OK si las partes cubren todo el archivo y coincide,
+# STATUS_NOT_FOUND si el upload no existe, STATUS_BUSY si aún se escriben partes, o
+# STATUS_BAD_REQUEST si el tamaño, las partes o el SHA-256 no coinciden (el upload se
+# descarta).
+PART_REQUEST = struct.Struct('!QQQ')
+PART_UPLOAD = struct.Struct('!Q')
+MAX_PART_TOTAL = 1 << 40 # Tamaño máximo de un upload por partes (1 TiB)
+DIGEST_SIZE = hashlib.sha256().digest_size
+PART_ASSEMBLE = struct.Struct(f'!Q{DIGEST_SIZE}s')
+
+# Contenido existente (hv)
+# Antes de subir un archivo, el cliente envía su SHA-256 (32 bytes) y flags (1 byte).
+# Si el servidor no tiene ese contenido responde STATUS_NOT_FOUND, y el cliente debe
+# subir el archivo normalmente. Si lo tiene (almacenamiento con deduplicación), publica
+# el archivo sin recibir los datos y responde STATUS_OK, o STATUS_EXISTS si el archivo
+# ya existe y no se indicó HAVE_REPLACE.
+HAVE_REQUEST = struct.Struct(f'!{DIGEST_SIZE}sB')
+HAVE_REPLACE = 0x01
+
+# Upload por diferencias (dt)
+# La petición lleva en length el tamaño del nuevo archivo. Si el archivo no existe en
+# el servidor, responde 'n' y el cliente debe subirlo normalmente. Si existe, responde
+# 'y' y el cliente confirma la sobreescritura ('y' / 'n'), como en 'up'. Después el
+# servidor envía DELTA_SIGNATURE: tamaño de bloque (4 bytes) y tamaño de su versión
+# del archivo (8 bytes), seguido de la firma de cada bloque (DELTA_BLOCK): checksum
+# débil (adler32, 4 bytes) y fuerte (los primeros DELTA_STRONG_SIZE bytes del SHA-256).
+# El cliente responde con instrucciones (DELTA_INSTRUCTION: tipo 1 byte, valor 8 bytes)
+# para construir el nuevo archivo:
+#   DELTA_COPY  copiar el bloque de la versión del servidor con índice valor
+#   DELTA_DATA  escribir los valor bytes (literales) que siguen a la instrucción
+#   DELTA_END   terminar; le sigue el SHA-256 del nuevo archivo (32 bytes)
+# El servidor responde STATUS_OK si el archivo construido tiene length bytes y ese
+# SHA-256, o STATUS_BAD_REQUEST si no (el archivo no cambia).
+DELTA_STRONG_SIZE = 16
+DELTA_SIGNATURE = struct.Struct('!IQ')
+DELTA_BLOCK = struct.Struct(f'!I{DELTA_STRONG_SIZE}s')
+DELTA_INSTRUCTION = struct.Struct('!cQ')
+DELTA_COPY = b'c'
+DELTA_DATA = b'd'
+DELTA_END = b'e'
+
+# Lista de archivos (ls)
+# La petición lleva en el campo del nombre el prefijo de los archivos deseados, y como
+# datos: flags (1 byte), limit (4 bytes, 0 = sin límite) y el cursor (el resto). La
+# respuesta es una sola trama 'ls' cuyo nombre es el cursor de la siguiente página
+# ('' si no hay más) y cuyos datos son: count (4 bytes) seguido de count entradas con
+# namelen (2 bytes), el nombre y, si se pidieron metadatos, size (8 bytes) y mtime
+# (8 bytes, double).
+LIST_REQUEST = struct.Struct('!BI')
+LIST_COUNT = struct.Struct('!I')
+LIST_NAME = struct.Struct('!H')
+LIST_STAT = struct.Struct('!Qd')
+LIST_METADATA = 0x01 # Flag: incluir tamaño y fecha de modificación
+
+# Sesión (ss)
+# Después de la respuesta 'y', el cliente puede enviar cualquier número de peticiones
+# ls/up/dw/dl/ck sobre la misma conexión, sin esperar la respuesta de cada una
+# (pipelining), y termina la sesión con 'qt' o cerrando la conexión. Cada petición:
+#   tag     (4 bytes)  Identificador elegido por el cliente
+#   op      (2 bytes)  Operación
+#   flags   (1 byte)   SESSION_REPLACE: sobreescribir el archivo si ya existe
+#   namelen (2 bytes)  Longitud del nombre del archivo (o del prefijo, para ls)
+#   length  (8 bytes)  Longitud de los datos: archivo para up, parámetros para ls,
+#                      0 o el rango (RANGE_REQUEST, sin compresión ni verificación)
+#                      para dw, 0 para dl y ck
+# seguida del nombre y los datos. El servidor atiende las peticiones en orden y
+# responde a cada una con:
+#   tag     (4 bytes)  El de la petición
+#   op      (2 bytes)  El de la petición
+#   status  (3 bytes)  STATUS_*
+#   length  (8 bytes)  Longitud de los datos (archivo para dw; cursor y lista para ls)
+# seguida de los datos. Las operaciones de una sesión no son interactivas: la
+# confirmación del cliente se indica con los flags.
+SESSION_REQUEST = struct.Struct('!I2sBHQ')
+SESSION_RESPONSE = struct.Struct('!I2s3sQ')
+SESSION_REPLACE = 0x01
+
+# Paquetes de archivos (bu, bd)
+# Transfieren muchos archivos en una sola petición, como un flujo continuo (al estilo
+# de tar): cada archivo lleva solo un encabezado de unos bytes, sin una ida y vuelta
+# por archivo. El servidor escribe o lee cada archivo conforme pasa por la conexión,
+# sin construir el paquete completo.
+#
+# La petición 'bu' lleva como datos flags (BUNDLE_REQUEST, 1 byte; BUNDLE_REPLACE:
+# sobreescribir los archivos que ya existen). El servidor responde 'y' y el cliente
+# envía los archivos, cada uno con BUNDLE_FILE: namelen (2 bytes) y size (8 bytes),
+# seguido del nombre y los datos; un BUNDLE_FILE con namelen y size 0 termina el
+# paquete. Al terminar, el servidor responde con una trama 'bu' cuyo length es el
+# número de archivos, seguida del status (3 bytes) de cada uno, en orden: STATUS_OK,
+# STATUS_EXISTS (no se sobreescribió) o STATUS_BAD_REQUEST (nombre inválido, o no se
+# pudo guardar).
+#
+# La petición 'bd' lleva en el campo del nombre el prefijo de los archivos deseados
+# y como datos un patrón (glob, ver fnmatch; vacío = todos los del prefijo). El
+# servidor responde 'y' seguido de los archivos, en orden por nombre, cada uno con
+# BUNDLE_ENTRY: status (3 bytes), namelen (2 bytes) y size (8 bytes), seguido del
+# nombre y los datos. Un archivo eliminado mientras se enviaba el paquete lleva
+# STATUS_NOT_FOUND y ningún dato. El paquete termina con un BUNDLE_ENTRY con namelen
+# 0 y, en size, el número de archivos; el cliente confirma con '100'.
+BUNDLE_REQUEST = struct.Struct('!B')
+BUNDLE_REPLACE = 0x01
+BUNDLE_FILE = struct.Struct('!HQ')
+BUNDLE_ENTRY = struct.Struct('!3sHQ')
+
+STATUS_OK = b'100' # Operación exitosa
+STATUS_BAD_REQUEST = b'400' # Petición inválida
+STATUS_NOT_FOUND = b'404' # El archivo no existe
+STATUS_EXISTS = b'409' # El archivo ya existe y no se pidió sobreescribirlo
+STATUS_BUSY = b'503' # Límite de operaciones de este tipo alcanzado, reintentar
+
+# Respuestas de un byte del servidor a una petición
+# 'y' / 'n': el archivo existe / no existe (para ls, 'y' indica que sigue la trama
+#            con la lista)
+# 'b': el servidor está ocupado (busy), el cliente debe reintentar más tarde
+BUSY = b'b'
+# 'u': el servidor no soporta la operación solicitada
+UNSUPPORTED = b'u'
+
+# Construye un encabezado, junto con el nombre del archivo (si lo hay)
+def packHeader(op, name='', length=0):
+    name = name.encode('utf-8', 'replace')
+    return HEADER.pack(op.encode('utf-8'), len(name), length) + name
+
+# Construye el BUNDLE_ENTRY de un archivo de un paquete (bd), seguido de su nombre
+def packBundleEntry(status, name, size=0):
+    name = name.encode('utf-8', 'replace')
+    return BUNDLE_ENTRY.pack(status, len(name), size) + name
+
+# Abre una conexión TCP (socket.create_connection) con las opciones de tuneSocket
+def connect(address, timeout=None):
+    conn = socket.create_connection(address, timeout)
+    tuneSocket(conn)
+    return conn
+
+# Envía un encabezado, junto con el nombre del archivo (si lo hay)
+def sendHeader(conn, op, name='', length=0):
+    conn.sendall(packHeader(op, name, length))
+
+# Recibe exactamente n bytes. Si la conexión se cierra antes, lanza ConnectionError.
+# Si se indica deadline (instante de time.monotonic()), lanza socket.timeout cuando
+# los n bytes no llegan antes de ese instante, sin importar cuántas veces envíe datos
+# el otro extremo.
+def recvExact(conn, n, deadline=None):
+    buffer = bytearray(n)
+    view = memoryview(buffer)
+    received = 0
+    while received < n:
+        if deadline is not None:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise socket.timeout(f'Deadline expired, expected {n - received} more bytes.')
+            conn.settimeout(remaining)
+        count = conn.recv_into(view[received:])
+        if not count:
+            raise ConnectionError(f'Connection closed, expected {n - received} more bytes.')
+        received += count
+    return bytes(buffer)
+
+# Recibe un encabezado y el nombre que lo acompaña. Regresa (op, name, length).
+# Con timeout (segundos), el encabezado completo debe llegar dentro de ese plazo;
+# después la conexión vuelve a ser bloqueante.
+def recvHeader(conn, timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        op, namelen, length = HEADER.unpack(recvExact(conn, HEADER.size, deadline))
+        name = recvExact(conn, namelen, deadline).decode('utf-8', 'replace') if namelen else ''
+    finally:
+        if deadline is not None: conn.settimeout(None)
+    return op.decode('utf-8', 'replace'), name, length
+
+# Datos de la petición ls
+def packListRequest(cursor='', limit=0, metadata=False):
+    return LIST_REQUEST.pack(LIST_METADATA if metadata else 0, limit) + cursor.encode('utf-8', 'replace')
+
+def unpackListRequest(data):
+    flags, limit = LIST_REQUEST.unpack_from(data)
+    return bool(flags & LIST_METADATA), limit, data[LIST_REQUEST.size:].decode('utf-8', 'replace')
+
+# Lista de compresiones que acepta el cliente
+def packCodecs(codecs):
+    data = ','.join(codecs).encode('ascii')
+    return bytes([len(data)]) + data
+
+def unpackCodecs(data):
+    return [c for c in data[1:1 + data[0]].decode('ascii', 'replace').split(',') if c] if data else []
+
+def recvCodecs(conn):
+    length = recvExact(conn, 1)
+    return unpackCodecs(length + recvExact(conn, length[0]))
+
+async def recvCodecsAsync(reader):
+    length = await recvExactAsync(reader, 1)
+    return unpackCodecs(length + await recvExactAsync(reader, length[0]))
+
+# Datos de la petición zu: las compresiones que acepta el cliente y los flags
+# (UPLOAD_VERIFY). recvUploadOptions regresa (codecs, flags)
+def packUploadOptions(codecs=(), flags=0):
+    return packCodecs(codecs) + bytes([flags])
+
+def recvUploadOptions(conn):
+    return recvCodecs(conn), recvExact(conn, 1)[0]
+
+async def recvUploadOptionsAsync(reader):
+    return await recvCodecsAsync(reader), (await recvExactAsync(reader, 1))[0]
+
+# Datos de la petición dw parcial (con las compresiones que acepta el cliente y los
+# flags). Regresa (offset, count, codecs, flags)
+def packRange(offset=0, count=0, codecs=(), flags=0):
+    data = RANGE_REQUEST.pack(offset, count)
+    if codecs or flags: data += packCodecs(codecs)
+    return data + (bytes([flags]) if flags else b'')
+
+def unpackRange(data):
+    if not data: return 0, 0, [], 0
+    codecs = data[RANGE_REQUEST.size:]
+    flags = codecs[1 + codecs[0]] if codecs and len(codecs) > 1 + codecs[0] else 0
+    return RANGE_REQUEST.unpack_from(data) + (unpackCodecs(codecs), flags)
+
+# Datos de la respuesta ls. stats es None o una función nombre -> (size, mtime)
+def packList(names, stats=None):
+    parts = [LIST_COUNT.pack(len(names))]
+    for name in names:
+        data = name.encode('utf-8', 'replace')
+        parts.append(LIST_NAME.pack(len(data)))
+        parts.append(data)
+        if stats is not None:
+            parts.append(LIST_STAT.pack(*(stats(name) or (0, 0.0))))
+    return b''.join(parts)
+
+# Regresa una lista de (name, size, mtime); size y mtime son None sin metadatos
+def unpackList(data, metadata=False):
+    count, = LIST_COUNT.unpack_from(data)
+    offset = LIST_COUNT.size
+    files = []
+    for i in range(count):
+        namelen, = LIST_NAME.unpack_from(data, offset)
+        offset += LIST_NAME.size
+        name = data[offset:offset + namelen].decode('utf-8', 'replace')
+        offset += namelen
+        size = mtime = None
+        if metadata:
+            size, mtime = LIST_STAT.unpack_from(data, offset)
+            offset += LIST_STAT.size
+        files.append((name, size, mtime))
+    return files
+
+# Peticiones y respuestas de una sesión
+def packSessionRequest(tag, op, name='', length=0, flags=0):
+    name = name.encode('utf-8', 'replace')
+    return SESSION_REQUEST.pack(tag, op.encode('utf-8'), flags, len(name), length) + name
+
+# Regresa (tag, op, flags, name, length)
+def recvSessionRequest(conn, timeout=None):
+    deadline = None if timeout is None else time.monotonic() + timeout
+    try:
+        tag, op, flags, namelen, length = SESSION_REQUEST.unpack(recvExact(conn, SESSION_REQUEST.size, deadline))
+        name = recvExact(conn, namelen, deadline).decode('utf-8', 'replace') if namelen else ''
+    finally:
+        if deadline is not None: conn.settimeout(None)
+    return tag, op.decode('utf-8', 'replace'), flags, name, length
+
+def sendSessionResponse(conn, tag, op, status, data=b'', length=None):
+    length = len(data) if length is None else length
+    conn.sendall(SESSION_RESPONSE.pack(tag, op.encode('utf-8'), status, length) + data)
+
+# Regresa (tag, op, status, length)
+def recvSessionResponse(conn):
+    tag, op, status, length = SESSION_RESPONSE.unpack(recvExact(conn, SESSION_RESPONSE.size))
+    return tag, op.decode('utf-8', 'replace'), status, length
+
+# Datos de la respuesta ls de una sesión: cursor de la siguiente página y lista
+def packSessionList(cursor, body):
+    cursor = cursor.encode('utf-8', 'replace')
+    return LIST_NAME.pack(len(cursor)) + cursor + body
+
+def unpackSessionList(data, metadata=False):
+    cursorlen, = LIST_NAME.unpack_from(data)
+    cursor = data[LIST_NAME.size:LIST_NAME.size + cursorlen].decode('utf-8', 'replace')
+    return cursor, unpackList(data[LIST_NAME.size + cursorlen:], metadata)
+
+# Versiones para asyncio (streams) de recvExact y recvHeader
+async def recvExactAsync(reader, n):
+    try:
+        return await reader.readexactly(n)
+    except asyncio.IncompleteReadError as e:
+        raise ConnectionError(f'Connection closed, expected {n - len(e.partial)} more bytes.') from e
+
+async def recvHeaderAsync(reader, timeout=None):
+    async def recv():
+        op, namelen, length = HEADER.unpack(await recvExactAsync(reader, HEADER.size))
+        name = (await recvExactAsync(reader, namelen)).decode('utf-8', 'replace') if namelen else ''
+        return op.decode('utf-8', 'replace'), name, length
+    try:
+        return await asyncio.wait_for(recv(), timeout)
+    except asyncio.TimeoutError as e:
+        raise socket.timeout('Deadline expired while receiving header.') from e
+
+# Recibe con recv_into en buffer (un buffer de BufferPool) hasta llenar sus primeros
+# size bytes. Regresa los bytes recibidos; si la conexión se cierra o falla antes, los
+# bytes ya recibidos se entregan a consume antes de lanzar la excepción, para que no se
+# pierdan (p. ej. lo recibido de un upload reanudable se conserva en el disco).
+def recvInto(conn, buffer, size, consume=None):
+    filled = 0
+    try:
+        while filled < size:
+            count = conn.recv_into(buffer[filled:size])
+            if not count:
+                raise ConnectionError(f'Connection closed, expected {size - filled} more bytes.')
+            filled += count
+    except BaseException:
+        if filled and consume: consume(buffer[:filled])
+        raise
+    return filled
+
+# Copia exactamente length bytes de la conexión al archivo f. Los datos se reciben en
+# un buffer de BufferPool y se escriben cuando está lleno (o termina la transferencia)
+def recvToFile(conn, f, length):
+    remaining = length
+    with buffers.borrow(length) as buffer:
+        while remaining:
+            count = recvInto(conn, buffer, min(remaining, len(buffer)), f.write)
+            f.write(buffer[:count])
+            remaining -= count
+
+# Escribe todos los bytes de data en el descriptor fd a partir de la posición offset
+# (os.pwrite, no modifica la posición del descriptor)
+def pwriteAll(fd, data, offset):
+    while data:
+        n = os.pwrite(fd, data, offset)
+        data = data[n:]
+        offset += n
+
+# Copia exactamente length bytes de la conexión al descriptor fd, a partir de offset
+def recvToOffset(conn, fd, offset, length):
+    remaining = length
+    with buffers.borrow(length) as buffer:
+        while remaining:
+            count = recvInto(conn, buffer, min(remaining, len(buffer)), lambda data: pwriteAll(fd, data, offset))
+            pwriteAll(fd, buffer[:count], offset)
+            offset += count
+            remaining -= count
+
+# SHA-256 del archivo indicado
+def fileDigest(filename):
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.digest()
+
+# Recibe y descarta exactamente length bytes (datos de una petición rechazada)
+def discard(conn, length):
+    remaining = length
+    with buffers.borrow(length) as buffer:
+        while remaining:
+            remaining -= recvInto(conn, buffer, min(remaining, len(buffer)))
+
+# Envía exactamente length bytes del archivo f por la conexión, leyendo con readinto
+# en un buffer de BufferPool. Con digest (hashlib), calcula el SHA-256 de los datos
+# mientras los envía
+def sendFromFile(conn, f, length, digest=None):
+    remaining = length
+    with buffers.borrow(length) as buffer:
+        while remaining:
+            count = f.readinto(buffer[:min(remaining, len(buffer))])
+            if not count:
+                raise EOFError(f'File ended, expected {remaining} more bytes.')
+            if digest is not None: digest.update(buffer[:count])
+            conn.sendall(buffer[:count])
+            remaining -= count
+
+# Destino de una transferencia que calcula el SHA-256 de los datos que se escriben en
+# el archivo f (digest)
+class DigestWriter:
+    def __init__(self, f):
+        self.f = f
+        self.digest = hashlib.sha256()
+
+    def write(self, data):
+        self.digest.update(data)
+        return self.f.write(data)
+
+# Errores con los que os.sendfile indica que no puede usarse con estos descriptores
+# (p. ej. sistemas de archivos o sockets que no lo soportan). En ese caso se utiliza
+# el envío por bloques con sendall.
+SENDFILE_UNSUPPORTED = (errno.EINVAL, errno.ENOSYS, errno.ENOTSOCK, errno.EOPNOTSUPP, errno.ENOTSUP)
+
+# Envía length bytes del archivo f, a partir de offset, por la conexión.
+# Utiliza os.sendfile para que el kernel copie los datos directamente del archivo al
+# socket, sin pasar por el intérprete (zero-copy). Si no está disponible, se envía por
+# bloques con sendall (sendFromFile). Con digest, los datos se envían por bloques para
+# calcular su SHA-256 mientras se envían, sin leer el archivo dos veces
+def sendFile(conn, f, length, offset=0, digest=None):
+    try:
+        infd, outfd = f.fileno(), conn.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        infd = None # Objetos sin descriptor de archivo (p. ej. io.BytesIO)
+    if digest is not None: infd = None
+
+    sent = 0
+    if infd is not None and hasattr(os, 'sendfile'):
+        try:
+            while sent < length:
+                n = os.sendfile(outfd, infd, offset + sent, length - sent)
+                if n == 0:
+                    raise EOFError(f'File ended, expected {length - sent} more bytes.')
+                sent += n
+            return
+        except OSError as e:
+            # Solo se puede recurrir al envío por bloques si aún no se envió nada
+            if sent or isinstance(e, ConnectionError) or e.errno not in SENDFILE_UNSUPPORTED:
+                raise
+
+    f.seek(offset)
+    sendFromFile(conn, f, length, digest)
+
+# Lectura de una conexión a través de un buffer (socket.makefile) de buffers.size
+# bytes: cada recv del sistema trae todo lo que haya llegado, por lo que los
+# encabezados y archivos pequeños de un paquete (bu, bd) se leen de la memoria, sin
+# una llamada al sistema por cada uno. Provee recv_into, por lo que recvExact,
+# recvToFile y discard funcionan sobre ella igual que sobre la conexión.
+class BufferedConnection:
+    def __init__(self, conn):
+        self.reader = conn.makefile('rb', buffering=buffers.size)
+        self.received = 0 # Bytes entregados con recv_into
+
+    def recv_into(self, buffer):
+        count = self.reader.readinto1(buffer)
+        self.received += count
+        return count
+
+    def close(self):
+        self.reader.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+# Envía los archivos de un paquete (bu) y el BUNDLE_FILE que lo termina. files produce
+# (name, f, size) por cada archivo, con f un archivo binario del que se envían sus
+# primeros size bytes. Los encabezados y los archivos pequeños se juntan en un solo
+# sendall de hasta buffers.size bytes; los archivos grandes se envían con sendFile.
+def sendBundle(conn, files):
+    batch = bytearray()
+    for name, f, size in files:
+        name = name.encode('utf-8', 'replace')
+        batch += BUNDLE_FILE.pack(len(name), size) + name
+        if len(batch) + size <= buffers.size:
+            f.seek(0)
+            data = f.read(size)
+            if len(data) != size:
+                raise EOFError(f'File ended, expected {size - len(data)} more bytes.')
+            batch += data
+        else:
+            conn.sendall(batch)
+            batch.clear()
+            sendFile(conn, f, size)
+    batch += BUNDLE_FILE.pack(0, 0)
+    conn.sendall(batch)
+
+# Recibe los archivos de un paquete (bd), después de la respuesta 'y'. Produce
+# (status, name, size, source) por cada archivo; antes de pedir el siguiente, se deben
+# leer (p. ej. con recvToFile) o descartar (discard) exactamente size bytes de source.
+def recvBundle(conn):
+    with BufferedConnection(conn) as source:
+        while True:
+            status, namelen, size = BUNDLE_ENTRY.unpack(recvExact(source, BUNDLE_ENTRY.size))
+            if not namelen: return
+            name = recvExact(source, namelen).decode('utf-8', 'replace')
+            yield status, name, size, source
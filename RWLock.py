@@ -0,0 +1,262 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import time
+import asyncio
+import threading
+from bisect import bisect_left
+from Metrics import metrics
+
+# LockStats
+# Estadísticas de espera de un conjunto de semáforos RWLock (por ejemplo, los de todos
+# los recursos del servidor). Por cada tipo de acceso (read / write) guarda el número
+# de adquisiciones, el tiempo total y máximo de espera, un histograma con los límites
+# de WAIT_BUCKETS (segundos), y cuántos hilos esperan el semáforo (waiting) y lo tienen
+# adquirido (holding) en este momento.
+#
+# La espera también se agrega a la petición actual (Metrics.lockWait).
+WAIT_BUCKETS = (0.001, 0.01, 0.1, 1, 10)
+
+class LockStats:
+    bounds = WAIT_BUCKETS
+
+    def __init__(self):
+        self.lock = threading.Lock() # Semáforo para acceder a las estadísticas
+        self.waits = {mode: [0, 0.0, 0.0, [0] * (len(WAIT_BUCKETS) + 1)] for mode in ('read', 'write')}
+        self.waiting = {'read': 0, 'write': 0}
+        self.holding = {'read': 0, 'write': 0}
+
+    # Inicio de la espera por el semáforo. Regresa el instante de inicio
+    def wait(self, mode):
+        with self.lock:
+            self.waiting[mode] += 1
+        return time.monotonic()
+
+    # Fin de la espera (semáforo adquirido), que comenzó en start
+    def acquired(self, mode, start):
+        wait = time.monotonic() - start
+        with self.lock:
+            self.waiting[mode] -= 1
+            self.holding[mode] += 1
+            entry = self.waits[mode]
+            entry[0] += 1
+            entry[1] += wait
+            entry[2] = max(entry[2], wait)
+            entry[3][bisect_left(WAIT_BUCKETS, wait)] += 1
+        metrics.lockWait(wait)
+
+    # Espera abandonada sin adquirir el semáforo (tarea cancelada)
+    def abandoned(self, mode):
+        with self.lock:
+            self.waiting[mode] -= 1
+
+    def released(self, mode):
+        with self.lock:
+            self.holding[mode] -= 1
+
+    # Copia de las estadísticas
+    def snapshot(self):
+        with self.lock:
+            return {mode: {'count': count,
+                           'total': total,
+                           'avg': total / count if count else 0.0,
+                           'max': maximum,
+                           'buckets': dict(zip([f'<={b}s' for b in WAIT_BUCKETS] + ['more'], buckets)),
+                           'waiting': self.waiting[mode],
+                           'holding': self.holding[mode]}
+                    for mode, (count, total, maximum, buckets) in self.waits.items()}
+
+# RWLock
+# Semáforo de Lectores y Escritores equitativo (FIFO por turnos).
+#
+# Cada hilo que llega toma un turno (ticket) y los turnos se atienden en orden de
+# llegada. Un lector entra cuando es su turno y no hay un escritor activo; los lectores
+# consecutivos entran juntos. Un escritor entra cuando es su turno y no hay nadie
+# activo. Así, un escritor en espera detiene a los lectores que llegaron después de
+# él, y su espera está acotada por los lectores que ya estaban activos (no puede
+# esperar para siempre aunque lleguen lectores continuamente, como en el modelo con
+# prioridad a Lectores).
+#
+# Si se indica stats (LockStats), cada adquisición registra su tiempo de espera y los
+# hilos que esperan y tienen el semáforo.
+#
+# Si se indica shared (ProcessLock, modo pre-fork), la exclusión también se respeta
+# entre procesos: el primer lector adquiere el lock compartido para todos los lectores
+# del proceso y el último lo libera, y el escritor adquiere el lock exclusivo. El lock
+# entre procesos se pide después de que el turno local se concedió y fuera de
+# self.cond, por lo que mientras un proceso espera a otro, sus hilos pueden seguir
+# tomando turno y liberando el semáforo; los lectores que entran mientras el primero
+# espera el lock lo esperan con él (locking). La espera por otros procesos se mide
+# junto con la espera del turno.
+#
+# El orden FIFO solo se garantiza entre los hilos de un proceso. Entre procesos, el
+# orden lo decide el kernel, que concede un lock de lectura aunque haya un escritor
+# esperando: un escritor espera mientras los lectores de otros procesos se traslapen
+# sin interrupción. Su espera sí está acotada dentro de su proceso, pues su turno
+# detiene a los lectores locales que llegan después de él.
+class RWLock:
+    def __init__(self, stats=None, shared=None):
+        self.cond = threading.Condition(threading.Lock()) # Espera de turno
+        self.nextTicket = 0 # Siguiente turno a entregar
+        self.serving = 0 # Turno que puede entrar
+        self.readers = 0 # Lectores activos
+        self.writer = False # Bandera de escritor activo
+        self.stats = stats
+        self.shared = shared # Semáforo entre procesos
+        self.held = False # Bandera del semáforo entre procesos adquirido
+        self.locking = False # Bandera de un hilo adquiriendo el semáforo entre procesos
+
+    # Con el turno local ya concedido (y self.cond adquirido), espera a que el proceso
+    # tenga el semáforo entre procesos. Lo adquiere, sin self.cond, el primer hilo que
+    # lo necesita; los demás esperan a que termine
+    def lockShared(self, acquire):
+        while not self.held:
+            if self.locking:
+                self.cond.wait()
+                continue
+            self.locking = True
+            self.cond.release()
+            try:
+                acquire()
+            finally:
+                self.cond.acquire()
+                self.locking = False
+                self.cond.notify_all()
+            self.held = True
+
+    # Libera el semáforo entre procesos (con self.cond adquirido)
+    def unlockShared(self):
+        self.shared.unlock()
+        self.held = False
+
+    def acquireRead(self):
+        start = self.stats.wait('read') if self.stats else 0
+        with self.cond:
+            ticket = self.nextTicket
+            self.nextTicket += 1
+            while ticket != self.serving or self.writer:
+                self.cond.wait()
+            self.serving += 1
+            self.readers += 1
+            # El siguiente turno puede ser otro lector
+            self.cond.notify_all()
+            if self.shared:
+                try:
+                    self.lockShared(self.shared.lockRead)
+                except BaseException:
+                    # Cede el acceso; otro lector del proceso puede volver a intentarlo
+                    self.readers -= 1
+                    self.cond.notify_all()
+                    if self.stats: self.stats.abandoned('read')
+                    raise
+        if self.stats: self.stats.acquired('read', start)
+
+    def releaseRead(self):
+        with self.cond:
+            self.readers -= 1
+            if self.readers == 0:
+                if self.held: self.unlockShared()
+                self.cond.notify_all()
+        if self.stats: self.stats.released('read')
+
+    def acquireWrite(self):
+        start = self.stats.wait('write') if self.stats else 0
+        with self.cond:
+            ticket = self.nextTicket
+            self.nextTicket += 1
+            while ticket != self.serving or self.writer or self.readers:
+                self.cond.wait()
+            self.serving += 1
+            self.writer = True
+            if self.shared:
+                try:
+                    self.lockShared(self.shared.lockWrite)
+                except BaseException:
+                    self.writer = False
+                    self.cond.notify_all()
+                    if self.stats: self.stats.abandoned('write')
+                    raise
+        if self.stats: self.stats.acquired('write', start)
+
+    def releaseWrite(self):
+        with self.cond:
+            if self.held: self.unlockShared()
+            self.writer = False
+            self.cond.notify_all()
+        if self.stats: self.stats.released('write')
+
+# AsyncRWLock
+# Versión de RWLock para el motor asyncio (corrutinas en lugar de hilos), con la misma
+# política FIFO por turnos. Una tarea cancelada mientras espera abandona su turno, para
+# no detener a las que llegaron después.
+class AsyncRWLock:
+    def __init__(self, stats=None):
+        self.cond = asyncio.Condition() # Espera de turno
+        self.nextTicket = 0 # Siguiente turno a entregar
+        self.serving = 0 # Turno que puede entrar
+        self.abandoned = set() # Turnos de tareas canceladas
+        self.readers = 0 # Lectores activos
+        self.writer = False # Bandera de escritor activo
+        self.stats = stats
+
+    # Espera el turno ticket (de un acceso mode) hasta que se cumpla ready()
+    async def wait(self, ticket, mode, ready):
+        try:
+            await self.cond.wait_for(lambda: ticket == self.serving and ready())
+        except BaseException:
+            self.abandoned.add(ticket)
+            self.advance()
+            if self.stats: self.stats.abandoned(mode)
+            raise
+
+    # Avanza al siguiente turno que no haya sido abandonado
+    def advance(self):
+        while self.serving in self.abandoned:
+            self.abandoned.remove(self.serving)
+            self.serving += 1
+        self.cond.notify_all()
+
+    async def acquireRead(self):
+        start = self.stats.wait('read') if self.stats else 0
+        async with self.cond:
+            ticket = self.nextTicket
+            self.nextTicket += 1
+            await self.wait(ticket, 'read', lambda: not self.writer)
+            self.serving += 1
+            self.readers += 1
+            self.advance()
+        if self.stats: self.stats.acquired('read', start)
+
+    async def releaseRead(self):
+        async with self.cond:
+            self.readers -= 1
+            if self.readers == 0: self.cond.notify_all()
+        if self.stats: self.stats.released('read')
+
+    async def acquireWrite(self):
+        start = self.stats.wait('write') if self.stats else 0
+        async with self.cond:
+            ticket = self.nextTicket
+            self.nextTicket += 1
+            await self.wait(ticket, 'write', lambda: not self.writer and not self.readers)
+            self.serving += 1
+            self.writer = True
+            self.advance()
+        if self.stats: self.stats.acquired('write', start)
+
+    async def releaseWrite(self):
+        async with self.cond:
+            self.writer = False
+            self.cond.notify_all()
+        if self.stats: self.stats.released('write')
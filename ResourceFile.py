@@ -12,29 +12,62 @@
 # Otoño 2020
 # 27/Noviembre/2020
 
+import io
+import hashlib
 import os
-import socket
+import fcntl
+import struct
 import threading
-from os.path import isfile
-from datetime import datetime
+from os.path import isfile, basename
+from RWLock import RWLock
+from StagedFile import StagedFile, Multipart
+from Delta import blockSize, signatures
+from Compression import choose, compressible, sendCompressed, recvCompressed
+from FileCache import openCached
+from Log import log
+from Metrics import metrics, STATUS_OUTCOMES
+from BufferPool import corkSocket
+from Protocol import BUSY, RESUME_OFFSET, PART_REQUEST, PART_UPLOAD, MAX_PART_TOTAL, PART_ASSEMBLE, DIGEST_SIZE, HAVE_REQUEST, HAVE_REPLACE, recvExact, recvToOffset, fileDigest
+from Protocol import DELTA_SIGNATURE, DELTA_INSTRUCTION, DELTA_COPY, DELTA_DATA, DELTA_END
+from Protocol import STATUS_OK, STATUS_BAD_REQUEST, STATUS_NOT_FOUND, STATUS_EXISTS, STATUS_BUSY, packHeader, sendHeader, recvToFile, sendFile, discard, sendSessionResponse
+from Protocol import RANGE_VERIFY, UPLOAD_VERIFY, CHECKSUM_REPLY, packBundleEntry
+
+# Número de bytes de una descarga parcial: count bytes (0 = hasta el final) a partir de
+# offset, sin pasar del final del archivo
+def sliceLength(size, offset, count):
+    remaining = max(size - offset, 0)
+    return min(count, remaining) if count else remaining
+
+# Estado (os.fstat) del archivo abierto f, o None si es un archivo de la caché
+# (io.BytesIO)
+def openedStat(f):
+    try:
+        return os.fstat(f.fileno())
+    except io.UnsupportedOperation:
+        return None
 
 # ResourceFile
 # Clase que representa un único archivo almacenado en el sistema. Provee los métodos
 # necesarios para gestionar todos los tipos de acceso al archivo de forma concurrente
-# implementado el modelo de Lectores y Escritores, con prioridad a Lectores.
+# implementado el modelo de Lectores y Escritores. Los accesos se atienden en orden de
+# llegada (RWLock), por lo que un escritor nunca espera indefinidamente aunque
+# lleguen lectores continuamente.
 #
-# Funciones Lector: download()
-# Funciones Escritor: upload(), delete()
+# Funciones Lector: download(), sessionDownload(), bundleDownload(), checksum(),
+# sessionChecksum()
+# Funciones Escritor: upload(), delete(), sessionUpload(), sessionDelete(), resume(),
+# assemble(), have(), delta(), store()
+# (los uploads solo son Escritores al publicar el archivo recibido, ver publish())
 # Pese a ser Escritores, las operaciones upload() y delete() no son completamente
 # iguales. Eliminar un archivo del sistema no implica que el recurso también deba ser
 # eliminado. Al eliminar, otros hilos pueden estar esperando su lugar, ya sea para
 # leer (download) o para escribir (upload, delete). Es por esto que se implementan
 # otras variables comunes para dar estos avisos.
 #
-# El recurso será eliminado del sistema (al eliminar el archivo) únicamente cuando
-# no queden hilos esperando para subir (upload) información. (Si se elimina el recurso
+# El recurso es eliminado del sistema por el registro del servidor (ResourceRegistry)
+# cuando ningún hilo lo está utilizando ni esperando por él. (Si se eliminara antes
 # podría generar inconsistencias, pues en el servidor se generaría otro recurso con
-# diferentes semáforos para los nuevos hilos después de la eliminación)
+# diferentes semáforos para los nuevos hilos)
 #
 # Al eliminar, el hilo debe avisar a los demás hilos de lectura (downlaod) y escritura
 # (únicamente delete) que el archivo ha sido eliminado. Éstos deben, antes
@@ -43,15 +76,63 @@ from datetime import datetime
 class ResourceFile:
     def __init__(self, filename, server):
         self.filename = filename # Nombre del archivo asociado a este recurso
+        self.name = basename(filename) # Nombre del archivo en el índice del servidor
         self.server = server # Objeto del servidor
 
-        self.readersCount = 0 # Contador de hilos de lectura ACTIVOS (leyendo o esperando)
-        self.uploadCount = 0 # Contador de hilos de escritora upload ESPERANDO
         self.deleted = False # Bandera de eliminación
-        self.readersLock = threading.Lock() # Semáforo para los lectores
-        self.uploadLock = threading.Lock() # Semáforo para acceder a uploadCount
         self.deletedLock = threading.Lock() # Semáforo para acceder a la bandera deleted
-        self.writersLock = threading.Lock() # Semáforo para los escritores
+        # En modo pre-fork (server.locks), los semáforos también excluyen a los hilos de
+        # los otros procesos (ProcessLock)
+        locks = server.locks
+        self.lock = RWLock(server.lockStats, locks and locks.get(self.name)) # Semáforo de Lectores y Escritores
+        self.resumeLock = threading.Lock() # Semáforo para el temporal de un upload reanudable
+        self.resumeShared = locks and locks.get(self.name, 'resume') # Temporal reanudable, entre procesos
+
+    # Adquisición y liberación del recurso
+    # Implementan el modelo de Lectores y Escritores (RWLock, en orden de llegada) para
+    # las operaciones interactivas (download, upload, delete) y para las operaciones de
+    # una sesión (session*).
+
+    def acquireRead(self):
+        self.lock.acquireRead()
+        self.refresh()
+
+    def releaseRead(self):
+        self.lock.releaseRead()
+
+    def acquireUpload(self):
+        self.lock.acquireWrite()
+        self.refresh()
+
+    # Al terminar un upload el archivo vuelve a existir
+    def releaseUpload(self):
+        self.deletedLock.acquire()
+        self.deleted = False
+        self.deletedLock.release()
+        self.lock.releaseWrite()
+
+    def acquireDelete(self):
+        self.lock.acquireWrite()
+        self.refresh()
+
+    def releaseDelete(self):
+        self.lock.releaseWrite()
+
+    # En modo pre-fork otro proceso pudo volver a crear el archivo mientras se esperaba
+    # el recurso, por lo que la bandera deleted no es confiable y se consulta el disco
+    def refresh(self):
+        if self.server.locks:
+            self.deletedLock.acquire()
+            self.deleted = False
+            self.deletedLock.release()
+
+    # Verifica que el archivo no haya sido eliminado por un delete() anterior y que
+    # exista en el servidor
+    def exists(self):
+        self.deletedLock.acquire()
+        deleted = self.deleted
+        self.deletedLock.release()
+        return not deleted and isfile(self.filename)
 
     # Download
     # Gestiona todo el proceso de descarga de un archivo con el cliente
@@ -60,15 +141,19 @@ class ResourceFile:
     # (3) Confirmar con el usuario el envío del archivo
     # (4) Envíar el archivo
     # (5) Esperar la confirmación del cliente de la recepción del archivo
-    def download(self, conn, addr, ID):
-        print(f'{datetime.now()} [Thread #{ID}] Preparing for download, trying to aquire resource...')
+    # Con offset y/o count (descarga parcial) solo se envían count bytes (0 = hasta el
+    # final) a partir de offset. Si el cliente ofrece compresiones (codecs) y los datos
+    # son comprimibles, se envían comprimidos con la primera que el servidor soporte.
+    # Con RANGE_VERIFY en flags, los datos van seguidos de su SHA-256. El de un archivo
+    # completo se toma del índice de checksums; si no está registrado, o es un rango o
+    # un archivo de la caché, se calcula mientras se envían los datos (sin volver a
+    # leerlos) y, si es el archivo completo, se registra en el índice.
+    def download(self, conn, addr, ID, offset=0, count=0, codecs=(), flags=0):
+        log.debug('Preparing for download, trying to aquire resource...')
         # Resource adquisition (I)
-        self.readersLock.acquire()
-        self.readersCount += 1
-        if self.readersCount == 1: self.writersLock.acquire()
-        self.readersLock.release()
+        self.acquireRead()
 
-        print(f'{datetime.now()} [Thread #{ID}] Resource Aquired.')
+        log.debug('Resource Aquired.')
 
         with conn:
             # Checking file existence (II)
@@ -78,111 +163,439 @@ class ResourceFile:
             if self.deleted:
                 self.deletedLock.release()
                 conn.send(b'n') # Reply (2)
-                print(f"{datetime.now()} [Thread #{ID}] Download Failed, {self.filename} doesn't exist")
+                log.warning("Download Failed, %s doesn't exist", self.filename)
+                metrics.outcome('not_found')
             else:
                 self.deletedLock.release()
 
                 # File send (III)
                 # Comprueba que el archivo exista en el servidor
                 if isfile(self.filename):
-                    print(f'{datetime.now()} [Thread #{ID}] File found. Waiting for confirmation to send...')
+                    log.debug('File found. Waiting for confirmation to send...')
                     # Reply (2)
                     conn.send(b'y')
                     # If exists in client, asks for sending (3)
                     send = conn.recv(1).decode('utf-8', 'replace')
                     if send == 'n':
-                        print(f"{datetime.now()} [Thread #{ID}] Download Aborted by client in {addr}")
+                        log.info('Download Aborted by client in %s', addr)
+                        metrics.outcome('aborted')
                     else:
                         # Sending file data (4)
-                        print(f'{datetime.now()} [Thread #{ID}] Download Confirmed.')
-                        with open(self.filename, 'rb') as f:
-                            data = f.read(4096)
-                            print(f'{datetime.now()} [Thread #{ID}] Sending file to client in {addr}.')
-                            while data:
-                                conn.send(data)
-                                data = f.read(4096)
-
-                            # Confirmation
-                            reply = conn.recv(3).decode('utf-8', 'replace')
-                            if reply == '100': print(f"{datetime.now()} [Thread #{ID}] Download Successfull, {self.filename} sended to client in {addr}")
-                            else: print(f"{datetime.now()} [Thread #{ID}] Download Failed, client in {addr} reported error.")
+                        log.debug('Download Confirmed.')
+                        # Los archivos pequeños se envían desde la caché del servidor
+                        f, data = openCached(self.server.cache, self.filename)
+                        with f:
+                            # Encabezado con el número de bytes a enviar, seguido de los datos
+                            total = f.seek(0, os.SEEK_END)
+                            size = sliceLength(total, offset, count)
+                            codec = choose(codecs) if codecs and compressible(f, offset, size) else ''
+                            verify = flags & RANGE_VERIFY
+                            st = openedStat(f) if verify and not offset and size == total else None
+                            digest = self.server.checksums.get(self.name, st) if st is not None else None
+                            hasher = hashlib.sha256() if verify and digest is None else None
+                            log.debug('Sending file to client in %s%s.', addr, f" ({codec})" if codec else "")
+                            try:
+                                # Con el SHA-256, el encabezado, los datos y el SHA-256 se
+                                # juntan en segmentos completos (corkSocket), para que el
+                                # cliente no espere cada parte por separado
+                                if verify: corkSocket(conn, True)
+                                # El nombre del encabezado indica la compresión
+                                sendHeader(conn, 'dw', codec, size)
+                                if codec: sendCompressed(conn, f, size, offset, codec, hasher)
+                                elif data is not None:
+                                    view = memoryview(data)[offset:offset + size]
+                                    if hasher is not None: hasher.update(view)
+                                    conn.sendall(view)
+                                else: sendFile(conn, f, size, offset, hasher)
+                                if verify:
+                                    if hasher is not None:
+                                        digest = hasher.digest()
+                                        if st is not None: self.server.checksums.put(self.name, st, digest)
+                                    conn.sendall(digest)
+                                    corkSocket(conn, False)
+
+                                # Confirmation
+                                reply = conn.recv(3).decode('utf-8', 'replace')
+                                if reply == '100':
+                                    log.info('Download Successfull, %s sended to client in %s', self.filename, addr, bytes=size)
+                                    metrics.outcome('ok', bytesOut=size)
+                                else:
+                                    log.warning('Download Failed, client in %s reported error.', addr)
+                                    metrics.outcome('failed')
+                            except ConnectionError:
+                                log.warning('Download Failed, connection with client in %s was lost.', addr)
+                                metrics.outcome('lost')
                 else:
                     conn.send(b'n') # Reply (2)
-                    print(f"{datetime.now()} [Thread #{ID}] Download Failed, {self.filename} doesn't exist")
+                    log.warning("Download Failed, %s doesn't exist", self.filename)
+                    metrics.outcome('not_found')
 
         # Resource liberation (IV)
-        self.readersLock.acquire()
-        self.readersCount -= 1
-        if self.readersCount == 0: self.writersLock.release()
-        self.readersLock.release()
+        self.releaseRead()
 
     # Upload
     # Gestiona el proceso de la subida de un archivo al servidor.
     # Consta de los siguientes pasos:
     # (2) Confirmar la existencia del archivo en el servidor
     # (3) Si el archivo existe, confirmar la sobreescritura
-    # (4) Recibir los datos del archivo
+    # (4) Recibir los datos del archivo (exactamente length bytes, indicados en el
+    # encabezado de la petición)
     # (5) Envíar una confirmación del archivo recibido
-    def upload(self, conn, addr, ID):
-        print(f'{datetime.now()} [Thread #{ID}] Preparing for upload, trying to aquire resource...')
-        # Waiting resource announcement (I)
-        # Incrementa el contador de hilos upload() en espera
-        self.uploadLock.acquire()
-        self.uploadCount += 1
-        self.uploadLock.release()
-
-        # Resource adquisition (II)
-        self.writersLock.acquire()
-        self.uploadLock.acquire()
-        self.uploadCount -= 1
-        self.uploadLock.release()
-
-        print(f'{datetime.now()} [Thread #{ID}] Resource Aquired.')
+    #
+    # Los datos se reciben en un archivo temporal (StagedFile) sin adquirir el recurso,
+    # por lo que los lectores siguen descargando la versión anterior mientras tanto. El
+    # recurso (Escritor) solo se adquiere para publicar el archivo con un rename.
+    #
+    # En un upload comprimido (zu), codecs es la lista de compresiones que ofrece el
+    # cliente; la respuesta (2) va seguida de la compresión elegida. Con UPLOAD_VERIFY
+    # en flags, los datos van seguidos de su SHA-256, y el archivo solo se publica si
+    # coincide con el de los datos recibidos (ver publish).
+    def upload(self, conn, addr, ID, length, codecs=None, flags=0):
+        log.debug('Preparing for upload...')
 
         with conn:
-            # Checking file existence (III)
+            # Checking file existence (I)
             exists = isfile(self.filename)
+            codec = choose(codecs) if codecs is not None else ''
+            choice = packHeader('zu', codec) if codecs is not None else b''
             if exists:
                 # Reply (2)
-                conn.send(b'y')
+                conn.send(b'y' + choice)
                 # Replace? (3)
                 # Si el archivo existe, pregunta al cliente por sobreescribir
                 replace = conn.recv(1).decode('utf-8', 'replace')
                 if replace == 'n':
-                    print(f"{datetime.now()} [Thread #{ID}] Upload Aborted by client in {addr}")
-            else: conn.send(b'n') # Reply (2)
+                    log.info('Upload Aborted by client in %s', addr)
+                    metrics.outcome('aborted')
+            else: conn.send(b'n' + choice) # Reply (2)
 
-            # Data receving (IV)
+            # Data receving (II)
             # Si el archivo no existía, o existía y se confirmó la sobreescritura
             if exists and replace == 'y' or not exists:
-                print(f'{datetime.now()} [Thread #{ID}] Upload Confirmed.')
-                with open(self.filename, 'wb') as f:
-                    conn.settimeout(5)
+                log.debug('Upload Confirmed.')
+                verify = bool(flags & UPLOAD_VERIFY)
+                staged = StagedFile(self.filename, self.server.fsync, hashing=verify or self.server.storage.hashing)
+                try:
+                    # Recibe los datos del archivo en el temporal (4), y el SHA-256 del cliente
+                    log.debug('Receiving file from client in %s%s.', addr, f" ({codec})" if codec else "")
+                    if codec: recvCompressed(conn, staged, length, codec)
+                    else: recvToFile(conn, staged, length)
+                    digest = recvExact(conn, DIGEST_SIZE) if verify else None
+                    staged.finish()
+
+                    # Resource adquisition (III), publicación (IV) y liberation (V)
+                    self.publish(staged, digest)
+                    log.debug('File published.')
+                except ConnectionError:
+                    log.warning('Upload Failed, connection with client in %s was lost.', addr)
+                    metrics.outcome('lost')
+                except ValueError as e:
+                    conn.send(STATUS_BAD_REQUEST)
+                    log.warning('Upload Failed, %s', e)
+                    metrics.outcome('invalid')
+                else:
+                    # Confirmation (5)
+                    conn.send(STATUS_OK)
+                    log.info('Upload Successfull, stored %s from client in %s', self.filename, addr, bytes=length)
+                    metrics.outcome('ok', bytesIn=length)
+                finally:
+                    staged.discard()
+
+    # Resume
+    # Upload reanudable (ver Protocol.RESUME_OFFSET). Sobreescribe el archivo sin
+    # preguntar. Consta de los siguientes pasos:
+    # (2) Informar al cliente cuántos bytes del archivo ya se recibieron
+    # (3) Recibir el resto del archivo, agregándolo al temporal
+    # (4) Publicar el archivo y envíar una confirmación
+    # Solo un hilo a la vez (de cualquier proceso) puede continuar el upload de un
+    # archivo; si otro lo está haciendo, se responde busy.
+    def resume(self, conn, addr, ID, length):
+        log.debug('Preparing for resumable upload...')
+        with conn:
+            if not self.resumeLock.acquire(blocking=False):
+                conn.send(BUSY)
+                log.info('Upload Rejected, %s is being uploaded by another client.', self.filename)
+                metrics.outcome('busy')
+                return
+            if self.resumeShared and not self.resumeShared.tryLock():
+                self.resumeLock.release()
+                conn.send(BUSY)
+                log.info('Upload Rejected, %s is being uploaded by another process.', self.filename)
+                metrics.outcome('busy')
+                return
+
+            try:
+                staged = StagedFile(self.filename, self.server.fsync, length)
+                try:
+                    # Reply (2)
+                    conn.sendall(b'y' + RESUME_OFFSET.pack(staged.offset))
+                    log.debug('Receiving file from client in %s, from byte %s.', addr, staged.offset)
+
+                    # Data receving (3)
+                    received = length - staged.offset
+                    recvToFile(conn, staged, received)
+                    staged.finish()
+
+                    # Publicación (4)
+                    self.publish(staged)
+                    conn.send(b'100')
+                    log.info('Upload Successfull, stored %s from client in %s', self.filename, addr, bytes=received)
+                    metrics.outcome('ok', bytesIn=received)
+                except ConnectionError:
+                    log.warning('Upload Interrupted, connection with client in %s was lost. Received data is kept.', addr)
+                    metrics.outcome('lost')
+                finally:
+                    staged.discard()
+            finally:
+                if self.resumeShared: self.resumeShared.unlock()
+                self.resumeLock.release()
+
+    # Part
+    # Recibe una parte de un upload por partes (ver Protocol.PART_REQUEST) y la escribe
+    # en su posición del temporal del upload con os.pwrite, o crea el upload si su
+    # identificador es 0. Las partes son rangos distintos del archivo, por lo que varias
+    # conexiones (o procesos) pueden escribir al mismo tiempo sin adquirir el recurso;
+    # solo se excluyen con el ensamblado (ver StagedFile.Multipart).
+    def part(self, conn, addr, ID, length):
+        with conn:
+            try:
+                upload, offset, total = PART_REQUEST.unpack(recvExact(conn, PART_REQUEST.size))
+                if not upload:
+                    # New upload
+                    try:
+                        if length or total > MAX_PART_TOTAL: raise ValueError
+                        multipart = Multipart.create(self.filename, total)
+                    except (ValueError, OSError):
+                        status = STATUS_BAD_REQUEST
+                    else:
+                        conn.sendall(STATUS_OK + PART_UPLOAD.pack(multipart.upload))
+                        log.debug('Part Upload of %s (%s bytes) created for client in %s.', self.filename, total, addr)
+                        metrics.outcome('ok')
+                        return
+                else:
+                    log.debug('Receiving part of %s (%s bytes from byte %s) from client in %s.', self.filename, length, offset, addr)
+                    multipart = Multipart(self.filename, upload)
                     try:
-                        # Recibe los datos del archivo (4)
-                        print(f'{datetime.now()} [Thread #{ID}] Receiving file from client in {addr}.')
-                        data = conn.recv(4096)
-                        while True:
-                            f.write(data)
-                            data = conn.recv(4096)
-                    except socket.timeout: pass
-                    conn.settimeout(None)
-
-                # Confirmation (5)
-                conn.send(b'100')
-                print(f"{datetime.now()} [Thread #{ID}] Upload Successfull, stored {self.filename} from client in {addr}")
-
-                # File list update (V)
-                # Actualiza la lista de archivos en el servidor
-                self.server.updateFileList()
-                print(f"{datetime.now()} [Thread #{ID}] File list of server was updated.")
+                        multipart.lock(fcntl.LOCK_SH)
+                    except FileNotFoundError:
+                        status = STATUS_NOT_FOUND
+                    except BlockingIOError:
+                        status = STATUS_BUSY
+                    else:
+                        try:
+                            if total != multipart.total() or offset + length > total:
+                                status = STATUS_BAD_REQUEST
+                            else:
+                                recvToOffset(conn, multipart.fd, offset, length)
+                                multipart.record(offset, length)
+                                status = STATUS_OK
+                        finally:
+                            multipart.unlock()
+            except ConnectionError:
+                log.warning('Part Upload Failed, connection with client in %s was lost.', addr)
+                metrics.outcome('lost')
+            else:
+                # Confirmation
+                conn.send(status)
+                if status == STATUS_OK:
+                    metrics.outcome('ok', bytesIn=length)
+                    if log.sampled('pu'): log.info('Part Upload Successfull, %s bytes from byte %s of %s.', length, offset, self.filename, bytes=length)
+                else:
+                    log.warning('Part Upload Failed, part of %s from client in %s was rejected (%s).', self.filename, addr, status.decode())
+                    metrics.outcome(STATUS_OUTCOMES[status])
+
+    # Assemble
+    # Ensambla un upload por partes: con el lock exclusivo del upload, verifica que las
+    # partes recibidas cubran todo el temporal, que tenga length bytes y el SHA-256
+    # indicado por el cliente, y lo publica como Escritor upload (publish()). La
+    # verificación se hace antes de adquirir el recurso.
+    def assemble(self, conn, addr, ID, length):
+        with conn:
+            try:
+                upload, digest = PART_ASSEMBLE.unpack(recvExact(conn, PART_ASSEMBLE.size))
+            except ConnectionError:
+                log.warning('Assemble Failed, connection with client in %s was lost.', addr)
+                metrics.outcome('lost')
+                return
+
+            multipart = Multipart(self.filename, upload)
+            try:
+                multipart.lock(fcntl.LOCK_EX)
+            except FileNotFoundError:
+                status = STATUS_NOT_FOUND
+            except BlockingIOError:
+                status = STATUS_BUSY
+            else:
+                try:
+                    status = STATUS_BAD_REQUEST
+                    if multipart.total() == length and multipart.complete():
+                        staged = StagedFile(self.filename, self.server.fsync, length, multipart.suffix)
+                        try:
+                            staged.finish()
+                            if fileDigest(staged.tempname) == digest:
+                                self.publish(staged, digest)
+                                status = STATUS_OK
+                        finally:
+                            staged.discard()
+                    multipart.remove()
+                finally:
+                    multipart.unlock()
+
+            conn.send(status)
+            if status == STATUS_OK:
+                log.info('Upload Successfull, assembled %s from client in %s', self.filename, addr, bytes=length)
+                metrics.outcome('ok')
+            else:
+                log.warning("Assemble Failed, upload of %s from client in %s was rejected (%s).", self.filename, addr, status.decode())
+                metrics.outcome(STATUS_OUTCOMES[status])
+
+    # Have
+    # Publica el archivo a partir de un contenido que el servidor ya tiene, indicado por
+    # su SHA-256 (ver Protocol.HAVE_REQUEST), como Escritor upload.
+    def have(self, conn, addr, ID, length):
+        with conn:
+            try:
+                if length != HAVE_REQUEST.size: raise struct.error
+                digest, flags = HAVE_REQUEST.unpack(recvExact(conn, length))
+            except (struct.error, ConnectionError):
+                log.warning('Have Failed, invalid request from client in %s.', addr)
+                metrics.outcome('invalid')
+                return
+
+            self.acquireUpload()
+            try:
+                if not self.server.storage.has(digest):
+                    status = STATUS_NOT_FOUND
+                elif not flags & HAVE_REPLACE and isfile(self.filename):
+                    status = STATUS_EXISTS
+                else:
+                    st = self.server.storage.link(self.filename, digest)
+                    if st is None:
+                        status = STATUS_NOT_FOUND
+                    else:
+                        self.server.cache.invalidate(self.filename)
+                        self.server.files.add(self.name, st.st_size, st.st_mtime)
+                        self.server.checksums.put(self.name, st, digest)
+                        status = STATUS_OK
+            finally:
+                self.releaseUpload()
+
+            conn.send(status)
+            if status == STATUS_OK: log.info('Upload Successfull, %s linked to existing content, no data received.', self.filename)
+            else: log.info('Have: %s for %s.', status.decode(), self.filename)
+            metrics.outcome(STATUS_OUTCOMES.get(status, 'failed'))
+
+    # Delta
+    # Upload por diferencias (ver Protocol.DELTA_SIGNATURE). Consta de los siguientes
+    # pasos:
+    # (2) Confirmar la existencia del archivo en el servidor
+    # (3) Confirmar la sobreescritura
+    # (4) Envíar las firmas de los bloques de la versión actual
+    # (5) Construir el nuevo archivo en un temporal con las instrucciones del cliente
+    # (6) Verificar el tamaño y el SHA-256, publicarlo y envíar una confirmación
+    #
+    # El recurso (Lector) solo se adquiere para abrir la versión actual: los archivos
+    # publicados nunca se modifican (se reemplazan con un rename), por lo que el archivo
+    # abierto conserva esa versión aunque otro hilo lo reemplace mientras tanto.
+    def delta(self, conn, addr, ID, length):
+        log.debug('Preparing for delta upload...')
+
+        with conn:
+            # Checking file existence (I)
+            self.acquireRead()
+            try:
+                basis = open(self.filename, 'rb') if self.exists() else None
+            finally:
+                self.releaseRead()
+            if basis is None:
+                conn.send(b'n') # Reply (2)
+                log.warning("Delta Upload Failed, %s doesn't exist.", self.filename)
+                metrics.outcome('not_found')
+                return
+
+            with basis:
+                try:
+                    # Reply (2) y Replace? (3)
+                    conn.send(b'y')
+                    if conn.recv(1) == b'n':
+                        log.info('Upload Aborted by client in %s', addr)
+                        metrics.outcome('aborted')
+                        return
+
+                    # Signatures (4)
+                    size = os.fstat(basis.fileno()).st_size
+                    block = blockSize(size)
+                    conn.sendall(DELTA_SIGNATURE.pack(block, size) + signatures(basis, block))
+                    log.debug('Sent signatures of %s, receiving delta from client in %s.', self.filename, addr)
+
+                    # Construcción del archivo (5)
+                    staged = StagedFile(self.filename, self.server.fsync, hashing=True)
+                    try:
+                        copied = self.rebuild(conn, staged, basis.fileno(), block, size, length)
+                        staged.finish()
+
+                        # Verificación y publicación (6)
+                        if copied is None:
+                            conn.send(STATUS_BAD_REQUEST)
+                            log.warning("Delta Upload Failed, delta from client in %s doesn't match %s.", addr, self.filename)
+                            metrics.outcome('invalid')
+                            return
+                        self.publish(staged, staged.digest.digest())
+                    finally:
+                        staged.discard()
+                    conn.send(STATUS_OK)
+                    log.info('Upload Successfull, stored %s from client in %s (%s of %s bytes reused).', self.filename, addr, copied, length, bytes=length - copied)
+                    metrics.outcome('ok', bytesIn=length - copied)
+                except ConnectionError:
+                    log.warning('Upload Failed, connection with client in %s was lost.', addr)
+                    metrics.outcome('lost')
+
+    # Escribe en el temporal el archivo descrito por las instrucciones del cliente,
+    # copiando los bloques de la versión actual (descriptor fd, de size bytes) a partir
+    # de los bloques indicados. Regresa el número de bytes copiados, o None si el
+    # archivo no tiene length bytes y el SHA-256 indicado por el cliente
+    def rebuild(self, conn, staged, fd, block, size, length):
+        written = copied = 0
+        while True:
+            kind, value = DELTA_INSTRUCTION.unpack(recvExact(conn, DELTA_INSTRUCTION.size))
+            if kind == DELTA_COPY and value * block < size:
+                data = os.pread(fd, block, value * block)
+                if written + len(data) > length: return None
+                staged.write(data)
+                written += len(data)
+                copied += len(data)
+            elif kind == DELTA_DATA and written + value <= length:
+                recvToFile(conn, staged, value)
+                written += value
+            elif kind == DELTA_END:
+                digest = recvExact(conn, DIGEST_SIZE)
+                return copied if written == length and staged.digest.digest() == digest else None
+            else:
+                return None
+
+    # Publica un archivo recibido (StagedFile) como Escritor upload, a través del
+    # almacenamiento del servidor: el recurso solo se mantiene durante la publicación y
+    # la actualización de los índices. digest es el SHA-256 que debe tener el archivo,
+    # si se conoce. Si el temporal calculó su SHA-256 al recibirlo y no coincide, no se
+    # publica: lanza ValueError, y el temporal se descarta (staged.discard del que
+    # llama), como en assemble y delta. Regresa el SHA-256, o None si no se conoce
+    def publish(self, staged, digest=None):
+        received = staged.digest.digest() if staged.digest is not None else None
+        if digest is not None and received is not None and digest != received:
+            raise ValueError(f"SHA-256 of the received data doesn't match the client's, {self.filename} not published.")
+        digest = digest or received
+        self.acquireUpload()
+        try:
+            st = self.server.storage.publish(staged, self.filename, digest)
+            self.server.cache.invalidate(self.filename)
+            # File list update
+            # Agrega el archivo al índice del servidor, y su SHA-256 al de checksums
+            self.server.files.add(self.name, st.st_size, st.st_mtime)
+            if digest is not None: self.server.checksums.put(self.name, st, digest)
+        finally:
+            self.releaseUpload()
+        return digest
 
-        # Resource liberation (VI)
-        self.deletedLock.acquire()
-        self.deleted = False
-        self.deletedLock.release()
-        self.writersLock.release()
-    
     # Remove
     # Gestiona el proceso de la eliminación de un archivo almacenado en el servidor
     # Consta de los siguientes pasos:
@@ -191,9 +604,9 @@ class ResourceFile:
     # no se puede revertir)
     # (4) Eliminar el archivo y confirmar al usuario la eliminación
     def delete(self, conn, addr, ID):
-        print(f'{datetime.now()} [Thread #{ID}] Preparing for delete, trying to aquire resource...')
+        log.debug('Preparing for delete, trying to aquire resource...')
         # Resource Adquisition (I)
-        self.writersLock.acquire()
+        self.acquireDelete()
 
         with conn:
             # File doesn't more exist (II)
@@ -203,7 +616,8 @@ class ResourceFile:
             if self.deleted:
                 self.deletedLock.release()
                 conn.send(b'n') # Reply (2)
-                print(f"{datetime.now()} [Thread #{ID}] Delete Failed, {self.filename} doesn't exist.")
+                log.warning("Delete Failed, %s doesn't exist.", self.filename)
+                metrics.outcome('not_found')
             else:
                 # Checking file existence (III)
                 if isfile(self.filename):
@@ -211,41 +625,166 @@ class ResourceFile:
                     conn.send(b'y')
                     # Remove? (3)
                     # Pregunta al usuario por última vez si desea eliminar el archivo
-                    print(f'{datetime.now()} [Thread #{ID}] File found. Waiting for confirmation to delete...')
+                    log.debug('File found. Waiting for confirmation to delete...')
                     remove = conn.recv(1).decode('utf-8', 'replace')
                     if remove == 'n':
-                        print(f"{datetime.now()} [Thread #{ID}] Delete Aborted, by client in {addr}")
+                        log.info('Delete Aborted, by client in %s', addr)
+                        metrics.outcome('aborted')
                     else:
-                        print(f'{datetime.now()} [Thread #{ID}] Delete Confirmed.')
+                        log.debug('Delete Confirmed.')
                         # Delete file permanently (IV)
-                        os.remove(self.filename)
+                        self.server.storage.remove(self.filename)
+                        self.server.cache.invalidate(self.filename)
 
                         # Confirmation (4)
                         conn.send(b'100')
-                        print(f"{datetime.now()}: Delete Successfull, {self.filename} was succesfully deleted.")
-
-                        # Removing resource from server (V)
-                        # Elimina este recurso de la lista del servidor, solo si no
-                        # quedan hilos upload() esperando.
-                        self.uploadLock.acquire()
-                        if self.uploadCount == 0:
-                            self.server.removeResource(self)
-                            print(f"{datetime.now()} [Thread #{ID}] Resource object for {self.filename} was removed from the system.")
-                        self.uploadLock.release()
-
-                        # File list update (VI)
-                        # Actualiza la lista de archivos en el servidor
-                        self.server.updateFileList()
-                        print(f"{datetime.now()} [Thread #{ID}] File list of server was updated.")
+                        log.info('Delete Successfull, %s was succesfully deleted.', self.filename)
+                        metrics.outcome('ok')
+
+                        # File list update (V)
+                        # Elimina el archivo de los índices del servidor
+                        self.server.files.remove(self.name)
+                        self.server.checksums.remove(self.name)
 
                         # File deleted
                         self.deleted = True
                         
                 else:
                     conn.send(b'n') # Reply (2)
-                    print(f"{datetime.now()}: Download Failed, {self.filename} doesn't exist")
+                    log.warning("Download Failed, %s doesn't exist", self.filename)
+                    metrics.outcome('not_found')
+
+                self.deletedLock.release()
+
+        # Resource liberation (VI)
+        self.releaseDelete()
+
+    # Checksum
+    # Responde el tamaño, la fecha de modificación y el SHA-256 del archivo (ver
+    # Protocol.CHECKSUM_REPLY), como Lector. El SHA-256 se toma del índice de checksums
+    # del servidor (ChecksumIndex) sin leer el archivo, excepto la primera vez que se
+    # consulta un archivo que no se recibió con un upload.
+    def checksum(self, conn, addr, ID):
+        self.acquireRead()
+        try:
+            with conn:
+                result = self.exists() and self.server.checksums.checksum(self.name, self.filename)
+                if not result:
+                    conn.send(b'n')
+                    log.warning("Checksum Failed, %s doesn't exist", self.filename)
+                    metrics.outcome('not_found')
+                    return
+                st, digest = result
+                conn.sendall(b'y' + CHECKSUM_REPLY.pack(st.st_size, st.st_mtime, digest))
+                log.info('Checksum Successfull, sended checksum of %s to client in %s', self.filename, addr)
+                metrics.outcome('ok')
+        finally:
+            self.releaseRead()
+
+    # Operaciones de una sesión
+    # Versiones no interactivas de download, upload y delete para las peticiones de una
+    # sesión (MainServer.session). Usan el mismo modelo de Lectores y Escritores, pero
+    # responden con una sola respuesta de sesión (identificada por tag) y no cierran la
+    # conexión. Regresan el status enviado al cliente.
 
+    # Download: responde con el archivo completo (o la parte pedida), o STATUS_NOT_FOUND
+    def sessionDownload(self, conn, tag, offset=0, count=0):
+        self.acquireRead()
+        try:
+            if not self.exists():
+                sendSessionResponse(conn, tag, 'dw', STATUS_NOT_FOUND)
+                return STATUS_NOT_FOUND
+
+            f, data = openCached(self.server.cache, self.filename)
+            with f:
+                size = sliceLength(f.seek(0, os.SEEK_END), offset, count)
+                sendSessionResponse(conn, tag, 'dw', STATUS_OK, length=size)
+                if data is not None: conn.sendall(memoryview(data)[offset:offset + size])
+                else: sendFile(conn, f, size, offset)
+            metrics.transferred(bytesOut=size)
+            return STATUS_OK
+        finally:
+            self.releaseRead()
+
+    # Upload: recibe el archivo (store) y responde con su status
+    def sessionUpload(self, conn, tag, length, replace):
+        status = self.store(conn, length, replace)
+        sendSessionResponse(conn, tag, 'up', status)
+        return status
+
+    # Delete: elimina el archivo sin pedir confirmación
+    def sessionDelete(self, conn, tag):
+        self.acquireDelete()
+        try:
+            self.deletedLock.acquire()
+            try:
+                if self.deleted or not isfile(self.filename):
+                    status = STATUS_NOT_FOUND
+                else:
+                    self.server.storage.remove(self.filename)
+                    self.server.cache.invalidate(self.filename)
+                    self.server.files.remove(self.name)
+                    self.server.checksums.remove(self.name)
+                    self.deleted = True
+                    status = STATUS_OK
+            finally:
                 self.deletedLock.release()
+            sendSessionResponse(conn, tag, 'dl', status)
+            return status
+        finally:
+            self.releaseDelete()
+
+    # Checksum: responde CHECKSUM_REPLY, o STATUS_NOT_FOUND
+    def sessionChecksum(self, conn, tag):
+        self.acquireRead()
+        try:
+            result = self.exists() and self.server.checksums.checksum(self.name, self.filename)
+            if not result:
+                sendSessionResponse(conn, tag, 'ck', STATUS_NOT_FOUND)
+                return STATUS_NOT_FOUND
+            st, digest = result
+            sendSessionResponse(conn, tag, 'ck', STATUS_OK, CHECKSUM_REPLY.pack(st.st_size, st.st_mtime, digest))
+            return STATUS_OK
+        finally:
+            self.releaseRead()
+
+    # Operaciones de un paquete (MainServer.bundleUpload, MainServer.bundleDownload)
+    # Reciben o envían un archivo del paquete, sin respuesta propia: el status de cada
+    # archivo forma parte del paquete. Regresan el status del archivo.
+
+    # Recibe length bytes en un temporal y lo publica. Si el archivo existe y replace es
+    # falso, los datos se descartan y regresa STATUS_EXISTS
+    def store(self, conn, length, replace):
+        if not replace and isfile(self.filename):
+            discard(conn, length)
+            return STATUS_EXISTS
+
+        staged = StagedFile(self.filename, self.server.fsync, hashing=self.server.storage.hashing)
+        try:
+            recvToFile(conn, staged, length)
+            staged.finish()
+            self.publish(staged)
+        finally:
+            staged.discard()
+        metrics.transferred(bytesIn=length)
+        return STATUS_OK
+
+    # Envía el BUNDLE_ENTRY del archivo seguido de sus datos, o un BUNDLE_ENTRY con
+    # STATUS_NOT_FOUND si fue eliminado
+    def bundleDownload(self, conn):
+        self.acquireRead()
+        try:
+            if not self.exists():
+                conn.sendall(packBundleEntry(STATUS_NOT_FOUND, self.name))
+                return STATUS_NOT_FOUND
 
-        # Resource liberation (VII)
-        self.writersLock.release()
\ No newline at end of file
+            f, data = openCached(self.server.cache, self.filename)
+            with f:
+                size = f.seek(0, os.SEEK_END)
+                conn.sendall(packBundleEntry(STATUS_OK, self.name, size))
+                if data is not None: conn.sendall(data)
+                else: sendFile(conn, f, size)
+            metrics.transferred(bytesOut=size)
+            return STATUS_OK
+        finally:
+            self.releaseRead()
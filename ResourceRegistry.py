@@ -0,0 +1,66 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import threading
+from zlib import crc32
+
+# ResourceRegistry
+# Registro de los recursos activos del servidor, indexados por nombre de archivo.
+#
+# Cada entrada guarda el recurso y un contador de referencias: acquire() incrementa
+# el contador (creando el recurso si no existe) y release() lo decrementa. Cuando
+# ninguna operación tiene el recurso, la entrada se elimina, por lo que el registro
+# solo contiene los archivos en uso y no crece con cada archivo accedido.
+#
+# Mientras una operación tenga una referencia, cualquier otra operación sobre el mismo
+# archivo obtiene el mismo recurso (y por lo tanto los mismos semáforos).
+#
+# Las entradas se reparten en varios diccionarios (stripes), cada uno con su propio
+# semáforo, de tal forma que operaciones sobre archivos distintos casi nunca compiten
+# por el mismo semáforo.
+class ResourceRegistry:
+    def __init__(self, factory, stripes=16):
+        self.factory = factory # Función que crea un recurso a partir del nombre del archivo
+        self.stripes = [({}, threading.Lock()) for _ in range(stripes)]
+
+    # Diccionario y semáforo que corresponden al archivo
+    def stripe(self, filename):
+        return self.stripes[crc32(filename.encode('utf-8', 'replace')) % len(self.stripes)]
+
+    # Provee el recurso para el archivo indicado y toma una referencia. Si no existe,
+    # lo crea.
+    def acquire(self, filename):
+        entries, lock = self.stripe(filename)
+        with lock:
+            entry = entries.get(filename)
+            if entry is None:
+                entry = entries[filename] = [self.factory(filename), 0]
+            entry[1] += 1
+            return entry[0]
+
+    # Libera una referencia al recurso. Si era la última, lo elimina del registro.
+    def release(self, resource):
+        entries, lock = self.stripe(resource.filename)
+        with lock:
+            entry = entries.get(resource.filename)
+            if entry is None or entry[0] is not resource:
+                return False
+            entry[1] -= 1
+            if entry[1] == 0:
+                del entries[resource.filename]
+            return True
+
+    # Número de recursos activos
+    def __len__(self):
+        return sum(len(entries) for entries, lock in self.stripes)
@@ -0,0 +1,281 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import time
+import fcntl
+import struct
+import hashlib
+from tempfile import mkstemp
+from os.path import dirname, basename, join
+
+# Niveles de sincronización con el disco (--fsync)
+# 'none': el sistema operativo decide cuándo escribir los datos
+# 'file': los datos del archivo se escriben al disco antes de publicarlo
+# 'full': además, se escribe el directorio después de publicarlo (el nuevo nombre
+#         sobrevive a una caída del sistema)
+FSYNC_LEVELS = ('none', 'file', 'full')
+
+# Los archivos temporales se reconocen por su prefijo y sufijo, y no forman parte del
+# índice de archivos del servidor. Los de uploads reanudables (PARTIAL_SUFFIX) y por
+# partes (MULTIPART_SUFFIX y RANGES_SUFFIX, ver Multipart) se conservan entre
+# ejecuciones; los de un upload por partes, hasta MULTIPART_EXPIRY (ver
+# removeTemporaries).
+TEMP_PREFIX = '.'
+TEMP_SUFFIX = '.part'
+PARTIAL_SUFFIX = '.partial'
+MULTIPART_SUFFIX = '.multipart'
+RANGES_SUFFIX = '.ranges'
+MULTIPART_EXPIRY = 7 * 24 * 3600 # Segundos sin recibir partes tras los que se descarta un upload por partes
+
+# Permisos de los archivos publicados: los de un archivo creado con open() (0666 menos
+# la umask del proceso). mkstemp crea los temporales con 0600, por lo que se cambian
+# al crearlos. La umask solo puede leerse cambiándola, por lo que se lee una vez al
+# iniciar, antes de que haya otros hilos
+def currentUmask():
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+FILE_MODE = 0o666 & ~currentUmask()
+
+# StagedFile
+# Archivo que se recibe en un archivo temporal del mismo directorio y que se publica
+# con un solo rename atómico (os.replace) al terminar.
+#
+# Mientras se reciben los datos, el archivo anterior (si existe) sigue completo y
+# disponible para los lectores; un upload interrumpido nunca deja un archivo truncado,
+# solo se elimina el temporal. Como el rename es atómico, un lector obtiene la
+# versión anterior o la nueva, nunca una mezcla.
+#
+# Uso:
+#   staged = StagedFile(filename, fsync)
+#   try:
+#       recvToFile(conn, staged.file, length)
+#       staged.finish()    # Sin semáforos: cierra (y sincroniza) el temporal
+#       ...adquirir el recurso...
+#       staged.commit()    # Solo el rename
+#   finally:
+#       staged.discard()   # Elimina el temporal si no se publicó
+#
+# Con size (upload reanudable, ver Protocol.RESUME_OFFSET) el temporal tiene un nombre
+# fijo por archivo y no se elimina en discard(), de tal forma que el siguiente intento
+# continúa al final de los datos ya recibidos (offset). Si el temporal es más grande
+# que size, pertenece a otra versión del archivo y se descarta. suffix distingue los
+# temporales de un upload reanudable (PARTIAL_SUFFIX) de los de un upload por partes
+# (MULTIPART_SUFFIX), que se escriben con os.pwrite desde varias conexiones.
+#
+# Con hashing, write() calcula el SHA-256 de los datos mientras se reciben (digest);
+# solo es posible si el temporal se escribe completo en una sola conexión, por lo que
+# un temporal reanudable nunca tiene digest.
+class StagedFile:
+    def __init__(self, filename, fsync='none', size=None, suffix=PARTIAL_SUFFIX, hashing=False):
+        self.filename = filename # Nombre final del archivo
+        self.fsync = fsync # Nivel de sincronización (FSYNC_LEVELS)
+        self.committed = False # Bandera de publicación
+        self.resumable = size is not None # Bandera de upload reanudable
+        self.offset = 0 # Bytes que ya contiene el temporal
+        self.digest = hashlib.sha256() if hashing and not self.resumable else None # SHA-256 de los datos
+
+        if self.resumable:
+            self.tempname = stagingName(filename, suffix)
+            self.file = open(self.tempname, 'ab')
+            self.offset = self.file.tell()
+            if self.offset > size:
+                self.file.truncate(0)
+                self.offset = 0
+        else:
+            fd, self.tempname = mkstemp(prefix=TEMP_PREFIX + basename(filename) + '.',
+                                        suffix=TEMP_SUFFIX, dir=dirname(filename) or '.')
+            os.fchmod(fd, FILE_MODE)
+            self.file = os.fdopen(fd, 'wb')
+
+    # Escribe datos en el temporal
+    def write(self, data):
+        if self.digest: self.digest.update(data)
+        self.file.write(data)
+
+    # Termina la escritura del temporal. Se ejecuta antes de adquirir el recurso, pues
+    # el fsync puede tardar
+    def finish(self):
+        self.file.flush()
+        if self.fsync != 'none':
+            os.fsync(self.file.fileno())
+        self.file.close()
+
+    # Publica el archivo (rename atómico) con su nombre final, o con el nombre target.
+    # Regresa el stat del archivo publicado
+    def commit(self, target=None):
+        target = target or self.filename
+        os.replace(self.tempname, target)
+        self.committed = True
+        if self.fsync == 'full': syncDirectory(target)
+        return os.stat(target)
+
+    # Elimina el temporal sin publicarlo, aunque sea reanudable (su contenido ya está
+    # publicado por otro medio)
+    def drop(self):
+        os.remove(self.tempname)
+        self.committed = True
+
+    # Elimina el temporal si el archivo no se publicó (salvo si es reanudable)
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if not self.committed and not self.resumable:
+            try:
+                os.remove(self.tempname)
+            except FileNotFoundError:
+                pass
+
+# Escribe al disco el directorio que contiene al archivo filename
+def syncDirectory(filename):
+    fd = os.open(dirname(filename) or '.', os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# Nombre del temporal fijo (reanudable o por partes) de un archivo
+def stagingName(filename, suffix):
+    return join(dirname(filename), TEMP_PREFIX + basename(filename) + suffix)
+
+# Verifica si el nombre corresponde a un archivo temporal
+def isTemporary(name):
+    return name.startswith(TEMP_PREFIX) and name.endswith((TEMP_SUFFIX, PARTIAL_SUFFIX, MULTIPART_SUFFIX, RANGES_SUFFIX))
+
+# Multipart
+# Temporales de un upload por partes (ver Protocol.PART_REQUEST). Cada upload tiene un
+# identificador (upload) que el servidor genera al crearlo, y que forma parte del
+# nombre de sus temporales, por lo que dos clientes que suben el mismo archivo al mismo
+# tiempo nunca escriben en el mismo temporal:
+#   .NAME.ID.multipart: los datos, creado con el tamaño total del archivo. Las partes
+#                       se escriben en su posición con os.pwrite
+#   .NAME.ID.ranges:    registro de las partes recibidas completas, cada una con una
+#                       sola escritura (O_APPEND) de RANGE_RECORD (offset, length)
+#
+# Como las partes pueden llegar a distintos procesos (--processes), el estado del
+# upload está solo en el disco, y la exclusión entre las partes y el ensamblado es un
+# flock sobre el temporal de datos: cada parte lo tiene compartido mientras escribe, y
+# el ensamblado lo toma exclusivo. Ninguno espera: si el otro tiene el lock se lanza
+# BlockingIOError, y el cliente debe reintentar. Una parte que abre el temporal
+# después de que se publicó (rename) lo detecta al comparar su inodo con el del nombre.
+RANGE_RECORD = struct.Struct('!QQ')
+
+class Multipart:
+    def __init__(self, filename, upload):
+        self.filename = filename # Nombre final del archivo
+        self.upload = upload # Identificador del upload
+        self.suffix = f'.{upload:016x}{MULTIPART_SUFFIX}' # Sufijo del temporal de datos (ver StagedFile)
+        self.tempname = stagingName(filename, self.suffix)
+        self.rangesname = stagingName(filename, f'.{upload:016x}{RANGES_SUFFIX}')
+        self.fd = None # Descriptor que tiene el lock
+
+    # Crea los temporales de un upload nuevo de total bytes. Lanza OSError (sin dejar
+    # temporales) si no puede crearlos
+    @classmethod
+    def create(cls, filename, total):
+        while True:
+            multipart = cls(filename, int.from_bytes(os.urandom(8), 'big') or 1)
+            try:
+                fd = os.open(multipart.tempname, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+            except FileExistsError:
+                continue
+            try:
+                os.ftruncate(fd, total)
+            except OSError:
+                os.remove(multipart.tempname)
+                raise
+            finally:
+                os.close(fd)
+            os.close(os.open(multipart.rangesname, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o666))
+            return multipart
+
+    # Abre el temporal de datos con el lock indicado (fcntl.LOCK_SH para escribir una
+    # parte, fcntl.LOCK_EX para ensamblar). Lanza FileNotFoundError si el upload no
+    # existe (o ya se publicó), y BlockingIOError si otra conexión tiene el lock
+    def lock(self, kind):
+        fd = os.open(self.tempname, os.O_WRONLY if kind == fcntl.LOCK_SH else os.O_RDONLY)
+        try:
+            fcntl.flock(fd, kind | fcntl.LOCK_NB)
+            if os.stat(self.tempname).st_ino != os.fstat(fd).st_ino:
+                raise FileNotFoundError(f'{self.tempname} was already published.')
+        except BaseException:
+            os.close(fd)
+            raise
+        self.fd = fd
+
+    # Cierra el temporal de datos (libera el lock)
+    def unlock(self):
+        fd, self.fd = self.fd, None
+        os.close(fd)
+
+    # Tamaño total del upload
+    def total(self):
+        return os.fstat(self.fd).st_size
+
+    # Registra que se recibió completa la parte de length bytes a partir de offset
+    def record(self, offset, length):
+        fd = os.open(self.rangesname, os.O_WRONLY | os.O_APPEND)
+        try:
+            os.write(fd, RANGE_RECORD.pack(offset, length))
+        finally:
+            os.close(fd)
+
+    # Verifica que las partes recibidas cubran todo el archivo. Se ejecuta con el lock
+    # exclusivo
+    def complete(self):
+        with open(self.rangesname, 'rb') as f:
+            data = f.read()
+        covered = 0
+        for offset, length in sorted(RANGE_RECORD.iter_unpack(data[:len(data) - len(data) % RANGE_RECORD.size])):
+            if offset > covered: return False
+            covered = max(covered, offset + length)
+        return covered >= self.total()
+
+    # Elimina los temporales del upload (el de datos, si no se publicó)
+    def remove(self):
+        for name in (self.tempname, self.rangesname):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+# Elimina los temporales que dejó una ejecución anterior interrumpida de entre los
+# archivos entries (os.DirEntry, ver Layout.scan). Los de uploads reanudables se
+# conservan; los de uploads por partes, solo si recibieron datos (mtime) en los últimos
+# expiry segundos, pues el cliente que no terminó de enviar las partes puede haberlos
+# abandonado. Regresa el número de archivos eliminados. Solo debe ejecutarse al iniciar
+# el servidor.
+def removeTemporaries(entries, expiry=MULTIPART_EXPIRY):
+    count = 0
+    uploads = {} # Upload por partes (ruta sin el sufijo) -> sus temporales
+    for e in entries:
+        if not e.name.startswith(TEMP_PREFIX): continue
+        if e.name.endswith(TEMP_SUFFIX):
+            os.remove(e.path)
+            count += 1
+        elif e.name.endswith(MULTIPART_SUFFIX):
+            uploads.setdefault(e.path[:-len(MULTIPART_SUFFIX)], []).append(e)
+        elif e.name.endswith(RANGES_SUFFIX):
+            uploads.setdefault(e.path[:-len(RANGES_SUFFIX)], []).append(e)
+
+    # Un registro de partes sin temporal de datos quedó de un upload ya ensamblado
+    oldest = time.time() - expiry
+    for files in uploads.values():
+        if not any(e.name.endswith(MULTIPART_SUFFIX) for e in files) or max(e.stat().st_mtime for e in files) < oldest:
+            for e in files:
+                os.remove(e.path)
+                count += 1
+    return count
@@ -0,0 +1,174 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import secrets
+import threading
+from os.path import isfile, join, dirname, basename
+from StagedFile import TEMP_PREFIX, TEMP_SUFFIX, isTemporary, syncDirectory
+from Protocol import fileDigest
+
+# Almacenamiento de los archivos del servidor
+# Los recursos (ResourceFile) publican y eliminan archivos a través del almacenamiento
+# del servidor (server.storage), que decide cómo se guardan en el disco. En ambos
+# casos el archivo queda disponible en su ruta de la organización del directorio
+# (Layout.path, p. ej. recv/NAME), de tal forma que la lectura (download) y el índice
+# no dependen del almacenamiento.
+#
+# publish(staged, filename, digest) publica un StagedFile con el nombre filename
+# remove(filename) elimina el archivo
+# has(digest) indica si el almacenamiento tiene el contenido con ese SHA-256
+# link(filename, digest) publica con el nombre filename un contenido que el
+#     almacenamiento ya tiene (por su SHA-256). Regresa el stat, o None si no lo tiene
+# hashing indica si el almacenamiento necesita el SHA-256 de los archivos recibidos
+
+# PlainStorage
+# Cada archivo es una copia independiente (el comportamiento original del servidor)
+class PlainStorage:
+    hashing = False
+
+    def __init__(self, layout):
+        self.root = layout.root # Directorio de los archivos
+
+    def publish(self, staged, filename, digest=None):
+        return staged.commit(filename)
+
+    def remove(self, filename):
+        os.remove(filename)
+
+    def has(self, digest):
+        return False
+
+    def link(self, filename, digest):
+        return None
+
+    def stats(self):
+        return {'backend': 'plain'}
+
+# BlobStorage
+# Almacenamiento por contenido (deduplicación). Cada contenido distinto se guarda una
+# sola vez en root/.blobs/XX/SHA256 (blob), y cada nombre de root es un enlace físico
+# (hard link) a su blob. Así, subir el mismo archivo con varios nombres no ocupa más
+# espacio, y si el cliente indica el SHA-256 de un contenido que ya existe, el archivo
+# se publica sin recibir sus datos (link).
+#
+# El número de enlaces del blob (st_nlink) es su contador de referencias: al eliminar
+# o reemplazar un nombre, si el blob queda con un solo enlace (el suyo) se elimina.
+# Como los archivos publicados nunca se modifican (todo upload se recibe en un
+# temporal), compartir el inode entre nombres es seguro.
+#
+# El índice nombre -> SHA-256 se reconstruye al iniciar, comparando los inodes de los
+# archivos de la organización (layout) con los de los blobs. Los archivos que no son enlaces a un blob
+# (subidos antes de activar la deduplicación) se conservan tal cual.
+class BlobStorage:
+    hashing = True
+
+    def __init__(self, layout):
+        self.root = layout.root # Directorio de los archivos
+        self.layout = layout # Organización de los archivos
+        self.blobs = join(self.root, '.blobs') # Directorio de los blobs
+        self.names = {} # Nombre de archivo -> SHA-256 (hex) de su contenido
+        self.lock = threading.Lock() # Semáforo para names y los contadores de los blobs
+        os.makedirs(self.blobs, exist_ok=True)
+        self.reconcile()
+
+    # Reconstruye el índice de nombres a partir de los inodes y elimina los blobs que
+    # ningún nombre utiliza. Regresa el número de nombres enlazados a un blob
+    def reconcile(self):
+        inodes = {}
+        with os.scandir(self.blobs) as prefixes:
+            for prefix in prefixes:
+                if not prefix.is_dir(): continue
+                with os.scandir(prefix.path) as entries:
+                    for e in entries:
+                        st = e.stat()
+                        # Blob sin nombres (ejecución anterior interrumpida)
+                        if st.st_nlink <= 1: os.remove(e.path)
+                        else: inodes[st.st_dev, st.st_ino] = e.name
+
+        names = {}
+        for e in self.layout.scan():
+            if not isTemporary(e.name):
+                st = e.stat()
+                digest = inodes.get((st.st_dev, st.st_ino))
+                if digest: names[e.name] = digest
+        with self.lock:
+            self.names = names
+        return len(names)
+
+    def blobName(self, digest):
+        return join(self.blobs, digest[:2], digest)
+
+    # Guarda el contenido del temporal como blob (si no existía) y lo publica con el
+    # nombre filename. digest es el SHA-256 ya calculado (bytes), si se conoce
+    def publish(self, staged, filename, digest=None):
+        if digest is None:
+            digest = staged.digest.digest() if staged.digest else fileDigest(staged.tempname)
+        digest = digest.hex()
+        blob = self.blobName(digest)
+        with self.lock:
+            if isfile(blob):
+                staged.drop()
+            else:
+                os.makedirs(dirname(blob), exist_ok=True)
+                staged.commit(blob)
+            st = self.place(filename, digest)
+        if staged.fsync == 'full': syncDirectory(filename)
+        return st
+
+    def has(self, digest):
+        return isfile(self.blobName(digest.hex()))
+
+    def link(self, filename, digest):
+        digest = digest.hex()
+        with self.lock:
+            if not isfile(self.blobName(digest)):
+                return None
+            return self.place(filename, digest)
+
+    def remove(self, filename):
+        with self.lock:
+            os.remove(filename)
+            digest = self.names.pop(basename(filename), None)
+            if digest: self.release(digest)
+
+    # Enlaza el nombre filename al blob (reemplazando atómicamente el archivo anterior,
+    # si existe) y libera el blob anterior. Se ejecuta con self.lock adquirido
+    def place(self, filename, digest):
+        temp = join(dirname(filename), f'{TEMP_PREFIX}{basename(filename)}.{secrets.token_hex(8)}{TEMP_SUFFIX}')
+        os.link(self.blobName(digest), temp)
+        os.replace(temp, filename)
+        # Si filename ya era un enlace al mismo blob, rename no hace nada y el temporal
+        # se conserva (sería un enlace de más en el contador del blob)
+        try:
+            os.remove(temp)
+        except FileNotFoundError:
+            pass
+
+        previous = self.names.get(basename(filename))
+        self.names[basename(filename)] = digest
+        if previous and previous != digest: self.release(previous)
+        return os.stat(filename)
+
+    # Elimina el blob si ningún nombre lo utiliza. Se ejecuta con self.lock adquirido
+    def release(self, digest):
+        blob = self.blobName(digest)
+        try:
+            if os.stat(blob).st_nlink <= 1: os.remove(blob)
+        except FileNotFoundError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            return {'backend': 'blobs', 'names': len(self.names), 'blobs': len(set(self.names.values()))}
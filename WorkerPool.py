@@ -0,0 +1,72 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import queue
+import threading
+from Log import log
+
+# WorkerPool
+# Conjunto fijo de hilos que atienden tareas desde una cola acotada. Los hilos se
+# crean una sola vez y se reutilizan, por lo que el número de hilos del servidor no
+# depende del número de conexiones.
+#
+# submit() nunca bloquea: si la cola está llena, la tarea se rechaza (regresa False)
+# y quien la envió decide cómo avisar al cliente. Así la memoria y la latencia se
+# mantienen acotadas aunque lleguen cientos de peticiones a la vez.
+class WorkerPool:
+    def __init__(self, workers=32, queueSize=64):
+        self.workers = workers # Número de hilos
+        self.tasks = queue.Queue(queueSize) # Cola acotada de tareas pendientes
+        self.activeCount = 0 # Contador de hilos ejecutando una tarea
+        self.rejectedCount = 0 # Contador de tareas rechazadas por cola llena
+        self.statsLock = threading.Lock() # Semáforo para acceder a los contadores
+
+        for i in range(workers):
+            threading.Thread(target=self.worker, name=f'Worker-{i + 1}', daemon=True).start()
+
+    # Encola la tarea func(*args). Regresa False si la cola está llena
+    def submit(self, func, *args):
+        try:
+            self.tasks.put_nowait((func, args))
+            return True
+        except queue.Full:
+            with self.statsLock:
+                self.rejectedCount += 1
+            return False
+
+    # Ciclo de cada hilo: toma una tarea de la cola y la ejecuta
+    def worker(self):
+        while True:
+            func, args = self.tasks.get()
+            with self.statsLock:
+                self.activeCount += 1
+            try:
+                func(*args)
+            except Exception as e:
+                log.error('Unhandled error in %s: %r', threading.current_thread().name, e)
+            finally:
+                with self.statsLock:
+                    self.activeCount -= 1
+                self.tasks.task_done()
+
+    # Estado actual del pool
+    def stats(self):
+        with self.statsLock:
+            return {
+                'workers': self.workers,
+                'active': self.activeCount,
+                'queued': self.tasks.qsize(),
+                'queueSize': self.tasks.maxsize,
+                'rejected': self.rejectedCount,
+            }
@@ -12,13 +12,25 @@
 # Otoño 2020
 # 27/Noviembre/2020
 
+import os
 import sys
-import socket
+import hashlib
 import argparse
-from os.path import isfile
+import threading
+from datetime import datetime
+from os.path import isfile, getsize
+from Protocol import BUSY, UNSUPPORTED, SESSION_REPLACE, STATUS_OK, STATUS_BAD_REQUEST, STATUS_EXISTS, RANGE_REQUEST, RESUME_OFFSET, PART_REQUEST
+from Protocol import PART_UPLOAD, PART_ASSEMBLE
+from Protocol import HAVE_REQUEST, HAVE_REPLACE, DELTA_SIGNATURE, DELTA_BLOCK, DELTA_INSTRUCTION, DELTA_COPY, DELTA_END
+from Protocol import packHeader, sendHeader, recvHeader, recvExact, recvToFile, sendFile, packListRequest, unpackList, packRange
+from Protocol import recvToOffset, fileDigest, packUploadOptions, connect, UPLOAD_VERIFY, RANGE_VERIFY, CHECKSUM_REPLY, DIGEST_SIZE, DigestWriter
+from Protocol import packSessionRequest, recvSessionResponse, unpackSessionList
+from Protocol import BUNDLE_REQUEST, BUNDLE_REPLACE, sendBundle, recvBundle, discard
+from Delta import signatureIndex, delta
+from Compression import available, compressible, sendCompressed, recvCompressed
 
 # Execution arguments order:
-# py client.py <host> <port> <operation> <file path>
+# py client.py <host> <port> <operation> <file path> [name]
 def main():
     argv = ParseArgs()# Resice parametros
 
@@ -29,18 +41,34 @@ def main():
     try:
         if argv.verbose:
             print(f'[+] Trying connection to {host}, {port}...')
-        with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
-            s.connect((host, port))
+        with connect((host, port)) as s:
             print(f'[+] Connected to {host}, {port}')
             # Does desired operation
             if argv.upload != None:
-                upload(s, argv.upload, argv.verbose)
+                # Upload mode: parallel parts, resumable or single stream
+                def send(conn):
+                    if argv.streams > 1: parallelUpload(conn, argv.upload, argv.streams, argv.verbose, argv.name)
+                    elif argv.resume: resumeUpload(conn, argv.upload, argv.verbose, argv.name)
+                    elif argv.delta: deltaUpload(conn, argv.upload, argv.verbose, argv.name)
+                    else: upload(conn, argv.upload, argv.verbose, argv.name, argv.compress, argv.verify)
+                if argv.dedup: dedupUpload(s, argv.upload, send, argv.verbose, argv.name)
+                else: send(s)
+            elif argv.download != None and argv.streams > 1:
+                parallelDownload(s, argv.download, argv.streams, argv.verbose, argv.name)
             elif argv.download != None:
-                download(s, argv.download, argv.verbose)
+                download(s, argv.download, argv.verbose, argv.offset, argv.count, argv.resume, argv.name, argv.compress, argv.verify)
             elif argv.delete != None:
                 delete(s, argv.delete, argv.verbose)
+            elif argv.checksum != None:
+                checksum(s, argv.checksum, argv.verbose, argv.name)
             elif argv.list:
-                listf(s, argv.verbose)
+                listf(s, argv.prefix, argv.cursor, argv.limit, argv.long, argv.verbose)
+            elif argv.batch != None:
+                batch(s, argv.batch, argv.yes, argv.long, argv.verbose)
+            elif argv.bundleUpload != None:
+                bundleUpload(s, argv.bundleUpload, argv.yes, argv.verbose)
+            elif argv.bundleDownload != None:
+                bundleDownload(s, argv.bundleDownload, argv.prefix, argv.yes, argv.verbose)
     except ConnectionRefusedError:
         print('[-] Error: Host Unreachable.')
     except Exception as e:
@@ -60,6 +88,11 @@ def ParseArgs():
                     type=int,
                     help='The port of the server.')
 
+    parser.add_argument('name',
+                    nargs='?',
+                    default=None,
+                    help='Upload/Download/Checksum: name of the file on the other side (default: same name).')
+
     group.add_argument('-up','--upload', 
                     action='store',
                     dest='upload',
@@ -78,20 +111,107 @@ def ParseArgs():
                     default=None,
                     help='Delete the specified file from server.')
 
+    group.add_argument('-ck','--checksum',
+                    action='store',
+                    dest='checksum',
+                    default=None,
+                    help='Show the SHA-256 of the specified file on server, and compare it with the local file (if any).')
+
     group.add_argument('-ls','--list', 
                     action='store_true',
                     dest='list',
                     default=False,
                     help='List server files')
     
-    group.add_argument('-v','--verbose', 
+    group.add_argument('-b','--batch',
+                    action='store',
+                    dest='batch',
+                    default=None,
+                    help='Run the operations listed in the given file ("-" for stdin) over one connection.')
+
+    group.add_argument('-bu','--bundle-upload',
+                    nargs='+',
+                    dest='bundleUpload',
+                    default=None,
+                    help='Upload the given files, and the files in the given directories, in one request.')
+
+    group.add_argument('-bd','--bundle-download',
+                    action='store',
+                    dest='bundleDownload',
+                    default=None,
+                    help='Download the files matching the given pattern (e.g. "*.txt", "" for all) in one request.')
+
+    parser.add_argument('-y','--yes',
+                    action='store_true',
+                    default=False,
+                    help='Batch and bundles: replace existing files without asking.')
+
+    parser.add_argument('-n','--streams',
+                    type=int,
+                    default=1,
+                    help='Upload/Download: transfer the file over N connections at once.')
+
+    parser.add_argument('--dedup',
+                    action='store_true',
+                    default=False,
+                    help="Upload: send only the file's SHA-256 first; the data is sent only if the server doesn't have it.")
+
+    parser.add_argument('-z','--compress',
+                    action='store_true',
+                    default=False,
+                    help='Upload/Download: compress the data while it is transferred (if it looks compressible).')
+
+    parser.add_argument('--delta',
+                    action='store_true',
+                    default=False,
+                    help="Upload: send only the parts of the file that differ from the server's copy.")
+
+    parser.add_argument('--no-verify',
+                    action='store_false',
+                    dest='verify',
+                    help="Upload/Download: don't verify the SHA-256 of the transferred data.")
+
+    parser.add_argument('--resume',
+                    action='store_true',
+                    default=False,
+                    help='Upload/Download: continue an interrupted transfer instead of starting over.')
+
+    parser.add_argument('--offset',
+                    type=int,
+                    default=0,
+                    help='Download: first byte of the file to download.')
+
+    parser.add_argument('--count',
+                    type=int,
+                    default=0,
+                    help='Download: number of bytes to download (default: up to the end).')
+
+    parser.add_argument('--prefix',
+                    default='',
+                    help='List: only files whose name starts with PREFIX.')
+
+    parser.add_argument('--limit',
+                    type=int,
+                    default=0,
+                    help='List: at most LIMIT files per page (default: all).')
+
+    parser.add_argument('--cursor',
+                    default='',
+                    help='List: continue after the given cursor (printed by the previous page).')
+
+    parser.add_argument('--long',
+                    action='store_true',
+                    default=False,
+                    help='List: show size and modification time.')
+
+    parser.add_argument('-v','--verbose', 
                     action='store_true',
                     dest='verbose',
                     default=False,
                     help='Show details of excecution.')
 
     #Lee los argumentos de la linea de comandos
-    args = parser.parse_args()
+    args = parser.parse_intermixed_args()
 
     if args.verbose:
         print("[upload]",args.upload)
@@ -101,32 +221,55 @@ def ParseArgs():
     
     return args
 
+# Checks the first reply of the server. Returns True (and reports it) if the server
+# is busy and the request must be retried later
+def busy(reply):
+    if reply == BUSY:
+        print('[-] Server busy, retry later.')
+        return True
+    return False
+
 # Upload file to server
-def upload(s,file, verbose=False):
+# With compress, the data is compressed while it is sent with the best compression
+# supported by both sides, unless it doesn't look compressible. With verify, the
+# SHA-256 of the data is sent after it, and the server saves the file only if the data
+# it received has the same SHA-256
+def upload(s,file, verbose=False, name=None, compress=False, verify=True):
     # Gets local filename and checks existence
     lfn = file
     if not isfile(lfn):
         print(f'[x] Error: Cannot find {lfn}.')
         return
     
-    # File exists, send request for Upload
-    s.send(b'up')
-    try:
-        rfn = sys.argv[5]
-    except IndexError:
-        rfn = lfn
+    rfn = name or lfn
+
+    # File exists, send request for Upload with filename and file size (1)
+    size = getsize(lfn)
+    if compress:
+        with open(lfn, 'rb') as lf:
+            compress = compressible(lf, 0, size)
+        if not compress and verbose:
+            print('[+] File does not look compressible, sending it uncompressed.')
+    if compress or verify:
+        # Compressed and/or verified upload: the request offers the available
+        # compressions (if any)
+        options = packUploadOptions(available() if compress else (), UPLOAD_VERIFY if verify else 0)
+        s.sendall(packHeader('zu', rfn, size) + options)
+    else:
+        sendHeader(s, 'up', rfn, size)
 
     if verbose:
         print(f'[+] Requested: Upload file {lfn} as {rfn}.')
         print('[+] Trying access to file...')
 
-    # Sends filename for server
-    s.send(rfn.encode('utf-8', 'replace'))
-
     # Reply (2)
-    exists = s.recv(1).decode('utf-8', 'replace')
+    exists = s.recv(1)
+    if busy(exists): return
+    exists = exists.decode('utf-8', 'replace')
+    codec = recvHeader(s)[1] if compress or verify else ''
     if verbose:
         print('[+] Access granted! Processing...')
+        if codec: print(f'[+] Compression: {codec}.')
 
     if exists == 'y':
         print(f'[-] File "{rfn}" already exists in server.')
@@ -141,40 +284,156 @@ def upload(s,file, verbose=False):
             print('[-] Upload Aborted')
             return
 
-    # Sending file data (4)
+    # Sending file data (4), and its SHA-256, computed while it is sent
+    digest = hashlib.sha256() if verify else None
     with open(lfn, 'rb') as lf:
         print('[+] Uploading...')
-        data = lf.read(4096)
-        while data:
-            s.send(data)
-            data = lf.read(4096)
+        if codec: sendCompressed(s, lf, size, 0, codec, digest)
+        else: sendFile(s, lf, size, 0, digest)
+    if verify: s.sendall(digest.digest())
 
     # Confirmation (5)
     reply = s.recv(3).decode('utf-8', 'replace')
-    if reply == '100': 
+    if reply == '100':
+        print(f"[+] File saved successfully on server{' (SHA-256 verified)' if verify else ''}.")
+    elif reply == '400':
+        print("[-] Couldn't save file on server. The data it received doesn't match the local file.")
+    else:
+        print("[-] Couldn't save file on server. Server reported error.")
+
+# Upload file to server, continuing a previous interrupted upload of the same file
+# (if any). Replaces the file on server without asking
+def resumeUpload(s, file, verbose=False, name=None):
+    lfn = file
+    if not isfile(lfn):
+        print(f'[x] Error: Cannot find {lfn}.')
+        return
+
+    rfn = name or lfn
+
+    # Request with the total file size (1)
+    size = getsize(lfn)
+    sendHeader(s, 'ru', rfn, size)
+    if verbose:
+        print(f'[+] Requested: Resumable upload of file {lfn} as {rfn}.')
+
+    # Reply (2): bytes already stored in server
+    reply = s.recv(1)
+    if busy(reply): return
+    offset, = RESUME_OFFSET.unpack(recvExact(s, RESUME_OFFSET.size))
+    if offset:
+        print(f'[+] Resuming upload from byte {offset} of {size}.')
+
+    # Sending the rest of the file (3)
+    with open(lfn, 'rb') as lf:
+        print('[+] Uploading...')
+        sendFile(s, lf, size - offset, offset)
+
+    # Confirmation (4)
+    reply = s.recv(3).decode('utf-8', 'replace')
+    if reply == '100':
         print('[+] File saved successfully on server.')
-    else: 
+    else:
         print("[-] Couldn't save file on server. Server reported error.")
 
-# Downlaod file from server
-def download(s,file,verbose=False):
-    # Requests download
-    s.send(b'dw')
+# Upload file to server sending only the differences with the server's copy: the
+# server sends the signatures of its blocks, and the client sends references to the
+# blocks it can reuse and the rest of the data (see Delta). If the file doesn't exist
+# on server, it is uploaded completely over a new connection
+def deltaUpload(s, file, verbose=False, name=None):
+    lfn = file
+    if not isfile(lfn):
+        print(f'[x] Error: Cannot find {lfn}.')
+        return
+
+    rfn = name or lfn
+
+    # Request with the new file size (1)
+    size = getsize(lfn)
+    sendHeader(s, 'dt', rfn, size)
+    if verbose:
+        print(f'[+] Requested: Delta upload of file {lfn} as {rfn}.')
+
+    # Reply (2)
+    exists = s.recv(1)
+    if busy(exists): return
+    if exists != b'y':
+        if verbose:
+            print(f'[+] File "{rfn}" not found on server, uploading it completely.')
+        with connect(s.getpeername()) as conn:
+            upload(conn, lfn, verbose, name)
+        return
 
+    print(f'[-] File "{rfn}" already exists in server.')
+    while True:
+        replace = input('Replace? (y/n) > ')
+        if replace == 'y' or replace == 'n':
+            # Replacement answer (3)
+            s.send(replace.encode('utf-8'))
+            break
+        print('(Expected "y" for replace, or "n" for cancel. Try again.)')
+    if replace == 'n':
+        print('[-] Upload Aborted')
+        return
+
+    # Signatures of the server's copy (4)
+    block, remote = DELTA_SIGNATURE.unpack(recvExact(s, DELTA_SIGNATURE.size))
+    count = -(-remote // block)
+    index, tail = signatureIndex(recvExact(s, count * DELTA_BLOCK.size), block, remote)
+    if verbose:
+        print(f'[+] Received {count} block signatures ({block} bytes per block).')
+
+    # Sending the delta (5)
+    print('[+] Uploading differences...')
+    digest = hashlib.sha256()
+    literal = 0
+    buffer = bytearray()
+    with open(lfn, 'rb') as lf:
+        for kind, value in delta(lf, block, index, tail, digest):
+            if kind == DELTA_COPY:
+                buffer += DELTA_INSTRUCTION.pack(kind, value)
+            else:
+                buffer += DELTA_INSTRUCTION.pack(kind, len(value))
+                buffer += value
+                literal += len(value)
+            if len(buffer) >= 65536:
+                s.sendall(buffer)
+                buffer.clear()
+    s.sendall(buffer + DELTA_INSTRUCTION.pack(DELTA_END, 0) + digest.digest())
+
+    # Confirmation (6)
+    reply = s.recv(3).decode('utf-8', 'replace')
+    if reply == '100':
+        print(f'[+] File saved successfully on server ({literal} of {size} bytes sent).')
+    else:
+        print("[-] Couldn't save file on server. Server reported error.")
+
+# Downlaod file from server
+# With offset and/or count only that part of the file is downloaded. With resume, an
+# existing local file is completed from its current size. With compress, the server
+# may send the data compressed. With verify, the server sends the SHA-256 of the data
+# after it, and the received data is verified against it
+def download(s,file,verbose=False,offset=0,count=0,resume=False,name=None,compress=False,verify=True):
     rfn = file
-    try:
-        lfn = sys.argv[5]
-    except IndexError:
-        lfn = rfn
+    lfn = name or rfn
+
+    resume = resume and isfile(lfn)
+    if resume:
+        offset = getsize(lfn)
+
+    # Requests download of filename (1), with the range, compressions and verification
+    # (if any)
+    flags = RANGE_VERIFY if verify else 0
+    request = packRange(offset, count, available() if compress else (), flags) if offset or count or compress or flags else b''
+    s.sendall(packHeader('dw', rfn, len(request)) + request)
     if verbose:
         print(f'[+] Requested: Download file {rfn} as {lfn}.')
         print('[+] Trying access to file...')
 
-    # Sends requested filename to server (1)
-    s.send(rfn.encode('utf-8', 'replace'))
-
     # Reply (2)
-    exists = s.recv(1).decode('utf-8', 'replace')
+    exists = s.recv(1)
+    if busy(exists): return
+    exists = exists.decode('utf-8', 'replace')
     if exists == 'n':
         print(f'[-] Cannot find {rfn} on server.')
         return
@@ -182,7 +441,10 @@ def download(s,file,verbose=False):
     # Checks file existence locally
     if verbose:
         print('[+] Access granted! Processing...')
-    if isfile(lfn):
+    if resume:
+        print(f'[+] Resuming download from byte {offset}.')
+        s.send(b'y')
+    elif isfile(lfn):
         print(f'[-] File {lfn} already exists locally.')
         while True:
             replace = input('Replace? (y/n) > ')
@@ -199,35 +461,38 @@ def download(s,file,verbose=False):
 
     # New File (4)
     print('[+] Downloading...')
-    with open(lfn, 'wb') as lf:
-        s.settimeout(5)
-        try:
-            data = s.recv(4096)
-            while True:
-                lf.write(data)
-                data = s.recv(4096)
-        except socket.timeout: pass
-        s.settimeout(None)
+    # El encabezado indica el tamaño exacto del archivo y la compresión
+    op, codec, size = recvHeader(s)
+    if verbose and codec:
+        print(f'[+] Compression: {codec}.')
+    with open(lfn, 'ab' if resume else 'wb') as lf:
+        # The SHA-256 is computed while the data is written
+        writer = DigestWriter(lf) if verify else lf
+        if codec: recvCompressed(s, writer, size, codec)
+        else: recvToFile(s, writer, size)
 
     # Confirmation (5)
+    if verify and recvExact(s, DIGEST_SIZE) != writer.digest.digest():
+        s.send(STATUS_BAD_REQUEST)
+        print(f'[x] Error: Downloaded {lfn}, but its SHA-256 does not match the file on server.')
+        return
     s.send(b'100')
-    print(f'[*] Downloaded: {lfn}')
+    print(f"[*] Downloaded: {lfn}{' (SHA-256 verified)' if verify else ''}")
 
 # Remove file on server
 def delete(s,file,verbose=False):
-    # Requests delete
-    s.send(b'dl')
-
     rfn = file
+
+    # Requests delete of filename (1)
+    sendHeader(s, 'dl', rfn)
     if verbose:
         print(f'[+] Requested: Delete file {rfn}.')
         print('[+] Trying access to file...')
 
-    # Sends requested filename (1)
-    s.send(rfn.encode('utf-8', 'replace'))
-
     # Reply (2)
-    exists = s.recv(1).decode('utf-8', 'replace')
+    exists = s.recv(1)
+    if busy(exists): return
+    exists = exists.decode('utf-8', 'replace')
     if exists == 'n':
         print(f'[-] Cannot find {rfn} on server.')
         return
@@ -254,29 +519,485 @@ def delete(s,file,verbose=False):
         print("[-] Error: Couldn't remove file from server. Server reported error.")
 
 # List files stored in server
-def listf(s,verbose=False):
-    # Requests list
-    s.send(b'ls')
+# Only files starting with prefix are listed. With limit, the server sends at most
+# limit files after cursor, and the cursor for the next page
+def listf(s, prefix='', cursor='', limit=0, metadata=False, verbose=False):
+    # Requests list (1)
+    request = packListRequest(cursor, limit, metadata)
+    sendHeader(s, 'ls', prefix, len(request))
+    s.sendall(request)
     if verbose:
         print('[+] Checking for files in server...')
 
-    # Receiving file list (1)
-    s.settimeout(3)
-    buffer = b''
-    try:
-        while True:
-            buffer += s.recv(4096)
-    except socket.timeout: pass
-    s.settimeout(None)
+    # Reply (2)
+    if busy(s.recv(1)): return
+
+    # Receiving file list (3)
+    op, nextCursor, length = recvHeader(s)
+    files = unpackList(recvExact(s, length), metadata)
 
-    # Confirmation (2)
+    # Confirmation (4)
     s.send(b'100')
 
-    files = buffer.decode('utf-8', 'replace')
-    if files == '': print('[+] Server is empty. No files found.')
+    if not files:
+        if prefix or cursor: print('[+] No files found.')
+        else: print('[+] Server is empty. No files found.')
     else:
         print('[+] File list received:')
-        print(files)
+        for name, size, mtime in files:
+            if metadata: print(f'{size:>14}  {datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}  {name}')
+            else: print(name)
+    if nextCursor:
+        print(f'[+] More files available, continue with --cursor "{nextCursor}"')
+
+# Upload file to server, sending first only its SHA-256. If the server already has the
+# content, the file is published without sending it; otherwise send(conn) uploads it
+# over a new connection
+def dedupUpload(s, file, send, verbose=False, name=None):
+    lfn = file
+    if not isfile(lfn):
+        print(f'[x] Error: Cannot find {lfn}.')
+        return
+    rfn = name or lfn
+
+    digest = fileDigest(lfn)
+    peer = s.getpeername()
+    conn, flags = s, 0
+    while True:
+        # Request with the SHA-256 (1)
+        with conn:
+            sendHeader(conn, 'hv', rfn, HAVE_REQUEST.size)
+            conn.sendall(HAVE_REQUEST.pack(digest, flags))
+            if verbose:
+                print(f'[+] Requested: Upload of content {digest.hex()} as {rfn}.')
+            # Reply (2)
+            reply = conn.recv(3)
+        if busy(reply): return
+
+        if reply == STATUS_OK:
+            print('[+] Server already had the content, file saved without sending data.')
+            return
+        if reply != STATUS_EXISTS or flags:
+            break
+
+        print(f'[-] File "{rfn}" already exists in server.')
+        while True:
+            replace = input('Replace? (y/n) > ')
+            if replace == 'y' or replace == 'n': break
+            print('(Expected "y" for replace, or "n" for cancel. Try again.)')
+        if replace == 'n':
+            print('[-] Upload Aborted')
+            return
+        conn, flags = connect(peer), HAVE_REPLACE
+
+    # The server doesn't have the content (3)
+    if verbose:
+        print('[+] Content not found on server, uploading it.')
+    with connect(peer) as conn:
+        send(conn)
+
+# Parallel transfers
+# The file is split into streams byte ranges, transferred at once over one connection
+# each (the first one uses the already connected socket s).
+
+# Splits size bytes into at most n ranges (offset, length)
+def splitRanges(size, n):
+    step = max(-(-size // n), 1)
+    return [(offset, min(step, size - offset)) for offset in range(0, size, step)] or [(0, 0)]
+
+# Runs transfer(conn, offset, length) for every range in its own thread and
+# connection. Returns the result (or the exception) of each range
+def runParallel(s, ranges, transfer):
+    results = [None] * len(ranges)
+    peer = s.getpeername()
+    def run(i, offset, length):
+        try:
+            conn = s if i == 0 else connect(peer)
+            with conn:
+                results[i] = transfer(conn, offset, length)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=run, args=(i, offset, length)) for i, (offset, length) in enumerate(ranges)]
+    for t in threads: t.start()
+    for t in threads: t.join()
+    return results
+
+# Upload file to server in parallel parts. The server assembles the parts and checks
+# them against the SHA-256 of the local file
+def parallelUpload(s, file, streams, verbose=False, name=None):
+    lfn = file
+    if not isfile(lfn):
+        print(f'[x] Error: Cannot find {lfn}.')
+        return
+    rfn = name or lfn
+    size = getsize(lfn)
+    ranges = splitRanges(size, streams)
+    peer = s.getpeername()
+
+    # Creating the upload (1)
+    with connect(peer) as conn:
+        conn.sendall(packHeader('pu', rfn, 0) + PART_REQUEST.pack(0, 0, size))
+        reply = conn.recv(3)
+        if busy(reply): return
+        if reply != STATUS_OK:
+            print(f"[-] Couldn't start the upload. Server reported error ({reply.decode('utf-8', 'replace')}).")
+            return
+        upload, = PART_UPLOAD.unpack(recvExact(conn, PART_UPLOAD.size))
+
+    # Sending parts (2)
+    def sendPart(conn, offset, length):
+        conn.sendall(packHeader('pu', rfn, length) + PART_REQUEST.pack(upload, offset, size))
+        with open(lfn, 'rb') as lf:
+            sendFile(conn, lf, length, offset)
+        return conn.recv(3)
+
+    print(f'[+] Uploading in {len(ranges)} streams...')
+    results = runParallel(s, ranges, sendPart)
+    failed = [r for r in results if r != STATUS_OK]
+    if failed:
+        if any(r == BUSY for r in failed): print('[-] Server busy, retry later.')
+        else: print(f"[-] Couldn't upload {len(failed)} of {len(ranges)} parts: {failed[0]}")
+        return
+    if verbose:
+        print('[+] All parts sent. Requesting assembly...')
+
+    # Assembly (3)
+    digest = fileDigest(lfn)
+    with connect(peer) as conn:
+        conn.sendall(packHeader('pc', rfn, size) + PART_ASSEMBLE.pack(upload, digest))
+        reply = conn.recv(3)
+    if busy(reply): return
+    if reply == STATUS_OK:
+        print('[+] File saved successfully on server.')
+    else:
+        print(f"[-] Couldn't save file on server. Server reported error ({reply.decode('utf-8', 'replace')}).")
+
+# Size, modification time and SHA-256 of a file on server, or None if it doesn't exist
+def remoteChecksum(s, rfn):
+    sendHeader(s, 'ck', rfn)
+    reply = s.recv(1)
+    if busy(reply): return None
+    if reply != b'y':
+        print(f'[-] Cannot find {rfn} on server.')
+        return None
+    return CHECKSUM_REPLY.unpack(recvExact(s, CHECKSUM_REPLY.size))
+
+# Show the SHA-256 of a file on server, and compare it with the local file (if any)
+def checksum(s, file, verbose=False, name=None):
+    rfn = file
+    lfn = name or rfn
+    if verbose:
+        print(f'[+] Requested: Checksum of file {rfn}.')
+
+    result = remoteChecksum(s, rfn)
+    if result is None: return
+    size, mtime, digest = result
+    print(f'{digest.hex()}  {size:>14}  {datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}  {rfn}')
+    if isfile(lfn):
+        if fileDigest(lfn) == digest: print(f'[+] Local file {lfn} matches the file on server.')
+        else: print(f'[-] Local file {lfn} differs from the file on server.')
+
+# Download file from server in parallel ranges, written in place with os.pwrite, and
+# verified against the SHA-256 of the file on server
+def parallelDownload(s, file, streams, verbose=False, name=None):
+    rfn = file
+    lfn = name or rfn
+
+    # File size and SHA-256 (1)
+    result = remoteChecksum(s, rfn)
+    if result is None: return
+    size, mtime, digest = result
+    if isfile(lfn):
+        print(f'[-] File {lfn} already exists locally.')
+        while True:
+            replace = input('Replace? (y/n) > ')
+            if replace == 'y' or replace == 'n': break
+            print('(Expected "y" for replace, or "n" for cancel. Try again.)')
+        if replace == 'n':
+            print('[-] Download Aborted')
+            return
+
+    # Receiving ranges (2)
+    def recvRange(conn, offset, length):
+        sendHeader(conn, 'dw', rfn, RANGE_REQUEST.size)
+        conn.sendall(packRange(offset, length))
+        reply = conn.recv(1)
+        if reply != b'y': return reply
+        conn.send(b'y')
+        op, name, received = recvHeader(conn)
+        recvToOffset(conn, fd, offset, received)
+        conn.send(b'100')
+        return received
+
+    ranges = splitRanges(size, streams)
+    print(f'[+] Downloading in {len(ranges)} streams...')
+    peer = s.getpeername()
+    with open(lfn, 'wb') as lf:
+        lf.truncate(size)
+        fd = lf.fileno()
+        # El socket s ya se utilizó para conocer el tamaño
+        results = runParallel(connect(peer), ranges, recvRange)
+
+    # Verification (3)
+    if results != [length for offset, length in ranges]:
+        failed = [r for r, (offset, length) in zip(results, ranges) if r != length]
+        if any(r == BUSY for r in failed): print('[-] Server busy, retry later.')
+        else: print(f"[-] Couldn't download {len(failed)} of {len(ranges)} ranges: {failed[0]}")
+        return
+    if fileDigest(lfn) != digest:
+        print(f'[x] Error: Downloaded {lfn}, but its SHA-256 does not match the file on server (changed during download?).')
+        return
+    print(f'[*] Downloaded: {lfn} (SHA-256 verified)')
+
+# Session
+# Runs many operations over one connection. Requests are sent without waiting for
+# the replies of the previous ones (pipelining); a second thread receives the tagged
+# replies, in the same order, and completes each operation.
+class Session:
+    def __init__(self, s, verbose=False):
+        self.s = s
+        self.verbose = verbose
+        self.tag = 0 # Last request tag
+        self.pending = {} # tag -> (op, name, local filename, metadata)
+        self.pendingLock = threading.Lock() # Lock for pending
+        self.failed = 0 # Requests that didn't succeed
+
+    # Requests the session. Returns False if the server can't start it
+    def start(self):
+        sendHeader(self.s, 'ss')
+        reply = self.s.recv(1)
+        if busy(reply): return False
+        if reply == UNSUPPORTED:
+            print('[-] Error: Server does not support sessions.')
+            return False
+
+        self.receiver = threading.Thread(target=self.receive)
+        self.receiver.start()
+        return True
+
+    # Registers and sends a request, followed by data (if any). Returns its tag
+    def request(self, op, name='', length=0, flags=0, data=b'', local=None, metadata=False):
+        with self.pendingLock:
+            self.tag += 1
+            tag = self.tag
+            self.pending[tag] = (op, name, local, metadata)
+        self.s.sendall(packSessionRequest(tag, op, name, length, flags) + data)
+        return tag
+
+    def upload(self, lfn, rfn, replace=False):
+        size = getsize(lfn)
+        with open(lfn, 'rb') as lf:
+            self.request('up', rfn, size, SESSION_REPLACE if replace else 0, local=lfn)
+            sendFile(self.s, lf, size)
+
+    def download(self, rfn, lfn):
+        self.request('dw', rfn, local=lfn)
+
+    def delete(self, rfn):
+        self.request('dl', rfn)
+
+    def checksum(self, rfn):
+        self.request('ck', rfn)
+
+    def listf(self, prefix='', cursor='', limit=0, metadata=False):
+        data = packListRequest(cursor, limit, metadata)
+        self.request('ls', prefix, len(data), data=data, metadata=metadata)
+
+    # Ends the session and waits for the remaining replies
+    def close(self):
+        try:
+            self.s.sendall(packSessionRequest(0, 'qt'))
+        except OSError:
+            pass # El servidor ya cerró la sesión
+        self.receiver.join()
+        with self.pendingLock:
+            for tag, (op, name, local, metadata) in self.pending.items():
+                print(f'[-] #{tag} {op} {name}: no reply, connection lost.')
+            self.failed += len(self.pending)
+
+    # Receives replies until the server ends the session
+    def receive(self):
+        while True:
+            try:
+                tag, op, status, length = recvSessionResponse(self.s)
+            except (ConnectionError, OSError):
+                return
+            with self.pendingLock:
+                op, name, local, metadata = self.pending.pop(tag)
+
+            if status != STATUS_OK:
+                self.failed += 1
+                print(f'[-] #{tag} {op} {name}: {SESSION_ERRORS.get(status, status.decode())}')
+            elif op == 'dw':
+                with open(local, 'wb') as lf:
+                    recvToFile(self.s, lf, length)
+                print(f'[*] #{tag} Downloaded: {local}')
+            elif op == 'ls':
+                cursor, files = unpackSessionList(recvExact(self.s, length), metadata)
+                print(f'[+] #{tag} File list received ({len(files)} files):')
+                for fname, size, mtime in files:
+                    if metadata: print(f'{size:>14}  {datetime.fromtimestamp(mtime):%Y-%m-%d %H:%M:%S}  {fname}')
+                    else: print(fname)
+                if cursor:
+                    print(f'[+] More files available, continue with cursor "{cursor}"')
+            elif op == 'up':
+                print(f'[+] #{tag} Uploaded: {local} as {name}')
+            elif op == 'dl':
+                print(f'[+] #{tag} Removed: {name}')
+            elif op == 'ck':
+                size, mtime, digest = CHECKSUM_REPLY.unpack(recvExact(self.s, length))
+                print(f'[+] #{tag} {digest.hex()}  {size}  {name}')
+
+# Descriptions of the session statuses
+SESSION_ERRORS = {
+    b'400': 'Bad request.',
+    b'404': 'Cannot find file on server.',
+    b'409': 'File already exists in server (use -y to replace).',
+    b'503': 'Server busy, retry later.',
+}
+
+# Runs a batch file over one session. One operation per line:
+#   up LOCAL [REMOTE]
+#   dw REMOTE [LOCAL]
+#   dl REMOTE
+#   ck REMOTE
+#   ls [PREFIX [CURSOR [LIMIT]]]
+# Empty lines and lines starting with # are ignored.
+def batch(s, file, replace=False, metadata=False, verbose=False):
+    session = Session(s, verbose)
+    if not session.start(): return
+
+    lines = sys.stdin if file == '-' else open(file)
+    try:
+        for number, line in enumerate(lines, 1):
+            args = line.split()
+            if not args or args[0].startswith('#'): continue
+            op, args = args[0], args[1:]
+            if op == 'up' and 1 <= len(args) <= 2:
+                lfn = args[0]
+                if not isfile(lfn):
+                    print(f'[x] Error: Cannot find {lfn}.')
+                    continue
+                session.upload(lfn, args[-1], replace)
+            elif op == 'dw' and 1 <= len(args) <= 2:
+                lfn = args[-1]
+                if isfile(lfn) and not replace:
+                    print(f'[-] File {lfn} already exists locally (use -y to replace).')
+                    continue
+                session.download(args[0], lfn)
+            elif op == 'dl' and len(args) == 1:
+                session.delete(args[0])
+            elif op == 'ck' and len(args) == 1:
+                session.checksum(args[0])
+            elif op == 'ls' and len(args) <= 3:
+                prefix = args[0] if args and args[0] != '""' else ''
+                cursor = args[1] if len(args) > 1 else ''
+                limit = int(args[2]) if len(args) > 2 else 0
+                session.listf(prefix, cursor, limit, metadata)
+            else:
+                print(f'[x] Error: Line {number}: cannot understand "{line.strip()}".')
+    except ConnectionError:
+        print('[-] Error: Connection with server lost (session timed out?).')
+    finally:
+        if lines is not sys.stdin: lines.close()
+        session.close()
+
+    if verbose:
+        print(f'[+] Session ended, {session.tag} requests, {session.failed} failed.')
+
+# Files of a bundle upload: the given files, and the regular files directly inside the
+# given directories (sorted), with their base names as names on server
+def bundleFiles(paths):
+    files = []
+    for path in paths:
+        if os.path.isdir(path):
+            with os.scandir(path) as entries:
+                files += sorted((e.name, e.path) for e in entries if e.is_file())
+        elif isfile(path):
+            files.append((os.path.basename(path), path))
+        else:
+            print(f'[x] Error: Cannot find {path}.')
+    return files
+
+# Uploads many files in one request (bundle). The files are streamed one after
+# another, each with a small header; the server replies with the status of each file
+# at the end
+def bundleUpload(s, paths, replace=False, verbose=False):
+    files = bundleFiles(paths)
+    if not files: return
+
+    # Request (1)
+    request = BUNDLE_REQUEST.pack(BUNDLE_REPLACE if replace else 0)
+    sendHeader(s, 'bu', '', len(request))
+    s.sendall(request)
+
+    # Reply (2)
+    reply = s.recv(1)
+    if busy(reply): return
+    if reply == UNSUPPORTED:
+        print('[-] Error: Server does not support bundles.')
+        return
+
+    # Files (3)
+    if verbose:
+        print(f'[+] Uploading {len(files)} files...')
+    def entries():
+        for name, path in files:
+            with open(path, 'rb') as lf:
+                yield name, lf, lf.seek(0, os.SEEK_END)
+    sendBundle(s, entries())
+
+    # Status of each file (4)
+    op, _, count = recvHeader(s)
+    statuses = recvExact(s, 3 * count)
+    failed = 0
+    for i, (name, path) in enumerate(files[:count]):
+        status = statuses[3 * i:3 * i + 3]
+        if status != STATUS_OK:
+            failed += 1
+            print(f'[-] {name}: {SESSION_ERRORS.get(status, status.decode())}')
+        elif verbose:
+            print(f'[+] Uploaded: {path} as {name}')
+    print(f'[+] Bundle uploaded, {count - failed} of {len(files)} files saved on server.')
+
+# Downloads in one request (bundle) the files whose names start with prefix and match
+# pattern (glob, "" for all). Files that exist locally are kept, unless replace
+def bundleDownload(s, pattern, prefix='', replace=False, verbose=False):
+    # Request (1)
+    request = pattern.encode('utf-8')
+    sendHeader(s, 'bd', prefix, len(request))
+    s.sendall(request)
+
+    # Reply (2)
+    reply = s.recv(1)
+    if busy(reply): return
+    if reply == UNSUPPORTED:
+        print('[-] Error: Server does not support bundles.')
+        return
+
+    # Files (3)
+    received = skipped = 0
+    for status, name, size, source in recvBundle(s):
+        # Base name only: a name with directories never leaves the current directory
+        lfn = os.path.basename(name)
+        if status != STATUS_OK:
+            print(f'[-] {name}: {SESSION_ERRORS.get(status, status.decode())}')
+        elif not lfn or (isfile(lfn) and not replace):
+            discard(source, size)
+            skipped += 1
+            print(f'[-] File {name} already exists locally (use -y to replace).')
+        else:
+            with open(lfn, 'wb') as lf:
+                recvToFile(source, lf, size)
+            received += 1
+            if verbose:
+                print(f'[*] Downloaded: {lfn}')
+
+    # Confirmation (4)
+    s.send(b'100')
+    if received or skipped: print(f'[+] Bundle downloaded, {received} files received.')
+    else: print('[+] No files found.')
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -0,0 +1,76 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import sys
+from os.path import dirname, abspath
+
+# Los módulos del servidor están en la raíz del repositorio (python -m pytest -q)
+sys.path.insert(0, dirname(dirname(abspath(__file__))))
+
+import time
+import socket
+import asyncio
+import threading
+import pytest
+from MainServer import MainServer
+from AsyncMainServer import AsyncMainServer
+
+TIMEOUT = 5 # Segundos
+
+# Puerto libre para un servidor de prueba
+def freePort():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+# Espera a que el servidor acepte conexiones
+def waitListening(port):
+    deadline = time.monotonic() + TIMEOUT
+    while True:
+        try:
+            socket.create_connection(('127.0.0.1', port), TIMEOUT).close()
+            return
+        except ConnectionRefusedError:
+            assert time.monotonic() < deadline, 'server did not start'
+            time.sleep(0.01)
+
+# Inicia servidores de prueba en un hilo, con ./recv dentro de un directorio temporal:
+# serve(engine='threads', **kwargs) regresa el servidor (MainServer o AsyncMainServer)
+# escuchando en 127.0.0.1, server.PORT. Se detienen al terminar la prueba
+@pytest.fixture
+def serve(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    servers = []
+    def start(engine='threads', **kwargs):
+        kwargs.setdefault('workers', 4)
+        Server = AsyncMainServer if engine == 'asyncio' else MainServer
+        server = Server('127.0.0.1', freePort(), **kwargs)
+        def run():
+            # El ciclo de eventos de AsyncMainServer se usa en este hilo
+            if engine == 'asyncio': asyncio.set_event_loop(server.loop)
+            server.start()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        servers.append((server, thread))
+        waitListening(server.PORT)
+        return server
+    yield start
+    for server, thread in servers:
+        if isinstance(server, AsyncMainServer):
+            server.loop.call_soon_threadsafe(server.stopEvent.set)
+        else:
+            # shutdown despierta al hilo que espera en accept
+            server.s.shutdown(socket.SHUT_RDWR)
+            server.s.close()
+        thread.join(TIMEOUT)
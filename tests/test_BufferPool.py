@@ -0,0 +1,46 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+from BufferPool import BufferPool, MIN_BUFFER_SIZE
+
+def test_buffer_size_follows_the_transfer():
+    pool = BufferPool(256 << 10)
+    assert pool.sizeFor(0) == pool.sizeFor(1) == MIN_BUFFER_SIZE
+    assert pool.sizeFor(MIN_BUFFER_SIZE + 1) == 2 * MIN_BUFFER_SIZE
+    assert pool.sizeFor(100 << 10) == 128 << 10
+    assert pool.sizeFor(10 << 20) == pool.sizeFor() == 256 << 10
+    # Con un máximo menor que MIN_BUFFER_SIZE, todos los buffers son del máximo
+    assert BufferPool(4096).sizeFor(10) == 4096
+
+def test_buffers_are_reused_by_size():
+    pool = BufferPool(256 << 10, keep=2)
+    with pool.borrow(100) as small, pool.borrow(1 << 20) as large:
+        assert (len(small), len(large)) == (MIN_BUFFER_SIZE, 256 << 10)
+    with pool.borrow(200) as small:
+        assert len(small) == MIN_BUFFER_SIZE
+    assert pool.stats() == {'size': 256 << 10, 'free': 2, 'allocated': 2, 'reused': 1}
+    # Un tamaño sin buffers libres crea uno nuevo; al regresar, solo se conservan keep
+    with pool.borrow(50 << 10):
+        pass
+    assert pool.stats()['allocated'] == 3 and pool.stats()['free'] == 2
+
+def test_configure_drops_buffers_of_other_sizes():
+    pool = BufferPool(256 << 10)
+    with pool.borrow() as buffer:
+        pool.configure(64 << 10)
+    assert pool.stats()['free'] == 0
+    with pool.borrow() as buffer:
+        assert len(buffer) == 64 << 10
+    assert pool.stats() == {'size': 64 << 10, 'free': 1, 'allocated': 2, 'reused': 0}
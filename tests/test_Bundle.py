@@ -0,0 +1,119 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import os
+import socket
+import ResourceFile
+from StagedFile import StagedFile
+from MainServer import MAX_NAME_LENGTH
+from Protocol import STATUS_OK, STATUS_BAD_REQUEST, STATUS_EXISTS, UNSUPPORTED, BUNDLE_REQUEST, BUNDLE_REPLACE, BUNDLE_FILE, BUNDLE_ENTRY
+from Protocol import packHeader, recvHeader, recvExact
+from FTPClient import FTPClient
+
+def client(server):
+    return FTPClient('127.0.0.1', server.PORT, 5)
+
+# Sube un paquete con los nombres (bytes) y datos indicados tal como se dan, sin
+# pasar por FTPClient. Regresa los status de los archivos
+def rawBundle(server, files, replace=True):
+    with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+        request = BUNDLE_REQUEST.pack(BUNDLE_REPLACE if replace else 0)
+        s.sendall(packHeader('bu', '', len(request)) + request)
+        assert s.recv(1) == b'y'
+        s.sendall(b''.join(BUNDLE_FILE.pack(len(name), len(data)) + name + data for name, data in files) + BUNDLE_FILE.pack(0, 0))
+        op, _, count = recvHeader(s)
+        statuses = recvExact(s, 3 * count)
+    return [statuses[i:i + 3] for i in range(0, len(statuses), 3)]
+
+# Descarga un paquete leyendo su formato directamente. Regresa las entradas
+# (status, name, data) y el número de archivos del BUNDLE_ENTRY final
+def rawDownload(server, pattern=b'', prefix=''):
+    entries = []
+    with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+        s.sendall(packHeader('bd', prefix, len(pattern)) + pattern)
+        assert s.recv(1) == b'y'
+        while True:
+            status, namelen, size = BUNDLE_ENTRY.unpack(recvExact(s, BUNDLE_ENTRY.size))
+            if not namelen: break
+            entries.append((status, recvExact(s, namelen).decode(), recvExact(s, size)))
+        s.sendall(STATUS_OK)
+    return entries, size
+
+def test_upload_and_download_round_trip(serve):
+    server = serve()
+    # Archivos pequeños (varios en un mismo envío), uno vacío y uno más grande que el
+    # buffer de transferencia
+    files = {f'f{i:03}.txt': os.urandom(i * 37) for i in range(50)}
+    files['big.bin'] = os.urandom(3 << 20)
+    result = client(server).uploadBundle(files.items())
+    assert result == [(name, STATUS_OK) for name in files]
+    entries, count = rawDownload(server)
+    assert count == len(files)
+    assert [(status, name) for status, name, _ in entries] == [(STATUS_OK, name) for name in sorted(files)]
+    assert {name: data for _, name, data in entries} == files
+
+def test_existing_files_are_kept_without_replace(serve):
+    server = serve()
+    client(server).upload('a.txt', b'old')
+    assert rawBundle(server, [(b'a.txt', b'new'), (b'b.txt', b'b')], replace=False) == [STATUS_EXISTS, STATUS_OK]
+    # La entrada rechazada no desalinea a la siguiente
+    assert client(server).downloadBundle() == {'a.txt': b'old', 'b.txt': b'b'}
+    assert rawBundle(server, [(b'a.txt', b'new')]) == [STATUS_OK]
+    assert client(server).download('a.txt') == b'new'
+
+def test_download_selects_by_prefix_and_pattern(serve):
+    server = serve()
+    names = ['a1.txt', 'a2.bin', 'a3.txt', 'b1.txt', 'ba.txt']
+    client(server).uploadBundle((name, name.encode()) for name in names)
+    downloads = client(server)
+    assert sorted(downloads.downloadBundle('*.txt')) == ['a1.txt', 'a3.txt', 'b1.txt', 'ba.txt']
+    assert sorted(downloads.downloadBundle(prefix='a')) == ['a1.txt', 'a2.bin', 'a3.txt']
+    assert sorted(downloads.downloadBundle('*1*', 'b')) == ['b1.txt']
+    assert downloads.downloadBundle('*.zip') == {}
+    assert rawDownload(server, b'', 'z') == ([], 0)
+
+def test_bundles_are_unsupported_by_the_asyncio_engine(serve):
+    server = serve('asyncio')
+    for op in ('bu', 'bd'):
+        with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+            s.sendall(packHeader(op))
+            assert s.recv(1) == UNSUPPORTED
+
+def test_invalid_names_are_rejected_and_skipped(serve):
+    server = serve()
+    # Un nombre de MAX_NAME_LENGTH bytes (UTF-8) es válido
+    longest = 'ñ' * (MAX_NAME_LENGTH // 2)
+    files = [(b'a.txt', b'a'), (b'../x', b'x' * 10), (b'b\xff.txt', b'yy'), (b'n' * (MAX_NAME_LENGTH + 1), b'z'),
+             (b'.', b''), (b'c\0', b'c'), (longest.encode(), b'long')]
+    assert rawBundle(server, files) == [STATUS_OK] + [STATUS_BAD_REQUEST] * 5 + [STATUS_OK]
+    assert sorted(os.listdir('recv')) == sorted(['a.txt', longest])
+    assert client(server).download(longest) == b'long'
+
+# StagedFile de prueba: no se puede escribir full.bin (disco lleno)
+class FullDisk(StagedFile):
+    def write(self, data):
+        if self.filename.endswith('full.bin'): raise OSError(28, 'No space left on device')
+        super().write(data)
+
+def test_disk_error_fails_only_that_file(serve, monkeypatch):
+    server = serve()
+    monkeypatch.setattr(ResourceFile, 'StagedFile', FullDisk)
+    big = os.urandom(1 << 20)
+    files = [('a.bin', b'a' * 100), ('full.bin', big), ('b.bin', big), ('full.bin', b'small'), ('c.bin', b'c')]
+    assert client(server).uploadBundle(files) == [
+        ('a.bin', STATUS_OK), ('full.bin', STATUS_BAD_REQUEST), ('b.bin', STATUS_OK),
+        ('full.bin', STATUS_BAD_REQUEST), ('c.bin', STATUS_OK)]
+    assert client(server).downloadBundle() == {'a.bin': b'a' * 100, 'b.bin': big, 'c.bin': b'c'}
+    assert not [n for n in os.listdir('recv') if n.startswith('.')]
@@ -0,0 +1,111 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import hashlib
+import pytest
+from ChecksumIndex import ChecksumIndex, CHECKSUM_SUFFIX, compactChecksums
+
+@pytest.fixture
+def root(tmp_path):
+    root = tmp_path / 'recv'
+    root.mkdir()
+    return str(root)
+
+def write(root, name, data):
+    path = os.path.join(root, name)
+    with open(path, 'wb') as f: f.write(data)
+    return path, os.stat(path)
+
+def test_entries_persist_in_the_journal(root):
+    index = ChecksumIndex(root)
+    path, st = write(root, 'a.bin', b'a' * 100)
+    digest = hashlib.sha256(b'a' * 100).digest()
+    index.put('a.bin', st, digest)
+    index.put('ñ.bin', write(root, 'ñ.bin', b'n')[1], hashlib.sha256(b'n').digest())
+    index.close()
+
+    reopened = ChecksumIndex(root)
+    assert reopened.get('a.bin', st) == digest
+    assert reopened.checksum('a.bin', path) == (st, digest)
+    assert reopened.stats() == {'entries': 2, 'hits': 1, 'computed': 0}
+    reopened.close()
+
+def test_changed_or_removed_files_are_not_answered(root):
+    index = ChecksumIndex(root)
+    path, st = write(root, 'a.bin', b'old')
+    index.put('a.bin', st, hashlib.sha256(b'old').digest())
+    # Otra versión del archivo (otro inodo): el SHA-256 se vuelve a calcular
+    os.remove(path)
+    path, new = write(root, 'a.bin', b'new!')
+    assert index.get('a.bin', new) is None
+    assert index.checksum('a.bin', path) == (new, hashlib.sha256(b'new!').digest())
+    assert index.stats()['computed'] == 1
+
+    index.remove('a.bin')
+    assert index.get('a.bin', new) is None
+    assert index.checksum('missing.bin', os.path.join(root, 'missing.bin')) is None
+    index.close()
+    reopened = ChecksumIndex(root)
+    assert reopened.stats()['entries'] == 0
+    reopened.close()
+
+def test_refresh_reads_entries_of_other_processes(root):
+    first, second = ChecksumIndex(root), ChecksumIndex(root)
+    path, st = write(root, 'a.bin', b'shared')
+    digest = hashlib.sha256(b'shared').digest()
+    first.put('a.bin', st, digest)
+    # El segundo índice no la tiene en memoria, pero la lee del journal antes de
+    # calcularla
+    assert second.get('a.bin', st) is None
+    assert second.checksum('a.bin', path) == (st, digest)
+    assert second.stats()['computed'] == 0
+    first.close()
+    second.close()
+
+def test_compaction_keeps_only_live_entries(root):
+    index = ChecksumIndex(root)
+    _, st = write(root, 'a.bin', b'a')
+    _, other = write(root, 'b.bin', b'b')
+    for i in range(10):
+        index.put('a.bin', st, hashlib.sha256(b'%d' % i).digest())
+    index.put('b.bin', other, bytes(32))
+    index.remove('b.bin')
+    index.close()
+
+    journal = root + CHECKSUM_SUFFIX
+    before = os.path.getsize(journal)
+    removed = compactChecksums(root)
+    assert removed > 0 and os.path.getsize(journal) == before - removed
+    reopened = ChecksumIndex(root)
+    assert reopened.get('a.bin', st) == hashlib.sha256(b'9').digest()
+    assert reopened.stats()['entries'] == 1
+    reopened.close()
+    # Sin entradas reemplazadas no se reescribe
+    assert compactChecksums(root) == 0
+
+def test_compaction_drops_a_torn_last_entry(root):
+    index = ChecksumIndex(root)
+    _, st = write(root, 'a.bin', b'a')
+    index.put('a.bin', st, bytes(32))
+    index.close()
+    journal = root + CHECKSUM_SUFFIX
+    size = os.path.getsize(journal)
+    # Una entrada incompleta (caída del sistema durante la escritura)
+    with open(journal, 'ab') as f: f.write(b'\x00\x05partial')
+    assert compactChecksums(root) == len(b'\x00\x05partial')
+    assert os.path.getsize(journal) == size
+    reopened = ChecksumIndex(root)
+    assert reopened.get('a.bin', st) == bytes(32)
+    reopened.close()
@@ -0,0 +1,106 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import io
+import os
+import zlib
+import random
+import socket
+import pytest
+from Compression import COMPRESS_BLOCK, available, compressedFrames, recvCompressed
+from Protocol import COMPRESSED_CHUNK, STATUS_OK, STATUS_BAD_REQUEST
+from Protocol import packHeader, packUploadOptions, packRange, recvHeader, recvExact
+
+# Conexión de prueba que entrega los bytes de data
+class Stream:
+    def __init__(self, data):
+        self.data = io.BytesIO(data)
+
+    def recv_into(self, view):
+        return self.data.readinto(view)
+
+def frames(data, codec):
+    return b''.join(compressedFrames(io.BytesIO(data), len(data), 0, codec))
+
+@pytest.mark.parametrize('codec', available())
+def test_round_trip(codec):
+    data = random.Random(1).randbytes(COMPRESS_BLOCK) + bytes(3 * COMPRESS_BLOCK + 5)
+    f = io.BytesIO()
+    recvCompressed(Stream(frames(data, codec)), f, len(data), codec)
+    assert f.getvalue() == data
+
+@pytest.mark.parametrize('codec', available())
+def test_longer_stream_is_rejected_without_writing_past_length(codec):
+    # Datos muy comprimibles: una trama pequeña produce mucho más que length
+    data = bytes(8 * COMPRESS_BLOCK)
+    f = io.BytesIO()
+    with pytest.raises(ValueError):
+        recvCompressed(Stream(frames(data, codec)), f, 1000, codec)
+    assert len(f.getvalue()) <= 1000
+
+def test_single_frame_larger_than_length():
+    # Toda la salida en una sola trama: zlib deja sin procesar el resto (unconsumed_tail)
+    compressed = zlib.compress(bytes(1 << 20))
+    stream = COMPRESSED_CHUNK.pack(len(compressed)) + compressed + COMPRESSED_CHUNK.pack(0)
+    for length in (0, 1, (1 << 20) - 1):
+        f = io.BytesIO()
+        with pytest.raises(ValueError):
+            recvCompressed(Stream(stream), f, length, 'zlib')
+        assert len(f.getvalue()) <= length
+
+def test_short_or_invalid_streams():
+    data = b'abc' * 1000
+    with pytest.raises(ValueError):
+        recvCompressed(Stream(frames(data, 'zlib')), io.BytesIO(), len(data) + 1, 'zlib')
+    with pytest.raises(ValueError):
+        recvCompressed(Stream(COMPRESSED_CHUNK.pack(4) + b'junk' + COMPRESSED_CHUNK.pack(0)), io.BytesIO(), 4, 'zlib')
+
+# Upload 'zu' de size bytes con la compresión que elija el servidor; stream genera las
+# tramas a partir de ella. Regresa la respuesta del servidor
+def compressedUpload(server, name, size, stream):
+    with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+        s.sendall(packHeader('zu', name, size) + packUploadOptions(available()))
+        assert recvExact(s, 1) == b'n'
+        codec = recvHeader(s)[1]
+        assert codec in available()
+        s.sendall(stream(codec))
+        return recvExact(s, 3)
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_server_round_trip(serve, engine):
+    server = serve(engine)
+    data = random.Random(2).randbytes(1000) * 300
+    assert compressedUpload(server, 'a.bin', len(data), lambda codec: frames(data, codec)) == STATUS_OK
+    with open('recv/a.bin', 'rb') as f: assert f.read() == data
+
+    for codec in available():
+        with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+            request = packRange(1000, 200000, [codec])
+            s.sendall(packHeader('dw', 'a.bin', len(request)) + request)
+            assert recvExact(s, 1) == b'y'
+            s.send(b'y')
+            op, chosen, size = recvHeader(s)
+            assert (chosen, size) == (codec, 200000)
+            f = io.BytesIO()
+            recvCompressed(s, f, size, codec)
+            s.send(STATUS_OK)
+        assert f.getvalue() == data[1000:201000]
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_server_rejects_a_longer_stream(serve, engine):
+    server = serve(engine)
+    # El flujo se descomprime en más bytes de los anunciados
+    assert compressedUpload(server, 'a.bin', 1000, lambda codec: frames(bytes(8 * COMPRESS_BLOCK), codec)) == STATUS_BAD_REQUEST
+    assert not os.path.exists('recv/a.bin')
@@ -0,0 +1,74 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import io
+import random
+import hashlib
+from Delta import MIN_BLOCK_SIZE, blockSize, signatures, signatureIndex, delta
+from Protocol import DELTA_COPY, DELTA_DATA
+
+# Instrucciones para construir new a partir de old (como el cliente), y el SHA-256 que
+# se calcula mientras se recorre new
+def encode(old, new, size=None):
+    size = size or blockSize(len(old))
+    index, tail = signatureIndex(signatures(io.BytesIO(old), size), size, len(old))
+    digest = hashlib.sha256()
+    return list(delta(io.BytesIO(new), size, index, tail, digest)), size, digest.digest()
+
+# Construye el archivo a partir de old y las instrucciones (como el servidor)
+def apply(old, instructions, size):
+    out = bytearray()
+    for kind, value in instructions:
+        if kind == DELTA_COPY: out += old[value * size:(value + 1) * size]
+        else: out += value
+    return bytes(out)
+
+def literalBytes(instructions):
+    return sum(len(value) for kind, value in instructions if kind == DELTA_DATA)
+
+def test_round_trip_with_edits():
+    rng = random.Random(1)
+    old = rng.randbytes(300000)
+    # Un byte cambiado, una inserción y un borrado
+    new = bytearray(old)
+    new[1000] ^= 0xff
+    new[150000:150000] = rng.randbytes(777)
+    del new[250000:251234]
+    new = bytes(new)
+    instructions, size, digest = encode(old, new)
+    assert apply(old, instructions, size) == new
+    assert digest == hashlib.sha256(new).digest()
+    # Solo se envían como datos los bloques que cambiaron
+    assert literalBytes(instructions) < 4 * size + 777
+
+def test_identical_file_is_only_copies():
+    old = random.Random(2).randbytes(5 * MIN_BLOCK_SIZE + 123)
+    instructions, size, _ = encode(old, old, MIN_BLOCK_SIZE)
+    assert all(kind == DELTA_COPY for kind, _ in instructions)
+    # El último bloque (más corto) también se reutiliza
+    assert [value for _, value in instructions] == list(range(6))
+    assert apply(old, instructions, size) == old
+
+def test_unrelated_and_empty_files():
+    rng = random.Random(3)
+    old, new = rng.randbytes(10000), rng.randbytes(9000)
+    for a, b in ((old, new), (b'', new), (old, b''), (b'', b'')):
+        instructions, size, digest = encode(a, b, MIN_BLOCK_SIZE)
+        assert apply(a, instructions, size) == b
+        assert digest == hashlib.sha256(b).digest()
+
+def test_block_size_bounds():
+    assert blockSize(0) == MIN_BLOCK_SIZE
+    assert blockSize(1 << 40) == 1 << 17
+    assert blockSize(1 << 30) % 1024 == 0
@@ -0,0 +1,88 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import pytest
+from FileCache import FileCache, openCached
+from FTPClient import FTPClient
+
+# Escribe el archivo, o lo reemplaza con un rename (como publish en otro proceso)
+def write(path, data, replace=False):
+    target = path + '.tmp' if replace else path
+    with open(target, 'wb') as f: f.write(data)
+    if replace: os.replace(target, path)
+
+def read(cache, path):
+    f, data = openCached(cache, path)
+    with f: return f.read(), data is not None
+
+def test_lru_eviction():
+    cache = FileCache(10, 4)
+    for name in 'abc': cache.put(name, name.encode() * 4)
+    # Solo caben dos archivos; 'a' es el menos reciente
+    assert cache.get('a') is None and cache.get('b') == b'bbbb'
+    cache.put('d', b'dddd')
+    assert cache.get('c') is None and cache.get('b') == b'bbbb'
+    # Los archivos mayores que maxFileSize no se guardan
+    cache.put('e', b'eeeee')
+    assert cache.get('e') is None
+    assert cache.stats() == {'entries': 2, 'bytes': 8, 'hits': 2, 'misses': 3, 'evictions': 2, 'invalidations': 0}
+    cache.invalidate('b')
+    assert cache.get('b') is None and cache.stats()['invalidations'] == 1
+    assert FileCache(0, 4).fits(1) is False
+
+def test_shared_cache_checks_the_identity(tmp_path):
+    path = str(tmp_path / 'a.txt')
+    write(path, b'first')
+    cache = FileCache(100, 100, shared=True)
+    assert read(cache, path) == (b'first', True)
+    assert read(cache, path) == (b'first', True)
+    assert cache.stats()['hits'] == 1
+
+    # Otro proceso reemplaza el archivo: la entrada anterior no se usa
+    write(path, b'second', replace=True)
+    assert read(cache, path) == (b'second', True)
+    assert cache.stats()['invalidations'] == 1
+    # Con otra identidad la entrada tampoco se usa
+    assert cache.get(path, None) is None
+
+def test_private_cache_is_invalidated_by_writes(tmp_path):
+    path = str(tmp_path / 'a.txt')
+    write(path, b'first')
+    cache = FileCache(100, 100)
+    read(cache, path)
+    write(path, b'second', replace=True)
+    # Sin shared, solo las escrituras del servidor (invalidate) cambian la entrada
+    assert read(cache, path) == (b'first', True)
+    cache.invalidate(path)
+    assert read(cache, path) == (b'second', True)
+    # Los archivos grandes se leen del disco
+    write(path, b'x' * 200)
+    cache.invalidate(path)
+    assert read(cache, path) == (b'x' * 200, False)
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_server_serves_new_versions(serve, engine):
+    server = serve(engine, cacheSize=1 << 20, cacheFileSize=64 << 10)
+    client = FTPClient('127.0.0.1', server.PORT, 5)
+    client.upload('a.txt', b'first')
+    assert client.download('a.txt') == b'first'
+    assert client.download('a.txt', offset=1, count=3) == b'irs'
+    assert server.cache.stats()['hits'] >= 1
+
+    client.upload('a.txt', b'second')
+    assert client.download('a.txt') == b'second'
+    client.delete('a.txt')
+    client.upload('a.txt', b'third')
+    assert client.download('a.txt') == b'third'
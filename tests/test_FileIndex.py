@@ -0,0 +1,64 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import pytest
+from FileIndex import FileIndex
+from Layout import makeLayout
+
+NAMES = ['a.txt', 'b1.bin', 'b2.bin', 'b3.bin', 'ba.txt', 'c.txt', 'ñ.txt']
+
+@pytest.fixture(params=['flat', 'sharded'])
+def index(request, tmp_path):
+    layout = makeLayout(request.param, str(tmp_path))
+    for name in NAMES:
+        with open(layout.path(name), 'wb') as f: f.write(name.encode())
+    # Temporales de uploads en curso, que no forman parte de la lista
+    for name in ('.b4.bin.partial', '.b5.bin.0000000000000001.multipart', '.x.txt.abc.part'):
+        with open(layout.path(name), 'wb') as f: f.write(b'x')
+    return FileIndex(layout)
+
+# Todas las páginas de limit nombres
+def pages(index, prefix='', limit=0):
+    result, cursor = [], ''
+    while True:
+        names, cursor = index.page(prefix, cursor, limit)
+        result.append(list(names))
+        if not cursor: return result
+
+def test_whole_list_is_sorted_without_temporaries(index):
+    assert index.page() == (tuple(NAMES), '')
+    assert index.stat('b1.bin')[0] == len('b1.bin')
+    assert index.stat('.b4.bin.partial') is None
+
+def test_pages_cover_the_list_once(index):
+    assert pages(index, limit=3) == [NAMES[0:3], NAMES[3:6], NAMES[6:]]
+    assert pages(index, limit=7) == [NAMES]
+    assert sum(pages(index, limit=1), []) == NAMES
+
+def test_prefix(index):
+    assert index.page('b')[0] == ('b1.bin', 'b2.bin', 'b3.bin', 'ba.txt')
+    assert pages(index, 'b', 2) == [['b1.bin', 'b2.bin'], ['b3.bin', 'ba.txt']]
+    assert index.page('b', 'b2.bin', 0)[0] == ('b3.bin', 'ba.txt')
+    assert index.page('z') == ((), '')
+    assert index.page('ñ')[0] == ('ñ.txt',)
+
+def test_page_follows_changes(index):
+    first, cursor = index.page('', '', 2)
+    assert first == ('a.txt', 'b1.bin')
+    # Los cambios posteriores al cursor aparecen en las páginas siguientes
+    index.add('b0.bin', 3, 0.0)
+    index.add('b15.bin', 3, 0.0)
+    index.remove('b2.bin')
+    assert index.page('', cursor, 2) == (('b15.bin', 'b3.bin'), 'b3.bin')
+    assert 'b0.bin' in index and 'b2.bin' not in index
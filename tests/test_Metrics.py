@@ -0,0 +1,108 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import time
+import urllib.request
+import urllib.error
+import pytest
+from Metrics import Metrics, Histogram, METRIC_BUCKETS, metrics
+from RWLock import LockStats
+from FileCache import FileCache
+from FTPClient import FTPClient, NotFound
+
+# Lo que render necesita del servidor
+class Server:
+    def __init__(self):
+        self.lockStats = LockStats()
+        self.cache = FileCache()
+
+# Muestras de las métricas: 'nombre{etiquetas}' -> valor
+def samples(text):
+    values = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            values[name] = float(value)
+    return values
+
+def test_histogram_buckets_are_upper_bounds():
+    histogram = Histogram()
+    for value in (0, METRIC_BUCKETS[0], METRIC_BUCKETS[0] * 1.5, 1000):
+        histogram.observe(value)
+    assert histogram.buckets[0] == 2 and histogram.buckets[1] == 1 and histogram.buckets[-1] == 1
+    assert histogram.count == 4
+
+def test_requests_outcomes_and_times():
+    m = Metrics()
+    m.begin()
+    m.operation('dw')
+    assert m.active['dw'] == 1 and m.connections == 1
+    m.lockWait(0.25)
+    m.outcome('ok', bytesOut=100)
+    m.transferred(bytesOut=20)
+    m.end()
+    # Una conexión que se cierra antes de la petición, y una operación de una sesión
+    m.begin()
+    m.end()
+    m.request('ls', 'ok')
+    # Sin petición actual no se registra nada
+    m.outcome('ok', bytesIn=5)
+
+    values = samples(m.render(Server()))
+    assert values['ftp_connections'] == 0 and values['ftp_active_requests{op="dw"}'] == 0
+    assert values['ftp_requests_total{op="dw",outcome="ok"}'] == 1
+    assert values['ftp_requests_total{op="none",outcome="closed"}'] == 1
+    assert values['ftp_requests_total{op="ls",outcome="ok"}'] == 1
+    assert values['ftp_bytes_total{direction="out"}'] == 120 and values['ftp_bytes_total{direction="in"}'] == 0
+    assert values['ftp_lock_wait_seconds_sum{op="dw"}'] == 0.25
+    assert values['ftp_lock_wait_seconds_bucket{op="dw",le="0.1"}'] == 0
+    assert values['ftp_lock_wait_seconds_bucket{op="dw",le="0.5"}'] == 1
+    assert values['ftp_request_seconds_count{op="dw"}'] == 1
+    assert values['ftp_request_seconds_bucket{op="dw",le="+Inf"}'] == 1
+    assert values['ftp_cache_events_total{event="hits"}'] == 0
+
+def test_http_endpoint():
+    m = Metrics()
+    http = m.serve(Server(), '127.0.0.1', 0)
+    try:
+        url = f'http://127.0.0.1:{http.server_address[1]}'
+        with urllib.request.urlopen(url + '/metrics', timeout=5) as response:
+            assert response.headers['Content-Type'].startswith('text/plain')
+            assert 'ftp_requests_total' in response.read().decode()
+        with pytest.raises(urllib.error.HTTPError) as error:
+            urllib.request.urlopen(url + '/other', timeout=5)
+        assert error.value.code == 404
+    finally:
+        http.shutdown()
+        http.server_close()
+
+# Espera a que el servidor registre el fin de las peticiones (después de la respuesta)
+def waitCounted(key, expected):
+    deadline = time.monotonic() + 5
+    while metrics.requests[key] < expected:
+        assert time.monotonic() < deadline, f'{key} not counted'
+        time.sleep(0.01)
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_server_counts_operations(serve, engine):
+    server = serve(engine)
+    client = FTPClient('127.0.0.1', server.PORT, 5, verify=False)
+    uploads, downloads = metrics.requests['up', 'ok'], metrics.requests['dw', 'not_found']
+    before = dict(metrics.bytes)
+    client.upload('a.bin', b'x' * 1000)
+    waitCounted(('up', 'ok'), uploads + 1)
+    with pytest.raises(NotFound): client.download('missing.bin')
+    waitCounted(('dw', 'not_found'), downloads + 1)
+    assert metrics.bytes['in'] - before.get('in', 0) >= 1000
+    assert 'ftp_requests_total{op="up",outcome="ok"}' in samples(metrics.render(server))
@@ -0,0 +1,83 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import pytest
+from os.path import join, relpath
+from Migrate import migrate, ownerName, HOLDING
+from Layout import FlatLayout, ShardedLayout
+
+# Archivos del servidor (con un nombre de subdirectorio de sharded) y los temporales
+# que se conservan: un upload reanudable y uno por partes
+FILES = ['a.txt', 'ab', 'ff', 'ñ.bin'] + [f'f{i:03}.dat' for i in range(50)]
+KEPT = ['.a.txt.partial', '.f001.dat.00000000000000aa.multipart', '.f001.dat.00000000000000aa.ranges']
+
+@pytest.fixture
+def root(tmp_path):
+    root = str(tmp_path / 'recv')
+    os.mkdir(root)
+    for name in FILES + KEPT + ['.c.txt.x1y2.part']:
+        with open(join(root, name), 'w') as f: f.write(name)
+    return root
+
+# Archivos bajo root: ruta relativa -> contenido
+def tree(root):
+    files = {}
+    for directory, _, names in os.walk(root):
+        for name in names:
+            with open(join(directory, name)) as f: files[relpath(join(directory, name), root)] = f.read()
+    return files
+
+def test_owner_names():
+    assert ownerName('a.txt') == 'a.txt'
+    assert ownerName('.a.txt.partial') == 'a.txt'
+    assert ownerName('.a.b.00000000000000aa.multipart') == 'a.b'
+    assert ownerName('.a.b.00000000000000aa.ranges') == 'a.b'
+    assert ownerName('.a.txt.x1y2.part') is None
+
+def test_round_trip(root):
+    original = tree(root)
+    counts = migrate(root, 'sharded')
+    assert counts == {'moved': len(FILES) + len(KEPT), 'in_place': 0, 'conflicts': 0}
+
+    # Cada archivo, y sus temporales, en el subdirectorio de su nombre
+    sharded = ShardedLayout(root)
+    moved = tree(root)
+    for name in FILES + KEPT:
+        assert relpath(join(os.path.dirname(sharded.location(ownerName(name))), name), root) in moved
+    assert sorted(e.name for e in sharded.scan() if not e.name.startswith('.')) == sorted(FILES)
+    # Los temporales que no se conservan se dejan donde están (el servidor los elimina)
+    assert '.c.txt.x1y2.part' in moved
+
+    assert migrate(root, 'sharded')['moved'] == 0
+    counts = migrate(root, 'flat')
+    assert counts['moved'] == len(FILES) + len(KEPT) and counts['conflicts'] == 0
+    assert tree(root) == original
+    assert not os.path.exists(join(root, HOLDING))
+
+def test_dry_run_moves_nothing(root):
+    original = tree(root)
+    assert migrate(root, 'sharded', dryRun=True)['moved'] == len(FILES) + len(KEPT)
+    assert tree(root) == original
+
+def test_conflicts_are_reported_and_kept(root):
+    # El mismo nombre en las dos organizaciones
+    location = ShardedLayout(root).location('a.txt')
+    os.makedirs(os.path.dirname(location))
+    with open(location, 'w') as f: f.write('other')
+    counts = migrate(root, 'sharded')
+    assert counts['conflicts'] == 1
+    assert tree(root)['a.txt'] == 'a.txt'
+    with open(location) as f: assert f.read() == 'other'
+    assert sorted(e.name for e in FlatLayout(root).scan() if not e.name.startswith('.')) == ['a.txt']
@@ -0,0 +1,103 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import os
+import time
+import socket
+import hashlib
+import pytest
+from Protocol import STATUS_OK, STATUS_BAD_REQUEST, STATUS_NOT_FOUND, PART_REQUEST, PART_UPLOAD, PART_ASSEMBLE, MAX_PART_TOTAL
+from Protocol import packHeader, recvExact
+from FTPClient import FTPClient
+from StagedFile import Multipart, MULTIPART_EXPIRY, removeTemporaries
+from Layout import makeLayout
+
+ENGINES = ['threads', 'asyncio']
+
+# Envía una petición y regresa el status de la respuesta, y la conexión
+def request(server, data):
+    s = socket.create_connection(('127.0.0.1', server.PORT), 5)
+    s.sendall(data)
+    return recvExact(s, 3), s
+
+# Crea un upload de total bytes. Regresa (status, identificador)
+def create(server, name, total):
+    status, s = request(server, packHeader('pu', name) + PART_REQUEST.pack(0, 0, total))
+    with s:
+        return status, PART_UPLOAD.unpack(recvExact(s, PART_UPLOAD.size))[0] if status == STATUS_OK else None
+
+def part(server, name, upload, offset, data, total):
+    status, s = request(server, packHeader('pu', name, len(data)) + PART_REQUEST.pack(upload, offset, total) + data)
+    s.close()
+    return status
+
+def assemble(server, name, upload, total, digest):
+    status, s = request(server, packHeader('pc', name, total) + PART_ASSEMBLE.pack(upload, digest))
+    s.close()
+    return status
+
+# Temporales de ./recv
+def temporaries():
+    return sorted(n for n in os.listdir('recv') if n.startswith('.'))
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_parts_are_assembled_in_any_order(serve, engine):
+    server = serve(engine)
+    data = os.urandom(100000)
+    status, upload = create(server, 'a.bin', len(data))
+    assert status == STATUS_OK
+    assert part(server, 'a.bin', upload, 60000, data[60000:], len(data)) == STATUS_OK
+    assert part(server, 'a.bin', upload, 0, data[:60000], len(data)) == STATUS_OK
+    assert assemble(server, 'a.bin', upload, len(data), hashlib.sha256(data).digest()) == STATUS_OK
+    assert FTPClient('127.0.0.1', server.PORT).download('a.bin') == data
+    assert temporaries() == []
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_invalid_uploads_are_not_created(serve, engine):
+    server = serve(engine)
+    assert create(server, 'a.bin', MAX_PART_TOTAL + 1) == (STATUS_BAD_REQUEST, None)
+    assert create(server, 'a.bin', 1 << 63) == (STATUS_BAD_REQUEST, None)
+    assert temporaries() == []
+    assert part(server, 'a.bin', 12345, 0, b'x', 10) == STATUS_NOT_FOUND
+
+def test_upload_that_cannot_be_reserved_is_rejected(serve, monkeypatch):
+    server = serve()
+    def ftruncate(fd, length): raise OSError(28, 'No space left on device')
+    monkeypatch.setattr(os, 'ftruncate', ftruncate)
+    assert create(server, 'a.bin', 1000) == (STATUS_BAD_REQUEST, None)
+    assert temporaries() == []
+
+def test_create_leaves_no_temporaries_on_error(tmp_path):
+    with pytest.raises(OSError):
+        Multipart.create(str(tmp_path / 'a.bin'), (1 << 63) - 1)
+    assert os.listdir(tmp_path) == []
+
+@pytest.mark.parametrize('layout', ['flat', 'sharded'])
+def test_abandoned_uploads_are_removed_at_startup(tmp_path, layout):
+    layout = makeLayout(layout, str(tmp_path))
+    recent = Multipart.create(layout.path('a.bin'), 10)
+    old = Multipart.create(layout.path('a.bin'), 10)
+    assembled = Multipart.create(layout.path('b.bin'), 10)
+    os.remove(assembled.tempname)
+    before = time.time() - MULTIPART_EXPIRY - 60
+    for name in (old.tempname, old.rangesname):
+        os.utime(name, (before, before))
+    for name in ('.c.bin.partial', '.d.bin.x1y2.part'):
+        with open(layout.path(name), 'wb') as f: f.write(b'x')
+
+    # Se conservan el upload reciente y el reanudable
+    assert removeTemporaries(layout.scan()) == 4
+    assert sorted(e.name for e in layout.scan()) == sorted(
+        ['.c.bin.partial', os.path.basename(recent.tempname), os.path.basename(recent.rangesname)])
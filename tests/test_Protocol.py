@@ -0,0 +1,151 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import io
+import os
+import time
+import errno
+import socket
+import hashlib
+import threading
+import pytest
+from Protocol import HEADER, packHeader, sendHeader, recvHeader, recvExact, sendFile
+from FTPClient import FTPClient
+
+# Envía data por un extremo de un socketpair en trozos de step bytes (en un hilo), y
+# regresa el otro extremo
+def trickle(data, step=1, delay=0):
+    a, b = socket.socketpair()
+    def send():
+        with a:
+            try:
+                for i in range(0, len(data), step):
+                    a.sendall(data[i:i + step])
+                    if delay: time.sleep(delay)
+            except BrokenPipeError:
+                pass # El receptor dejó de esperar
+    threading.Thread(target=send, daemon=True).start()
+    return b
+
+def test_header_survives_fragmentation():
+    with trickle(packHeader('up', 'ñame.txt', 1 << 40) + b'data') as conn:
+        assert recvHeader(conn, 5) == ('up', 'ñame.txt', 1 << 40)
+        # Después del encabezado la conexión vuelve a ser bloqueante
+        assert conn.gettimeout() is None
+        assert recvExact(conn, 4) == b'data'
+
+def test_header_without_name():
+    with trickle(packHeader('ls')) as conn:
+        assert recvHeader(conn) == ('ls', '', 0)
+
+def test_closed_connection_and_deadline():
+    with trickle(packHeader('up', 'a')[:HEADER.size - 1]) as conn:
+        with pytest.raises(ConnectionError):
+            recvHeader(conn)
+    # Un encabezado que llega muy lento no detiene al servidor más de timeout
+    with trickle(packHeader('up', 'a.txt'), 1, 0.2) as conn:
+        start = time.monotonic()
+        with pytest.raises(socket.timeout):
+            recvHeader(conn, 0.3)
+        assert time.monotonic() - start < 1
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_transfers_end_with_their_length(serve, engine):
+    server = serve(engine)
+    client = FTPClient('127.0.0.1', server.PORT, 5, verify=False)
+    # Sin framing, el receptor solo sabía que terminó la transferencia al vencer el
+    # timeout del socket
+    start = time.monotonic()
+    for size in (0, 1, 4096, 1 << 20):
+        data = bytes(range(256)) * (size // 256) + b'x' * (size % 256)
+        assert client.upload(f'{size}.bin', data) == size
+        assert client.download(f'{size}.bin') == data
+    assert time.monotonic() - start < 3
+
+def test_unknown_operation_closes_the_connection(serve):
+    server = serve()
+    with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+        sendHeader(s, 'zz', 'a.txt')
+        assert s.recv(1) == b''
+
+# Envía con send(conn) por un extremo de un socketpair (en un hilo) y regresa todo lo
+# recibido en el otro, y la excepción de send (o None)
+def received(send):
+    a, b = socket.socketpair()
+    error = []
+    def run():
+        with a:
+            try:
+                send(a)
+            except Exception as e:
+                error.append(e)
+    thread = threading.Thread(target=run)
+    thread.start()
+    with b:
+        data = b''.join(iter(lambda: b.recv(1 << 16), b''))
+    thread.join()
+    return data, error[0] if error else None
+
+@pytest.fixture
+def source(tmp_path):
+    data = os.urandom(3 << 20)
+    path = tmp_path / 'source.bin'
+    path.write_bytes(data)
+    with open(path, 'rb') as f:
+        yield f, data
+
+# os.sendfile que registra sus llamadas, o que falla con error
+def fakeSendfile(monkeypatch, error=None, after=0):
+    calls = []
+    real = os.sendfile
+    def sendfile(outfd, infd, offset, count):
+        calls.append(offset)
+        if error and len(calls) > after: raise OSError(error, os.strerror(error))
+        return real(outfd, infd, offset, min(count, 1 << 16))
+    monkeypatch.setattr(os, 'sendfile', sendfile)
+    return calls
+
+def test_sendfile_sends_the_range(source, monkeypatch):
+    f, data = source
+    calls = fakeSendfile(monkeypatch)
+    assert received(lambda conn: sendFile(conn, f, 1 << 20, 12345)) == (data[12345:12345 + (1 << 20)], None)
+    assert calls and calls[0] == 12345
+
+def test_fallback_when_sendfile_is_not_supported(source, monkeypatch):
+    f, data = source
+    calls = fakeSendfile(monkeypatch, errno.EINVAL)
+    assert received(lambda conn: sendFile(conn, f, len(data) - 7, 7)) == (data[7:], None)
+    assert len(calls) == 1
+    # Objetos sin descriptor de archivo
+    assert received(lambda conn: sendFile(conn, io.BytesIO(data), 100, 5)) == (data[5:105], None)
+
+def test_no_fallback_after_a_partial_send(source, monkeypatch):
+    f, data = source
+    fakeSendfile(monkeypatch, errno.EINVAL, after=2)
+    sent, error = received(lambda conn: sendFile(conn, f, len(data)))
+    # Recurrir a sendall repetiría o saltaría bytes
+    assert isinstance(error, OSError) and sent == data[:len(sent)] and len(sent) < len(data)
+
+def test_digest_is_computed_while_sending(source, monkeypatch):
+    f, data = source
+    calls = fakeSendfile(monkeypatch)
+    digest = hashlib.sha256()
+    assert received(lambda conn: sendFile(conn, f, 1000, 10, digest)) == (data[10:1010], None)
+    assert digest.digest() == hashlib.sha256(data[10:1010]).digest() and calls == []
+
+def test_sendfile_on_a_short_file(source):
+    f, data = source
+    sent, error = received(lambda conn: sendFile(conn, f, 100, len(data) - 10))
+    assert isinstance(error, EOFError) and sent == data[-10:]
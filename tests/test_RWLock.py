@@ -0,0 +1,183 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import time
+import asyncio
+import threading
+from RWLock import RWLock, AsyncRWLock, LockStats
+
+TIMEOUT = 5 # Segundos
+
+# Espera (sin bloquear para siempre) a que se cumpla condition()
+def waitUntil(condition):
+    deadline = time.monotonic() + TIMEOUT
+    while not condition():
+        assert time.monotonic() < deadline, 'timed out'
+        time.sleep(0.001)
+
+# Ejecuta acquire / release del modo indicado en un hilo, registrando en order el
+# nombre del hilo al adquirir el semáforo. El hilo libera el semáforo cuando se
+# activa su evento
+def start(lock, mode, name, order):
+    done = threading.Event()
+    def run():
+        getattr(lock, f'acquire{mode}')()
+        order.append(name)
+        done.wait(TIMEOUT)
+        getattr(lock, f'release{mode}')()
+    thread = threading.Thread(target=run)
+    thread.start()
+    return thread, done
+
+def test_readers_share_the_lock():
+    stats = LockStats()
+    lock, order = RWLock(stats), []
+    threads = [start(lock, 'Read', f'r{i}', order) for i in range(3)]
+    waitUntil(lambda: len(order) == 3)
+    assert stats.snapshot()['read']['holding'] == 3
+    for thread, done in threads:
+        done.set()
+        thread.join()
+
+def test_writer_is_not_starved_by_later_readers():
+    stats = LockStats()
+    lock, order = RWLock(stats), []
+    r1 = start(lock, 'Read', 'r1', order)
+    waitUntil(lambda: order == ['r1'])
+    w = start(lock, 'Write', 'w', order)
+    waitUntil(lambda: stats.snapshot()['write']['waiting'] == 1)
+    # Los lectores que llegan después del escritor esperan aunque el semáforo solo
+    # tenga lectores
+    r2 = start(lock, 'Read', 'r2', order)
+    waitUntil(lambda: stats.snapshot()['read']['waiting'] == 1)
+    time.sleep(0.05)
+    assert order == ['r1']
+
+    r1[1].set()
+    waitUntil(lambda: order == ['r1', 'w'])
+    time.sleep(0.05)
+    assert order == ['r1', 'w']
+    w[1].set()
+    waitUntil(lambda: order == ['r1', 'w', 'r2'])
+    r2[1].set()
+    for thread, _ in (r1, w, r2): thread.join()
+
+def test_turns_are_served_in_arrival_order():
+    stats = LockStats()
+    lock, order = RWLock(stats), []
+    holder = start(lock, 'Write', 'w0', order)
+    waitUntil(lambda: order == ['w0'])
+    waiting = []
+    for i, mode in enumerate(('Write', 'Read', 'Write', 'Read'), 1):
+        waiting.append(start(lock, mode, f'{mode[0].lower()}{i}', order))
+        waitUntil(lambda: sum(s['waiting'] for s in stats.snapshot().values()) == i)
+    # Cada turno entra solo, pues un escritor separa a los lectores
+    holder[1].set()
+    for entered, (thread, done) in enumerate(waiting, 2):
+        waitUntil(lambda: len(order) == entered)
+        done.set()
+        thread.join()
+    holder[0].join()
+    assert order == ['w0', 'w1', 'r2', 'w3', 'r4']
+
+# AsyncRWLock
+
+# Versión de start para corrutinas
+def startTask(lock, mode, name, order):
+    done = asyncio.Event()
+    async def run():
+        await getattr(lock, f'acquire{mode}')()
+        order.append(name)
+        await done.wait()
+        await getattr(lock, f'release{mode}')()
+    return asyncio.create_task(run()), done
+
+async def settle():
+    for _ in range(10): await asyncio.sleep(0)
+
+def test_async_writer_is_not_starved_by_later_readers():
+    async def scenario():
+        lock, order = AsyncRWLock(), []
+        r1 = startTask(lock, 'Read', 'r1', order)
+        await settle()
+        w = startTask(lock, 'Write', 'w', order)
+        await settle()
+        r2 = startTask(lock, 'Read', 'r2', order)
+        await settle()
+        assert order == ['r1']
+        r1[1].set()
+        await settle()
+        assert order == ['r1', 'w']
+        w[1].set()
+        await settle()
+        assert order == ['r1', 'w', 'r2']
+        r2[1].set()
+        await asyncio.gather(r1[0], w[0], r2[0])
+    asyncio.run(scenario())
+
+def test_async_cancelled_waiter_gives_up_its_turn():
+    async def scenario():
+        lock, order = AsyncRWLock(LockStats()), []
+        holder = startTask(lock, 'Write', 'w0', order)
+        await settle()
+        cancelled = startTask(lock, 'Write', 'w1', order)
+        reader = startTask(lock, 'Read', 'r2', order)
+        await settle()
+        cancelled[0].cancel()
+        await settle()
+        holder[1].set()
+        await settle()
+        assert order == ['w0', 'r2']
+        assert lock.stats.snapshot()['write']['waiting'] == 0
+        reader[1].set()
+        await asyncio.gather(holder[0], reader[0])
+    asyncio.run(scenario())
+
+# Semáforo entre procesos de prueba: lockRead / lockWrite esperan a que se active
+# release (como F_OFD_SETLKW mientras otro proceso tiene el lock)
+class BlockingShared:
+    def __init__(self):
+        self.release = threading.Event()
+        self.calls = []
+
+    def lockRead(self):
+        self.calls.append('read')
+        self.release.wait(TIMEOUT)
+
+    def lockWrite(self):
+        self.calls.append('write')
+        self.release.wait(TIMEOUT)
+
+    def unlock(self):
+        self.calls.append('unlock')
+
+def test_process_lock_is_taken_outside_the_condition():
+    shared = BlockingShared()
+    lock, order = RWLock(shared=shared), []
+    first = start(lock, 'Read', 'r1', order)
+    waitUntil(lambda: shared.calls == ['read'])
+    # Mientras el primer lector espera al otro proceso, la condición está libre y los
+    # demás lectores del proceso esperan su lock en lugar de pedir otro
+    assert lock.cond.acquire(timeout=TIMEOUT)
+    lock.cond.release()
+    second = start(lock, 'Read', 'r2', order)
+    time.sleep(0.05)
+    assert order == [] and shared.calls == ['read']
+
+    shared.release.set()
+    waitUntil(lambda: sorted(order) == ['r1', 'r2'])
+    for thread, done in (first, second):
+        done.set()
+        thread.join()
+    assert shared.calls == ['read', 'unlock']
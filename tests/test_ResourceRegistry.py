@@ -0,0 +1,79 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import time
+import threading
+from ResourceRegistry import ResourceRegistry
+from FTPClient import FTPClient
+
+# Recurso de prueba
+class Resource:
+    def __init__(self, filename):
+        self.filename = filename
+
+def test_same_resource_while_referenced():
+    created = []
+    registry = ResourceRegistry(lambda name: created.append(name) or Resource(name))
+    first = registry.acquire('a')
+    assert registry.acquire('a') is first and registry.acquire('b') is not first
+    assert created == ['a', 'b'] and len(registry) == 2
+
+    assert registry.release(first)
+    assert registry.acquire('a') is first
+    assert registry.release(first) and registry.release(first)
+    # Sin referencias la entrada se elimina, y el siguiente acquire crea otro recurso
+    assert len(registry) == 1
+    assert registry.acquire('a') is not first
+    assert created == ['a', 'b', 'a']
+
+def test_release_of_a_stale_resource_is_ignored():
+    registry = ResourceRegistry(Resource)
+    old = registry.acquire('a')
+    registry.release(old)
+    current = registry.acquire('a')
+    # Una referencia de más al recurso anterior no libera al actual
+    assert not registry.release(old)
+    assert registry.acquire('a') is current and len(registry) == 1
+
+def test_concurrent_acquire_and_release():
+    registry = ResourceRegistry(Resource, stripes=4)
+    names = [f'f{i}' for i in range(20)]
+    seen = {name: set() for name in names}
+    held = {name: registry.acquire(name) for name in names} # Una referencia durante toda la prueba
+    def work():
+        for _ in range(200):
+            for name in names:
+                resource = registry.acquire(name)
+                seen[name].add(id(resource))
+                registry.release(resource)
+    threads = [threading.Thread(target=work) for _ in range(8)]
+    for thread in threads: thread.start()
+    for thread in threads: thread.join()
+    assert all(ids == {id(held[name])} for name, ids in seen.items())
+    for resource in held.values(): registry.release(resource)
+    assert len(registry) == 0
+
+def test_server_drops_resources_after_each_operation(serve):
+    server = serve()
+    client = FTPClient('127.0.0.1', server.PORT, 5)
+    for i in range(20):
+        client.upload(f'{i}.txt', b'x')
+        client.download(f'{i}.txt')
+    client.delete('0.txt')
+    # Cada operación libera su referencia poco después de responder
+    deadline = time.monotonic() + 5
+    while len(server.resources):
+        assert time.monotonic() < deadline, 'resources still registered'
+        time.sleep(0.01)
@@ -0,0 +1,94 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import time
+import socket
+import pytest
+from Protocol import BUSY, STATUS_OK, RESUME_OFFSET, packHeader, recvExact
+from FTPClient import FTPClient
+
+ENGINES = ['threads', 'asyncio']
+
+# Espera a que el servidor suelte los recursos (después de perder una conexión)
+def waitReleased(server):
+    deadline = time.monotonic() + 5
+    while len(server.resources):
+        assert time.monotonic() < deadline, 'resources still registered'
+        time.sleep(0.01)
+
+# Inicia un upload reanudable de size bytes. Regresa la conexión y el offset que
+# indica el servidor
+def resume(server, name, size):
+    s = socket.create_connection(('127.0.0.1', server.PORT), 5)
+    s.sendall(packHeader('ru', name, size))
+    reply = recvExact(s, 1)
+    if reply == BUSY:
+        s.close()
+        return None, None
+    assert reply == b'y'
+    return s, RESUME_OFFSET.unpack(recvExact(s, RESUME_OFFSET.size))[0]
+
+@pytest.mark.parametrize('engine', ENGINES)
+@pytest.mark.parametrize('verify', [True, False])
+def test_ranges(serve, engine, verify):
+    server = serve(engine)
+    data = os.urandom(300000)
+    client = FTPClient('127.0.0.1', server.PORT, 5, verify)
+    client.upload('a.bin', data)
+    assert client.download('a.bin', offset=1000, count=5000) == data[1000:6000]
+    assert client.download('a.bin', offset=299000) == data[299000:]
+    assert client.download('a.bin', count=10) == data[:10]
+    # El rango se recorta al final del archivo
+    assert client.download('a.bin', offset=299990, count=100) == data[299990:]
+    assert client.download('a.bin', offset=400000) == b''
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_interrupted_upload_is_resumed(serve, engine):
+    server = serve(engine)
+    data = os.urandom(200000)
+    s, offset = resume(server, 'a.bin', len(data))
+    assert offset == 0
+    s.sendall(data[:80000])
+    s.close()
+    waitReleased(server)
+    assert not os.path.exists('recv/a.bin')
+
+    # El segundo intento continúa donde terminó el primero
+    s, offset = resume(server, 'a.bin', len(data))
+    with s:
+        assert offset == 80000
+        s.sendall(data[offset:])
+        assert recvExact(s, 3) == STATUS_OK
+    with open('recv/a.bin', 'rb') as f: assert f.read() == data
+    waitReleased(server)
+    assert not [n for n in os.listdir('recv') if n.startswith('.')]
+
+@pytest.mark.parametrize('engine', ENGINES)
+def test_resume_rules(serve, engine):
+    server = serve(engine)
+    s, offset = resume(server, 'a.bin', 1000)
+    s.sendall(b'x' * 600)
+    # Mientras continúa, otro cliente no puede subir el mismo archivo
+    assert resume(server, 'a.bin', 1000) == (None, None)
+    s.close()
+    waitReleased(server)
+
+    # Un tamaño menor que lo recibido empieza de nuevo
+    s, offset = resume(server, 'a.bin', 100)
+    with s:
+        assert offset == 0
+        s.sendall(b'y' * 100)
+        assert recvExact(s, 3) == STATUS_OK
+    with open('recv/a.bin', 'rb') as f: assert f.read() == b'y' * 100
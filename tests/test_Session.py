@@ -0,0 +1,77 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import socket
+import hashlib
+from Protocol import STATUS_OK, STATUS_BAD_REQUEST, STATUS_NOT_FOUND, RANGE_REQUEST, SESSION_REPLACE, CHECKSUM_REPLY
+from Protocol import packHeader, packRange, recvExact, packSessionRequest, recvSessionResponse
+
+# Inicia una sesión con el servidor
+def session(server):
+    s = socket.create_connection(('127.0.0.1', server.PORT), 5)
+    s.sendall(packHeader('ss'))
+    assert s.recv(1) == b'y'
+    return s
+
+# Respuesta de la siguiente petición: (tag, op, status, datos)
+def response(s):
+    tag, op, status, length = recvSessionResponse(s)
+    return tag, op, status, recvExact(s, length)
+
+def test_pipelined_requests_are_answered_in_order(serve):
+    server = serve()
+    with session(server) as s:
+        s.sendall(packSessionRequest(1, 'up', 'a.txt', 5, SESSION_REPLACE) + b'hello'
+                  + packSessionRequest(2, 'dw', 'a.txt')
+                  + packSessionRequest(3, 'dw', 'a.txt', RANGE_REQUEST.size) + packRange(1, 3)
+                  + packSessionRequest(4, 'dl', 'a.txt')
+                  + packSessionRequest(5, 'dw', 'a.txt'))
+        assert [response(s) for _ in range(5)] == [
+            (1, 'up', STATUS_OK, b''),
+            (2, 'dw', STATUS_OK, b'hello'),
+            (3, 'dw', STATUS_OK, b'ell'),
+            (4, 'dl', STATUS_OK, b''),
+            (5, 'dw', STATUS_NOT_FOUND, b'')]
+
+def test_unexpected_data_is_discarded(serve):
+    server = serve()
+    with session(server) as s:
+        # Un delete con datos, y una descarga con compresión y verificación (no
+        # admitidas en una sesión): se rechazan sin ejecutarse, y sus datos no se
+        # confunden con la siguiente petición
+        options = packRange(0, 0, ['zlib'], 1)
+        s.sendall(packSessionRequest(1, 'up', 'a.txt', 3) + b'abc'
+                  + packSessionRequest(2, 'dl', 'a.txt', 4) + b'junk'
+                  + packSessionRequest(3, 'dw', 'a.txt', len(options)) + options
+                  + packSessionRequest(4, 'dw', 'a.txt'))
+        assert [response(s) for _ in range(4)] == [
+            (1, 'up', STATUS_OK, b''),
+            (2, 'dl', STATUS_BAD_REQUEST, b''),
+            (3, 'dw', STATUS_BAD_REQUEST, b''),
+            (4, 'dw', STATUS_OK, b'abc')]
+
+def test_checksum_after_a_request_with_data(serve):
+    server = serve()
+    with session(server) as s:
+        s.sendall(packSessionRequest(1, 'up', 'a.txt', 3) + b'abc'
+                  + packSessionRequest(2, 'ck', 'a.txt', 4) + b'junk'
+                  + packSessionRequest(3, 'ck', 'a.txt')
+                  + packSessionRequest(4, 'ck', 'b.txt'))
+        assert response(s)[2] == STATUS_OK
+        assert response(s) == (2, 'ck', STATUS_BAD_REQUEST, b'')
+        tag, op, status, data = response(s)
+        size, mtime, digest = CHECKSUM_REPLY.unpack(data)
+        assert (tag, status, size, digest) == (3, STATUS_OK, 3, hashlib.sha256(b'abc').digest())
+        assert response(s) == (4, 'ck', STATUS_NOT_FOUND, b'')
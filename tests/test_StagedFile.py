@@ -0,0 +1,84 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import os
+import stat
+import socket
+import hashlib
+import pytest
+from StagedFile import StagedFile, FILE_MODE, PARTIAL_SUFFIX, isTemporary
+from Protocol import STATUS_OK, packHeader
+from FTPClient import FTPClient
+
+@pytest.fixture
+def target(tmp_path):
+    target = tmp_path / 'a.txt'
+    target.write_bytes(b'old')
+    return str(target)
+
+def test_previous_version_stays_until_commit(target):
+    staged = StagedFile(target, hashing=True)
+    try:
+        staged.write(b'new ')
+        staged.write(b'content')
+        with open(target, 'rb') as f: assert f.read() == b'old'
+        assert isTemporary(os.path.basename(staged.tempname))
+        staged.finish()
+        st = staged.commit()
+    finally:
+        staged.discard()
+    with open(target, 'rb') as f: assert f.read() == b'new content'
+    assert st.st_size == len(b'new content') and stat.S_IMODE(st.st_mode) == FILE_MODE
+    assert staged.digest.digest() == hashlib.sha256(b'new content').digest()
+    assert os.listdir(os.path.dirname(target)) == ['a.txt']
+
+def test_discard_leaves_the_previous_version(target):
+    staged = StagedFile(target)
+    staged.write(b'partial')
+    staged.discard()
+    with open(target, 'rb') as f: assert f.read() == b'old'
+    assert os.listdir(os.path.dirname(target)) == ['a.txt']
+
+def test_resumable_temporary_is_kept(target):
+    staged = StagedFile(target, size=10)
+    staged.write(b'12345')
+    staged.discard()
+    # El siguiente intento continúa al final de lo recibido, y sin hashing
+    staged = StagedFile(target, size=10, hashing=True)
+    assert staged.offset == 5 and staged.digest is None
+    staged.write(b'67890')
+    staged.finish()
+    staged.commit()
+    staged.discard()
+    with open(target, 'rb') as f: assert f.read() == b'1234567890'
+    # Un temporal más grande que el archivo es de otra versión y se descarta
+    tempname = os.path.join(os.path.dirname(target), '.a.txt' + PARTIAL_SUFFIX)
+    with open(tempname, 'wb') as f: f.write(b'x' * 20)
+    assert StagedFile(target, size=10).offset == 0
+
+def test_downloads_see_the_previous_version_during_an_upload(serve):
+    server = serve()
+    client = FTPClient('127.0.0.1', server.PORT, 5, verify=False)
+    client.upload('a.txt', b'old')
+    with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+        s.sendall(packHeader('up', 'a.txt', 6))
+        assert s.recv(1) == b'y'
+        s.sendall(b'y' + b'new')
+        # A la mitad del upload
+        assert client.download('a.txt') == b'old'
+        s.sendall(b'new')
+        assert s.recv(3) == STATUS_OK
+    assert client.download('a.txt') == b'newnew'
+    assert not [n for n in os.listdir('recv') if n.startswith('.')]
@@ -0,0 +1,114 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+import os
+import socket
+import hashlib
+import pytest
+from Storage import BlobStorage
+from StagedFile import StagedFile
+from Layout import makeLayout
+from Protocol import STATUS_OK, STATUS_NOT_FOUND, STATUS_EXISTS, HAVE_REQUEST, HAVE_REPLACE, packHeader, recvExact
+from FTPClient import FTPClient
+
+@pytest.fixture(params=['flat', 'sharded'])
+def layout(request, tmp_path):
+    return makeLayout(request.param, str(tmp_path))
+
+# Publica data con el nombre name, como un upload
+def publish(storage, layout, name, data):
+    staged = StagedFile(layout.path(name), hashing=True)
+    staged.write(data)
+    staged.finish()
+    try:
+        return storage.publish(staged, layout.path(name))
+    finally:
+        staged.discard()
+
+def blobs(storage):
+    return sorted(name for _, _, names in os.walk(storage.blobs) for name in names)
+
+def links(storage, data):
+    return os.stat(storage.blobName(hashlib.sha256(data).hexdigest())).st_nlink
+
+def test_same_content_is_stored_once(layout):
+    storage = BlobStorage(layout)
+    publish(storage, layout, 'a.bin', b'shared')
+    publish(storage, layout, 'b.bin', b'shared')
+    assert blobs(storage) == [hashlib.sha256(b'shared').hexdigest()]
+    # Un enlace por nombre, más el del blob
+    assert links(storage, b'shared') == 3
+    assert os.path.samefile(layout.path('a.bin'), layout.path('b.bin'))
+    assert storage.stats() == {'backend': 'blobs', 'names': 2, 'blobs': 1}
+
+    # El blob se conserva mientras algún nombre lo utilice
+    storage.remove(layout.path('a.bin'))
+    assert links(storage, b'shared') == 2
+    publish(storage, layout, 'b.bin', b'other')
+    assert blobs(storage) == [hashlib.sha256(b'other').hexdigest()]
+    with open(layout.path('b.bin'), 'rb') as f: assert f.read() == b'other'
+    storage.remove(layout.path('b.bin'))
+    assert blobs(storage) == [] and storage.stats()['names'] == 0
+
+def test_link_existing_content(layout):
+    storage = BlobStorage(layout)
+    publish(storage, layout, 'a.bin', b'content')
+    digest = hashlib.sha256(b'content').digest()
+    assert storage.has(digest) and not storage.has(hashlib.sha256(b'x').digest())
+    assert storage.link(layout.path('c.bin'), hashlib.sha256(b'x').digest()) is None
+    assert storage.link(layout.path('c.bin'), digest).st_size == len(b'content')
+    assert links(storage, b'content') == 3
+    # Volver a enlazar el mismo nombre no cambia el contador
+    storage.link(layout.path('c.bin'), digest)
+    assert links(storage, b'content') == 3
+
+def test_reconcile_rebuilds_the_names(layout):
+    storage = BlobStorage(layout)
+    publish(storage, layout, 'a.bin', b'a')
+    publish(storage, layout, 'b.bin', b'a')
+    publish(storage, layout, 'c.bin', b'c')
+    # Un archivo anterior a la deduplicación y un blob sin nombres
+    with open(layout.path('plain.bin'), 'wb') as f: f.write(b'plain')
+    os.remove(layout.path('c.bin'))
+
+    reopened = BlobStorage(layout)
+    assert reopened.names == {'a.bin': hashlib.sha256(b'a').hexdigest(), 'b.bin': hashlib.sha256(b'a').hexdigest()}
+    assert blobs(reopened) == [hashlib.sha256(b'a').hexdigest()]
+    # Los archivos que no son enlaces a un blob se eliminan sin tocar los blobs
+    reopened.remove(layout.path('plain.bin'))
+    assert links(reopened, b'a') == 3
+
+# Petición hv. Regresa el status de la respuesta
+def have(server, name, data, flags=0):
+    with socket.create_connection(('127.0.0.1', server.PORT), 5) as s:
+        s.sendall(packHeader('hv', name, HAVE_REQUEST.size) + HAVE_REQUEST.pack(hashlib.sha256(data).digest(), flags))
+        return recvExact(s, 3)
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_have_publishes_without_data(serve, engine):
+    server = serve(engine, dedup=True)
+    client = FTPClient('127.0.0.1', server.PORT, 5)
+    data = os.urandom(10000)
+    client.upload('a.bin', data)
+    assert have(server, 'b.bin', os.urandom(10)) == STATUS_NOT_FOUND
+    assert have(server, 'b.bin', data) == STATUS_OK
+    assert client.download('b.bin') == data
+    assert have(server, 'b.bin', data) == STATUS_EXISTS
+    assert have(server, 'b.bin', data, HAVE_REPLACE) == STATUS_OK
+    assert server.storage.stats() == {'backend': 'blobs', 'names': 2, 'blobs': 1}
+
+    client.delete('a.bin')
+    client.delete('b.bin')
+    assert server.storage.stats()['names'] == 0
+    assert have(server, 'c.bin', data) == STATUS_NOT_FOUND
@@ -0,0 +1,103 @@
+# Benemérita Universidad Autónoma de Puebla
+# Facultad de Ciencias de la Computación
+# Programación Concurrente y Paralela
+#
+# Proyecto Final: Sistemas concurrentes, programación de un
+# servidor FTP simple con gestión multiusuario concurrente.
+#
+# Arizmendi Ramírez Esiel Kevin, 201737811
+# Coria Rios Marco Antonio, 201734576
+# Ruiz Lozano Paulo César, 201727952
+#
+# Otoño 2020
+# 27/Noviembre/2020
+
+
+import time
+import socket
+import threading
+import pytest
+from WorkerPool import WorkerPool
+from Protocol import BUSY, STATUS_OK, packHeader, recvExact
+from FTPClient import FTPClient, ServerBusy
+
+TIMEOUT = 5 # Segundos
+
+def test_full_queue_rejects_tasks():
+    pool = WorkerPool(1, 1)
+    started, release = threading.Event(), threading.Event()
+    def block():
+        started.set()
+        release.wait(TIMEOUT)
+    assert pool.submit(block)
+    assert started.wait(TIMEOUT)
+    done = threading.Event()
+    # El hilo está ocupado: la siguiente tarea espera en la cola, y la cola está llena
+    assert pool.submit(done.set)
+    assert not pool.submit(done.set)
+    assert pool.stats() == {'workers': 1, 'active': 1, 'queued': 1, 'queueSize': 1, 'rejected': 1}
+    release.set()
+    assert done.wait(TIMEOUT)
+
+def test_failing_task_keeps_the_worker():
+    pool = WorkerPool(1, 2)
+    done = threading.Event()
+    assert pool.submit(lambda: 1 / 0)
+    assert pool.submit(done.set)
+    assert done.wait(TIMEOUT)
+
+# Espera a que el servidor termine las operaciones en curso (el lugar de una operación
+# se libera poco después de enviar su respuesta)
+def waitIdle(server):
+    def busy():
+        if not hasattr(server, 'pool'): return any(server.activeOps.values())
+        stats = server.pool.stats()
+        return stats['active'] or stats['queued']
+    deadline = time.monotonic() + TIMEOUT
+    while busy():
+        assert time.monotonic() < deadline, 'server still busy'
+        time.sleep(0.01)
+
+# Inicia un upload de size bytes sin enviar sus datos: la operación queda en curso
+def pendingUpload(server, name, size=10):
+    s = socket.create_connection(('127.0.0.1', server.PORT), TIMEOUT)
+    s.sendall(packHeader('up', name, size))
+    assert s.recv(1) == b'n'
+    return s
+
+@pytest.mark.parametrize('engine', ['threads', 'asyncio'])
+def test_operation_limit_replies_busy(serve, engine):
+    server = serve(engine, opLimits={'up': 1})
+    client = FTPClient('127.0.0.1', server.PORT, TIMEOUT, verify=False)
+    client.upload('a.txt', b'a')
+    waitIdle(server)
+    first = pendingUpload(server, 'b.txt')
+    with pytest.raises(ServerBusy):
+        client.upload('c.txt', b'c')
+    # Las demás operaciones no tienen límite
+    assert client.download('a.txt') == b'a'
+    first.sendall(b'x' * 10)
+    assert first.recv(3) == STATUS_OK
+    first.close()
+    # Al terminar la operación se libera su lugar
+    waitIdle(server)
+    assert client.upload('c.txt', b'c') == 1
+    assert server.stats()['rejected']['up'] == 1
+
+def test_full_queue_replies_busy_without_reading_the_request(serve):
+    server = serve(workers=1, queueSize=1)
+    # La conexión con la que serve() espera al servidor ya terminó
+    waitIdle(server)
+    first = pendingUpload(server, 'a.txt')
+    # Espera en la cola sin ocupar un hilo
+    queued = socket.create_connection(('127.0.0.1', server.PORT), TIMEOUT)
+    with socket.create_connection(('127.0.0.1', server.PORT), TIMEOUT) as rejected:
+        assert rejected.recv(1) == BUSY
+        assert rejected.recv(1) == b''
+    assert server.pool.stats()['rejected'] == 1
+    first.sendall(b'x' * 10)
+    assert first.recv(3) == STATUS_OK
+    queued.sendall(packHeader('dw', 'a.txt'))
+    assert recvExact(queued, 1) == b'y'
+    first.close()
+    queued.close()